@@ -0,0 +1,304 @@
+"""
+Drives the app in-process through WebTest and reports the p50/p95/p99 latency
+and the requests per second of each of its endpoints: the languages, concepts,
+and words datatables (the html pages and the json of their ajax requests), the
+detail pages, the maps, the downloads, and the search and distances views.
+
+The app is built from development.ini, minus the debug toolbar, against an
+SQLite db that is populated by initializedb's main from the test fixtures
+(with made-up words of two more doculects) or, with --scale, from the
+synthetic datasets of the import_throughput benchmark. The downloads are
+rendered on each request unless static/downloads holds precomputed ones.
+
+Usage: python benchmarks/http_latency.py [--requests 50] [--concurrency 1] [--scale 1]
+       [--setting northeuralex.response_cache.backend=memory] [--output results.json]
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import math
+import os.path
+import platform
+import tempfile
+import time
+
+from urllib.parse import urlencode
+
+import transaction
+
+from clld.db.meta import Base, DBSession
+
+from pyramid.paster import get_appsettings
+
+from sqlalchemy import create_engine
+
+from webtest import TestApp
+
+import northeuralex
+from northeuralex.models import Concept, Doculect, Word
+from northeuralex.scripts.initializedb import ConceptDataset, main
+
+from import_throughput import get_commit, write_datasets
+
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, '..', 'northeuralex', 'tests', 'fixtures')
+
+INI_PATH = os.path.join(BENCHMARKS_DIR, '..', 'development.ini')
+
+XHR_HEADERS = {'X-Requested-With': 'XMLHttpRequest'}
+
+DATATABLE_PARAMS = 'sEcho=1&iDisplayStart=0&iDisplayLength=100'
+
+
+
+"""
+Database
+"""
+
+def write_fixture_datasets(directory):
+    """
+    Writes the fixture datasets into the given dir: the main dataset is
+    limited to the fixture concepts and, so that the maps and distances have
+    more than one doculect to show, the words of Finnish and North Karelian
+    are made up from the Irish ones. Returns the argparse.Namespace with the
+    paths, as expected by initializedb's main.
+    """
+    concept_ids = set(concept.id for concept in ConceptDataset(
+        os.path.join(FIXTURES_DIR, 'concept_data.tsv')).gen_concepts())
+
+    with open(os.path.join(FIXTURES_DIR, 'main_data.tsv'), encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    rows = [line.split('\t') for line in lines[1:]
+            if line and line.split('\t')[2] in concept_ids]
+
+    for iso_code, glotto_code in [('fin', 'finn1318'), ('krl', 'kare1335')]:
+        rows += [[iso_code, glotto_code, row[2], row[3][::-1]] + row[4:]
+                for row in rows if row[0] == 'gle']
+
+    args = argparse.Namespace(
+            main_data=os.path.join(directory, 'main_data.tsv'),
+            lang_data=os.path.join(FIXTURES_DIR, 'lang_data.tsv'),
+            concept_data=os.path.join(FIXTURES_DIR, 'concept_data.tsv'),
+            sources_data=os.path.join(directory, 'sources.bib'))
+
+    with open(args.main_data, 'w', encoding='utf-8') as f:
+        f.write('\r\n'.join([lines[0]] + ['\t'.join(row) for row in rows]) + '\r\n')
+
+    with open(args.sources_data, 'w', encoding='utf-8') as f:
+        f.write('@book{gle_source, author={Author}, title={Title}, year={2000}}\n')
+
+    return args
+
+
+
+def build_db(directory, scale=0):
+    """
+    Creates and populates the SQLite db in the given dir, from the fixtures
+    or, if scale is set, from the synthetic datasets. Returns the db's url.
+    """
+    if scale:
+        args, _ = write_datasets(directory, scale)
+    else:
+        args = write_fixture_datasets(directory)
+
+    url = 'sqlite:///' + os.path.join(directory, 'db.sqlite')
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+
+    DBSession.remove()
+    DBSession.configure(bind=engine)
+
+    with transaction.manager:
+        main(argparse.Namespace(bulk=True,
+            log=logging.getLogger('http_latency'), **vars(args)))
+
+    DBSession.remove()
+
+    return url
+
+
+
+def make_app(db_url, overrides={}):
+    """
+    Returns the webtest.TestApp wrapping the app built from development.ini,
+    with the db url and the given settings replacing the ini's ones. The debug
+    toolbar and the reloading of templates are turned off.
+    """
+    settings = get_appsettings(INI_PATH, name='main')
+    settings.update({
+        'sqlalchemy.url': db_url,
+        'pyramid.includes': 'pyramid_tm',
+        'pyramid.reload_templates': 'false'})
+    settings.update(overrides)
+
+    return TestApp(northeuralex.main({}, **settings))
+
+
+
+"""
+Endpoints
+"""
+
+def get_endpoints():
+    """
+    Returns the list of the (name, path, headers) tuples of the endpoints to
+    benchmark, the ids in the paths being looked up in the db.
+    """
+    word = DBSession.query(Word).order_by(Word.pk).first()
+    language = DBSession.query(Doculect).get(word.language_pk)
+    concept = DBSession.query(Concept).get(word.parameter_pk)
+
+    ids = {
+        'language': language.id,
+        'parameter': concept.id,
+        'valueset': word.valueset.id,
+        'value': word.id,
+        'doculects': ','.join(row[0] for row in DBSession.query(Doculect.id)
+            .filter(Doculect.pk.in_(DBSession.query(Word.language_pk).distinct()))
+            .order_by(Doculect.id).limit(3))}
+
+    words_query = urlencode({'q': word.raw_ipa[:3]})
+    concepts_query = urlencode({'q': concept.english_name[:3]})
+
+    DBSession.remove()
+
+    endpoints = [
+        ('home', '/', {}),
+
+        ('languages', '/languages', {}),
+        ('languages xhr', '/languages?' + DATATABLE_PARAMS, XHR_HEADERS),
+        ('parameters', '/parameters', {}),
+        ('parameters xhr', '/parameters?' + DATATABLE_PARAMS, XHR_HEADERS),
+        ('values', '/values', {}),
+        ('values xhr', '/values?' + DATATABLE_PARAMS, XHR_HEADERS),
+        ('values xhr language', '/values?language={}&{}'.format(
+            ids['language'], DATATABLE_PARAMS), XHR_HEADERS),
+        ('values xhr parameter', '/values?parameter={}&{}'.format(
+            ids['parameter'], DATATABLE_PARAMS), XHR_HEADERS),
+
+        ('language', '/languages/{}'.format(ids['language']), {}),
+        ('parameter', '/parameters/{}'.format(ids['parameter']), {}),
+        ('valueset', '/valuesets/{}'.format(ids['valueset']), {}),
+        ('value', '/values/{}'.format(ids['value']), {}),
+
+        ('languages map', '/languages.geojson', {}),
+        ('parameter map', '/parameters/{}.geojson'.format(ids['parameter']), {}),
+
+        ('search words', '/search/words?' + words_query, {}),
+        ('search concepts', '/search/concepts?' + concepts_query, {}),
+        ('distances', '/distances?languages={}'.format(ids['doculects']), {})]
+
+    for name in ['languages', 'parameters', 'values']:
+        for extension in ['csv', 'xls', 'json', 'ndjson']:
+            endpoints.append(('{}.{}'.format(name, extension),
+                '/{}.{}'.format(name, extension), {}))
+
+    return endpoints
+
+
+
+"""
+Timings
+"""
+
+def percentile(sorted_values, percent):
+    """
+    Returns the nearest-rank percentile of the given sorted values.
+    """
+    index = max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+
+def run_endpoint(app, path, headers, num_requests, concurrency=1, warmup=2):
+    """
+    Sends the given number of GET requests to the given path, spread over the
+    given number of threads, after a few untimed ones. Returns the dict of the
+    results: the latency percentiles in ms, the requests per second, the
+    response size, and the statuses other than 200.
+    """
+    for _ in range(warmup):
+        app.get(path, headers=headers, expect_errors=True)
+
+    def timed_get(_):
+        start = time.perf_counter()
+        res = app.get(path, headers=headers, expect_errors=True)
+        return time.perf_counter() - start, res.status_int, len(res.body)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed_get, range(num_requests)))
+    total = time.perf_counter() - start
+
+    latencies = sorted(result[0] * 1000 for result in results)
+
+    return {
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'rps': num_requests / total,
+        'bytes': results[-1][2],
+        'errors': sorted(set(result[1] for result in results if result[1] != 200))}
+
+
+
+def main_cli(args):
+    """
+    Builds the db and the app, runs the endpoints, prints a table of the
+    results, and writes these along with the commit hash into a json file.
+    """
+    overrides = dict(setting.split('=', 1) for setting in args.setting)
+
+    results = {
+        'commit': get_commit(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'scale': args.scale,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'settings': overrides,
+        'results': {}}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = make_app(build_db(temp_dir, args.scale), overrides)
+
+        print('{:<24} {:>9} {:>9} {:>9} {:>8} {:>10}'.format(
+            'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'rps', 'bytes'))
+
+        for name, path, headers in get_endpoints():
+            result = run_endpoint(app, path, headers, args.requests, args.concurrency)
+            results['results'][name] = dict(result, path=path)
+
+            print('{:<24} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {rps:>8.1f} {bytes:>10}{}'.format(
+                name, ' status {}'.format(result['errors']) if result['errors'] else '',
+                **result))
+
+        DBSession.remove()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--requests', type=int, default=50,
+            help='the number of timed requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=1,
+            help='the number of threads sending the requests')
+    parser.add_argument('--scale', type=int, default=0,
+            help='use the synthetic datasets of this multiple of the NorthEuraLex '
+            'size instead of the fixtures')
+    parser.add_argument('--setting', action='append', default=[],
+            help='an app setting as key=value, replacing the ini\'s one')
+    parser.add_argument('--output', default='http_latency.json',
+            help='the json file to write the results into')
+
+    main_cli(parser.parse_args())
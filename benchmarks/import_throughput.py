@@ -0,0 +1,264 @@
+"""
+Times the parsing of the dataset files, the add_* helpers of initializedb,
+and its full main func against SQLite, on synthetic datasets of 1×, 10×, and
+100× the size of NorthEuraLex, and writes the timings as json so that the
+import throughput can be compared between commits.
+
+The synthetic datasets have the real number of concepts and scale×107
+languages with one or two words per concept. The ORM-based add_words is only
+timed up to --orm-max-scale as it gets very slow beyond that.
+
+Usage: python benchmarks/import_throughput.py [--scales 1,10,100] [--output results.json]
+"""
+import argparse
+import datetime
+import json
+import logging
+import os.path
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import transaction
+
+from clld.db.meta import Base, DBSession
+
+from sqlalchemy import create_engine
+
+from northeuralex.scripts.initializedb import (
+        ConceptDataset, LangDataset, MainDataset,
+        add_concepts, add_doculects, add_words, bulk_add_words, main)
+
+
+
+NUM_LANGUAGES = 107
+
+NUM_CONCEPTS = 1016
+
+SEGMENTS = 'p b t d k g m n ŋ f v s z ʃ x h l r j w a e i o u æ ø y ɨ ə'.split()
+
+FAMILIES = ['Uralic', 'Indo-European', 'Turkic', 'Mongolic', 'Tungusic']
+
+
+
+"""
+Synthetic datasets
+"""
+
+def make_iso_code(index):
+    """
+    Returns the index-th of the three-letter codes aaa, aab, ..., zzz.
+    """
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return letters[index // 676 % 26] + letters[index // 26 % 26] + letters[index % 26]
+
+
+
+def write_tsv(path, header, rows):
+    """
+    Writes the given header and rows into a tsv file at the given path.
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\t'.join(header) + '\n')
+        for row in rows:
+            f.write('\t'.join(map(str, row)) + '\n')
+
+
+
+def write_datasets(directory, scale, seed=42):
+    """
+    Writes main_data.tsv, lang_data.tsv, concept_data.tsv, and sources.bib of
+    the given scale into the given dir. Returns an argparse.Namespace with the
+    paths, as expected by initializedb's main, and the number of words.
+    """
+    rand = random.Random(seed)
+
+    iso_codes = [make_iso_code(index) for index in range(NUM_LANGUAGES * scale)]
+    concept_ids = ['Konzept{}::N'.format(index) for index in range(NUM_CONCEPTS)]
+
+    write_tsv(os.path.join(directory, 'concept_data.tsv'), [
+        'number', 'position_in_ranking', 'ranking_value', 'id_nelex',
+        'gloss_en', 'gloss_ru', 'annotation_de', 'annotation_en', 'annotation_ru',
+        'concepticon', 'concepticon_id', 'concepticon_proposed', 'comments'], [
+        [index + 1, index + 1, '0', concept_id, 'gloss {}'.format(index),
+            'глосса {}'.format(index), '[]', '[]', '[]', 'CONCEPT {}'.format(index),
+            index + 1, 'CONCEPT_{}'.format(index), '']
+        for index, concept_id in enumerate(concept_ids)])
+
+    write_tsv(os.path.join(directory, 'lang_data.tsv'), [
+        'name', 'glotto_code', 'iso_code', 'family', 'subfamily',
+        'latitude', 'longitude'], [
+        ['Language {}'.format(iso_code), iso_code + '1234', iso_code,
+            rand.choice(FAMILIES), '', round(rand.uniform(40, 75), 2),
+            round(rand.uniform(0, 180), 2)]
+        for iso_code in iso_codes])
+
+    num_words = 0
+
+    def gen_words():
+        nonlocal num_words
+        for iso_code in iso_codes:
+            for concept_id in concept_ids:
+                for _ in range(1 if rand.random() < 0.8 else 2):
+                    segments = [rand.choice(SEGMENTS) for _ in range(rand.randint(2, 9))]
+                    num_words += 1
+                    yield [iso_code, iso_code + '1234', concept_id,
+                        ''.join(segments) + str(num_words), ''.join(segments),
+                        ' '.join(segments), '', '', '', 'validate']
+
+    write_tsv(os.path.join(directory, 'main_data.tsv'), [
+        'Language_ID', 'Glottocode', 'Concept_ID', 'Word_Form', 'rawIPA', 'IPA',
+        'ASJP', 'List', 'Dolgo', 'Next_Step'], gen_words())
+
+    with open(os.path.join(directory, 'sources.bib'), 'w', encoding='utf-8') as f:
+        for iso_code in iso_codes[:NUM_LANGUAGES]:
+            f.write('@book{{{0}_source, author={{Author}}, title={{{0}}}, '
+                    'year={{2000}}}}\n'.format(iso_code))
+
+    args = argparse.Namespace(
+            main_data=os.path.join(directory, 'main_data.tsv'),
+            lang_data=os.path.join(directory, 'lang_data.tsv'),
+            concept_data=os.path.join(directory, 'concept_data.tsv'),
+            sources_data=os.path.join(directory, 'sources.bib'))
+
+    return args, num_words
+
+
+
+"""
+Timings
+"""
+
+def timed(timings, name, func, *args):
+    """
+    Calls the given func with the given args, stores the seconds it took under
+    the given name, and returns its result.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    timings[name] = time.perf_counter() - start
+
+    return result
+
+
+
+def fresh_db(directory, name):
+    """
+    Creates an SQLite db with the app's schema in the given dir and binds the
+    session to it.
+    """
+    engine = create_engine('sqlite:///' + os.path.join(directory, name + '.sqlite'))
+    Base.metadata.create_all(engine)
+
+    DBSession.remove()
+    DBSession.configure(bind=engine)
+
+
+
+def run_scale(scale, orm_max_scale=1):
+    """
+    Returns the dict of the results for the given scale.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        timings = {}
+        args, num_words = timed(timings, 'generate', write_datasets, temp_dir, scale)
+
+        timed(timings, 'gen_langs', lambda: sum(1 for _ in
+            LangDataset(args.lang_data).gen_langs()))
+        timed(timings, 'gen_concepts', lambda: sum(1 for _ in
+            ConceptDataset(args.concept_data).gen_concepts()))
+        timed(timings, 'gen_words', lambda: sum(1 for _ in
+            MainDataset(args.main_data).gen_words()))
+
+        fresh_db(temp_dir, 'bulk')
+        with transaction.manager:
+            concepts = timed(timings, 'add_concepts', add_concepts,
+                    ConceptDataset(args.concept_data), DBSession)
+            doculects = timed(timings, 'add_doculects', add_doculects,
+                    LangDataset(args.lang_data), DBSession)
+            timed(timings, 'bulk_add_words', bulk_add_words,
+                    MainDataset(args.main_data), DBSession, concepts, doculects)
+
+        if scale <= orm_max_scale:
+            fresh_db(temp_dir, 'orm')
+            with transaction.manager:
+                concepts = add_concepts(ConceptDataset(args.concept_data), DBSession)
+                doculects = add_doculects(LangDataset(args.lang_data), DBSession)
+                timed(timings, 'add_words', lambda: (add_words(
+                    MainDataset(args.main_data), DBSession, concepts, doculects),
+                    DBSession.flush()))
+
+        for bulk in [False, True]:
+            if bulk or scale <= orm_max_scale:
+                fresh_db(temp_dir, 'main_bulk' if bulk else 'main')
+                main_args = argparse.Namespace(bulk=bulk,
+                        log=logging.getLogger('import_throughput'), **vars(args))
+                with transaction.manager:
+                    timed(timings, 'main_bulk' if bulk else 'main', main, main_args)
+
+        DBSession.remove()
+
+    word_timings = ['gen_words', 'bulk_add_words', 'add_words', 'main', 'main_bulk']
+
+    return {
+        'scale': scale,
+        'languages': NUM_LANGUAGES * scale,
+        'concepts': NUM_CONCEPTS,
+        'words': num_words,
+        'seconds': timings,
+        'words_per_second': {name: num_words / timings[name]
+            for name in word_timings if timings.get(name)}}
+
+
+
+def get_commit():
+    """
+    Returns the hash of the checked out git commit or None.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def main_cli(scales, output, orm_max_scale):
+    """
+    Runs the benchmarks for the given scales, prints the timings, and writes
+    these along with the commit hash into the given json file.
+    """
+    results = {
+        'commit': get_commit(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'results': []}
+
+    for scale in scales:
+        results['results'].append(run_scale(scale, orm_max_scale))
+
+        result = results['results'][-1]
+        print('{}×: {} words'.format(scale, result['words']))
+        for name, seconds in result['seconds'].items():
+            print('  {}: {:.2f}s'.format(name, seconds))
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--scales', default='1,10,100',
+            help='comma-separated multiples of the NorthEuraLex size')
+    parser.add_argument('--output', default='import_throughput.json',
+            help='the json file to write the results into')
+    parser.add_argument('--orm-max-scale', type=int, default=1,
+            help='the largest scale to time the ORM-based add_words at')
+
+    args = parser.parse_args()
+    main_cli([int(scale) for scale in args.scales.split(',')],
+            args.output, args.orm_max_scale)
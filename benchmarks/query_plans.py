@@ -0,0 +1,166 @@
+"""
+Shows the query plans and timings of the hot lookups of the data tables, the
+download adapters, and the importer, before and after the indexes and the
+denormalised word columns added to the models.
+
+The db is an SQLite file populated from the given dataset files (by default,
+the test fixtures). The "before" state is simulated by dropping the indexes
+declared in northeuralex.models and querying the words via the valueset table.
+
+Usage: python benchmarks/query_plans.py [main_data lang_data concept_data]
+"""
+import argparse
+import os.path
+import statistics
+import tempfile
+import time
+
+import transaction
+
+from clld.db.meta import Base, DBSession
+
+from sqlalchemy import create_engine
+
+from northeuralex.scripts.initializedb import (
+        ConceptDataset, LangDataset, MainDataset,
+        add_concepts, add_doculects, bulk_add_words)
+
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__),
+        '..', 'northeuralex', 'tests', 'fixtures')
+
+
+"""
+The (name, before, after) triples of the benchmarked queries. The params are
+filled in from the first word in the db.
+"""
+QUERIES = [
+    ('words of a language',
+        'SELECT word.pk FROM word JOIN value ON value.pk = word.pk '
+        'JOIN valueset ON valueset.pk = value.valueset_pk '
+        'WHERE valueset.language_pk = :language_pk',
+        'SELECT word.pk FROM word WHERE word.language_pk = :language_pk'),
+    ('words of a concept',
+        'SELECT word.pk FROM word JOIN value ON value.pk = word.pk '
+        'JOIN valueset ON valueset.pk = value.valueset_pk '
+        'WHERE valueset.parameter_pk = :parameter_pk',
+        'SELECT word.pk FROM word WHERE word.parameter_pk = :parameter_pk'),
+    ('words by next step',
+        'SELECT word.pk FROM word WHERE word.next_step = :next_step',
+        None),
+    ('synset of a language and a concept',
+        'SELECT valueset.pk FROM valueset '
+        'WHERE valueset.language_pk = :language_pk '
+        'AND valueset.parameter_pk = :parameter_pk',
+        None),
+    ('doculect by iso code',
+        'SELECT doculect.pk FROM doculect WHERE doculect.iso_code = :iso_code',
+        None),
+    ('doculects of a family',
+        'SELECT doculect.pk FROM doculect WHERE doculect.family = :family',
+        None),
+    ('doculects of a subfamily',
+        'SELECT doculect.pk FROM doculect WHERE doculect.subfamily = :subfamily',
+        None),
+    ('concept by concepticon id',
+        'SELECT concept.pk FROM concept '
+        'WHERE concept.concepticon_id = :concepticon_id',
+        None) ]
+
+
+
+def populate(engine, main_data, lang_data, concept_data):
+    """
+    Creates the schema and imports the given datasets, skipping the words of
+    concepts or languages that are not in the respective dataset.
+    """
+    Base.metadata.create_all(engine)
+    DBSession.configure(bind=engine)
+
+    with transaction.manager:
+        concepts = add_concepts(ConceptDataset(concept_data), DBSession)
+        doculects = add_doculects(LangDataset(lang_data), DBSession)
+
+        words = [word for word in MainDataset(main_data).gen_words()
+                if word.concept in concepts and word.iso_code in doculects]
+        bulk_add_words(argparse.Namespace(gen_words=lambda: iter(words)),
+                DBSession, concepts, doculects)
+
+
+
+def get_params(conn):
+    """
+    Returns the query params, taken from the first word in the db.
+    """
+    row = conn.execute(
+        'SELECT word.language_pk, word.parameter_pk, word.next_step, '
+        'doculect.iso_code, doculect.family, doculect.subfamily, '
+        'concept.concepticon_id FROM word '
+        'JOIN doculect ON doculect.pk = word.language_pk '
+        'JOIN concept ON concept.pk = word.parameter_pk '
+        'ORDER BY word.pk LIMIT 1').fetchone()
+
+    return dict(zip(['language_pk', 'parameter_pk', 'next_step',
+        'iso_code', 'family', 'subfamily', 'concepticon_id'], row))
+
+
+
+def explain(conn, query, params, repeat=20):
+    """
+    Returns the query plan of the given query as a list of strings and the
+    median time of running it in ms.
+    """
+    plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        timings.append(time.perf_counter() - start)
+
+    return plan, statistics.median(timings) * 1000
+
+
+
+def main(main_data, lang_data, concept_data):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        engine = create_engine('sqlite:///' + os.path.join(temp_dir, 'db.sqlite'))
+        populate(engine, main_data, lang_data, concept_data)
+
+        indexes = [index for table in Base.metadata.sorted_tables
+                for index in table.indexes
+                if table.name in ('doculect', 'concept', 'word', 'valueset', 'value')
+                and index.name.startswith('ix_')]
+
+        with engine.connect() as conn:
+            params = get_params(conn)
+
+            for index in indexes:
+                index.drop(conn)
+            before = [explain(conn, query, params) for _, query, _ in QUERIES]
+
+            for index in indexes:
+                index.create(conn)
+            after = [explain(conn, new_query or query, params)
+                    for _, query, new_query in QUERIES]
+
+    for (name, _, _), (plan_before, ms_before), (plan_after, ms_after) \
+    in zip(QUERIES, before, after):
+        print(name)
+        print('  before ({:.3f} ms): {}'.format(ms_before, '; '.join(plan_before)))
+        print('  after  ({:.3f} ms): {}'.format(ms_after, '; '.join(plan_after)))
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('main_data', nargs='?',
+            default=os.path.join(FIXTURES_DIR, 'main_data.tsv'))
+    parser.add_argument('lang_data', nargs='?',
+            default=os.path.join(FIXTURES_DIR, 'lang_data.tsv'))
+    parser.add_argument('concept_data', nargs='?',
+            default=os.path.join(FIXTURES_DIR, 'concept_data.tsv'))
+
+    args = parser.parse_args()
+    main(args.main_data, args.lang_data, args.concept_data)
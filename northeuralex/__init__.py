@@ -1,8 +1,12 @@
 from pyramid.config import Configurator
 
+from clld.db.meta import DBSession
 from clld.interfaces import IMapMarker
 from clld.web.icon import ICON_MAP
 
+from northeuralex.cache import VersionedCache, get_data_version
+from northeuralex.db import SETTINGS_PREFIX as DB_SETTINGS_PREFIX, get_server_threads
+
 
 """
 Even if not used, these models should still be imported. The original comment:
@@ -55,6 +59,44 @@ FAMILY_ICONS = {
 
 
 
+"""
+Caches used by the get_map_marker hook. The icon URLs only depend on the
+family and the app's URL, so these are kept for the process' lifetime under
+a fixed version (the caches do not keep anything under a version of None). The
+synset families are looked up once per data version with a single query, so
+that the markers of a concept map do not lazy-load the synsets' doculects.
+"""
+ICON_URLS = VersionedCache(max_size=1000)
+
+SYNSET_FAMILIES = VersionedCache()
+
+
+
+def get_icon_url(family, req):
+    """
+    Returns the URL of the map marker icon for the given language family.
+    """
+    if family not in FAMILY_ICONS:
+        family = '_default'
+
+    return ICON_URLS.get('icons', (family, req.application_url),
+            lambda: FAMILY_ICONS[family].url(req))
+
+
+
+def get_synset_families(req):
+    """
+    Returns a dict mapping the primary keys of all the synsets to the language
+    families of their doculects.
+    """
+    return SYNSET_FAMILIES.get(get_data_version(req), 'families',
+            lambda: dict(DBSession.query(models.Synset.pk, models.Doculect.family)
+                .select_from(models.Synset)
+                .join(models.Doculect,
+                    models.Synset.language_pk == models.Doculect.pk)))
+
+
+
 def get_map_marker(item, req):
     """
     Hook called for each marker on each map. Determines the map marker for the
@@ -72,22 +114,35 @@ def get_map_marker(item, req):
     if isinstance(item, models.Doculect):
         family = item.family
     elif isinstance(item, models.Synset):
-        family = item.language.family
-
-    if family not in FAMILY_ICONS:
-        family = '_default'
+        family = get_synset_families(req).get(item.pk)
+        if family is None:
+            family = item.language.family
 
-    return FAMILY_ICONS[family].url(req)
+    return get_icon_url(family, req)
 
 
 
 def main(global_config, **settings):
     """
     Returns a Pyramid WSGI application. Apart from the clld boilerplate, it
-    orders the home sub-navigation and registers the get_map_marker hook.
+    orders the home sub-navigation, registers the get_map_marker hook, and
+    adds the db settings, the db snapshot, the request metrics, the response
+    cache, and the serving of pre-compressed static files (see the db,
+    snapshot, metrics, response_cache, and precompressed modules).
     """
+    settings.setdefault(DB_SETTINGS_PREFIX + 'server_threads',
+            get_server_threads(global_config.get('__file__')))
+
     config = Configurator(settings=settings)
     config.include('clld.web.app')
+    config.include('northeuralex.db')
+    config.include('northeuralex.snapshot')
+    config.include('northeuralex.metrics')
+    config.include('northeuralex.response_cache')
+    config.include('northeuralex.precompressed')
+    config.include('northeuralex.search')
+    config.include('northeuralex.glosses')
+    config.include('northeuralex.distances')
 
     config.registry.settings['home_comp'] = ['help', 'download', 'legal', 'contact']
 
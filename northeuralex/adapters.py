@@ -1,9 +1,48 @@
+import gzip
+import hashlib
+import io
+import itertools
 import json
+import os
 
-from clld.web.adapters import csv, excel, JsonIndex
+from urllib.parse import urlencode
+
+from clld.db.meta import DBSession
+from clld.web.adapters import csv, excel, geojson, Index, JsonIndex
 from clld import interfaces
 
 from clldutils.dsv import UnicodeWriter
+from clldutils.path import Path
+
+from pyramid.request import Request
+from pyramid.response import FileResponse, Response
+
+import transaction
+import xlwt
+
+from northeuralex import FAMILY_ICONS
+from northeuralex.cache import VersionedCache, get_data_version
+from northeuralex.columnar import encode_columns
+from northeuralex.datatables import apply_filters
+from northeuralex.db import start_export
+from northeuralex.metrics import timed_render
+from northeuralex.models import Concept, Doculect, Word
+from northeuralex.precompressed import choose_encoding, get_encoding_qvalue
+
+
+
+"""
+Query limits
+
+QUERY_LIMIT is the maximum number of rows in a download, as in clld's own
+adapters; YIELD_PER is the number of rows fetched from the db cursor at a time
+by the streaming adapters, which is also the number of rows per chunk sent to
+the client.
+"""
+
+QUERY_LIMIT = csv.QUERY_LIMIT
+
+YIELD_PER = 500
 
 
 
@@ -13,10 +52,15 @@ Mixin classes
 Each of these includes two methods: header and row. The former is invoked once
 per download while the latter is called once for each model instance. The idea
 is taken from clld.web.adapters.excel.
+
+A mixin can also provide a get_items method to replace the datatable's query,
+in which case row is called with whatever the replacement query yields.
 """
 
 class LanguagesMixin:
 
+    download_name = 'languages'
+
     def header(self, ctx, req):
         return ['name', 'glotto_code', 'iso_code',
                 'family', 'subfamily', 'latitude', 'longitude']
@@ -31,6 +75,8 @@ class LanguagesMixin:
 
 class ConceptsMixin:
 
+    download_name = 'parameters'
+
     def header(self, ctx, req):
         return ['id', 'name', 'english', 'german', 'russian',
                 'concepticon_id', 'concepticon_name']
@@ -43,31 +89,255 @@ class ConceptsMixin:
 
 
 class WordsMixin:
+    """
+    Instead of Word instances, the rows are plain tuples selected by a single
+    query joining the word table (via its language_pk and parameter_pk
+    columns) with the doculect and concept tables; thus, a download does not
+    fire any per-row lazy loads.
+    """
+
+    download_name = 'values'
 
     def header(self, ctx, req):
         return ['lang_iso_code', 'concept_id',
                 'ortho_form', 'raw_ipa', 'next_step']
 
     def row(self, ctx, req, word):
-        return [word.valueset.language.iso_code,
-                word.valueset.parameter.id,
-                word.name, word.raw_ipa, word.next_step]
+        return list(word)
+
+    def get_items(self, ctx, req):
+        query = DBSession.query(
+                    Doculect.iso_code, Concept.id,
+                    Word.name, Word.raw_ipa, Word.next_step) \
+                .select_from(Word) \
+                .join(Doculect, Word.language_pk == Doculect.pk) \
+                .join(Concept, Word.parameter_pk == Concept.pk) \
+                .filter(Word.active == True)
+
+        if getattr(ctx, 'language', None):
+            query = query.filter(Word.language_pk == ctx.language.pk)
+
+        if getattr(ctx, 'parameter', None):
+            query = query.filter(Word.parameter_pk == ctx.parameter.pk)
+
+        query, _ = apply_filters(ctx, req, query)
+
+        return query.order_by(Word.pk).limit(QUERY_LIMIT).yield_per(YIELD_PER)
+
+
+
+"""
+Streaming
+
+The streaming mixin replaces the render_to_response method of clld's adapters
+so that the download is sent to the client in chunks as the rows come off the
+db cursor instead of being rendered into one string first.
+"""
+
+class StreamingMixin:
+    """
+    Subclasses have to implement gen_chunks(ctx, req, items), a generator
+    yielding the bytes of the download of the given items.
+    """
+
+    def get_items(self, ctx, req):
+        """
+        Returns the query yielding the items to be serialised. Eager loading is
+        turned off as it does not work with yield_per; the mixins' row methods
+        lazy-load whatever they need.
+        """
+        return ctx.get_query(limit=QUERY_LIMIT) \
+                .enable_eagerloads(False).yield_per(YIELD_PER)
+
+    def render(self, ctx, req):
+        return b''.join(self.gen_chunks(ctx, req, self.get_items(ctx, req)))
+
+    def render_to_response(self, ctx, req):
+        """
+        The query is built here because the request's transaction (and thus
+        the session of any model instances that the datatable holds) is over
+        by the time the app_iter is consumed. Running the query afterwards
+        begins a new transaction, which zope.sqlalchemy joins to the thread's
+        transaction manager, i.e. pyramid_tm's, but which pyramid_tm never
+        ends; as a download only reads, that transaction is aborted once the
+        download is complete or the client has gone away, and the session is
+        removed. The export profile of the db module is applied to the
+        transaction. The render time recorded in the metrics is that of
+        sending the whole download.
+        """
+        items = self.get_items(ctx, req)
+
+        def gen_app_iter():
+            try:
+                with timed_render(self):
+                    yield from self.gen_chunks(ctx, req, start_export(items))
+            finally:
+                transaction.abort()
+                DBSession.remove()
+
+        return set_headers(self, Response(app_iter=gen_app_iter()), ctx)
+
+
+
+def set_headers(adapter, res, ctx):
+    """
+    Sets the headers that clld's Renderable.render_to_response would set on a
+    response for the given adapter and, unless the adapter's attachment flag
+    is unset, the content disposition that clld's csv and excel adapters add.
+    Returns the response.
+    """
+    res.vary = 'Accept'
+    res.content_type = str(adapter.send_mimetype or adapter.mimetype)
+
+    if adapter.charset:
+        res.charset = str(adapter.charset)
+
+    if adapter.content_type_params:
+        params = res.content_type_params
+        params.update({str(key): str(value)
+            for key, value in adapter.content_type_params.items()})
+        res.content_type_params = params
+
+    if getattr(adapter, 'attachment', True):
+        res.content_disposition = 'attachment; filename="{}.{}"'.format(
+                repr(ctx), adapter.extension)
+
+    return res
+
+
+
+"""
+Precomputed downloads
+
+The unfiltered downloads only change when the db is re-populated. Thus, these
+are rendered by initializedb's prime_cache step (see write_downloads below)
+into DOWNLOADS_DIR, together with a manifest listing the files' sha1 hashes.
+The precomputed mixin serves such a file, if there is one, along with the hash
+as ETag, so that clients sending If-None-Match get a 304; otherwise it falls
+back to rendering the download. If the client accepts it, the file's
+compressed sibling is served instead (see the precompressed module).
+"""
+
+DOWNLOADS_DIR = Path(__file__).parent.joinpath('static', 'downloads')
+
+MANIFEST_NAME = 'manifest.json'
+
+_json_files = {}
+
+
+def read_json_file(path):
+    """
+    Returns the parsed contents of the json file at the given path or None if
+    there is no such file. The file is only re-read when its mtime changes,
+    i.e. after initializedb has been run again.
+    """
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+
+    key = str(path)
+
+    if key not in _json_files or _json_files[key][0] != mtime:
+        with path.open(encoding='utf-8') as f:
+            _json_files[key] = (mtime, json.load(f))
+
+    return _json_files[key][1]
+
+
+
+def get_manifest():
+    """
+    Returns the dict mapping the names of the precomputed downloads to their
+    hashes; if there is no manifest, the dict is empty.
+    """
+    return read_json_file(DOWNLOADS_DIR.joinpath(MANIFEST_NAME)) or {}
+
+
+
+def is_unfiltered(ctx, req):
+    """
+    Checks whether the given datatable is neither constrained (e.g. to the
+    words of a language) nor filtered, sorted or paged via request params.
+    """
+    for model in getattr(ctx, '__constraints__', []):
+        if getattr(ctx, ctx.attr_from_constraint(model), None):
+            return False
+
+    for name, value in req.params.items():
+        if value and name.startswith(('sSearch', 'iSort', 'iDisplay')):
+            return False
+
+    return True
+
+
+
+class PrecomputedMixin:
+
+    def render_to_response(self, ctx, req):
+        filename = '{}.{}'.format(self.download_name, self.extension)
+        path = DOWNLOADS_DIR.joinpath(filename)
+
+        digest = get_manifest().get(filename) if is_unfiltered(ctx, req) else None
+
+        if digest is None or not path.exists():
+            return super().render_to_response(ctx, req)
+
+        encoding, served_path = choose_encoding(req, str(path))
+
+        res = set_headers(self, FileResponse(served_path, request=req), ctx)
+        res.content_encoding = encoding
+        res.vary = ('Accept', 'Accept-Encoding')
+        res.etag = '{}-{}'.format(digest, encoding) if encoding else digest
+
+        return res
 
 
 
 """
 excel adapters
+
+The base excel adapter only differs from clld's one in that it takes the items
+from get_items, thus allowing the mixins to replace the query, in that the
+query runs with the export profile of the db module, and in that its render
+time is recorded in the metrics.
 """
 
-class LanguagesExcelAdapter(LanguagesMixin, excel.ExcelAdapter):
+class ExcelAdapter(PrecomputedMixin, excel.ExcelAdapter):
+
+    def get_items(self, ctx, req):
+        return ctx.get_query(limit=QUERY_LIMIT)
+
+    def render(self, ctx, req):
+        with timed_render(self):
+            workbook = xlwt.Workbook()
+            sheet = workbook.add_sheet(ctx.__unicode__())
+
+            for col_index, col in enumerate(self.header(ctx, req)):
+                sheet.write(0, col_index, col)
+
+            items = start_export(self.get_items(ctx, req))
+
+            for row_index, item in enumerate(items, 1):
+                for col_index, col in enumerate(self.row(ctx, req, item)):
+                    sheet.write(row_index, col_index, col)
+
+            out = io.BytesIO()
+            workbook.save(out)
+
+        return out.getvalue()
+
+
+
+class LanguagesExcelAdapter(LanguagesMixin, ExcelAdapter):
     pass
 
 
-class ConceptsExcelAdapter(ConceptsMixin, excel.ExcelAdapter):
+class ConceptsExcelAdapter(ConceptsMixin, ExcelAdapter):
     pass
 
 
-class WordsExcelAdapter(WordsMixin, excel.ExcelAdapter):
+class WordsExcelAdapter(WordsMixin, ExcelAdapter):
     pass
 
 
@@ -77,19 +347,32 @@ csv adapters
 
 The base csv adapter overwrites clld's one in order to replace item.csv_head
 and item.to_csv calls with calls to the mixins defined above. In other words,
-it applies the logic of clld's base excel adapter.
+it applies the logic of clld's base excel adapter. The output is streamed, a
+chunk per YIELD_PER rows.
 """
 
-class CsvAdapter(csv.CsvAdapter):
+class CsvAdapter(PrecomputedMixin, StreamingMixin, csv.CsvAdapter):
 
-    def render(self, ctx, req):
+    def gen_chunks(self, ctx, req, items):
         with UnicodeWriter() as writer:
             writer.writerow(self.header(ctx, req))
+            yield self.flush(writer)
 
-            for item in ctx.get_query(limit=csv.QUERY_LIMIT):
+            for index, item in enumerate(items, 1):
                 writer.writerow(self.row(ctx, req, item))
+                if index % YIELD_PER == 0:
+                    yield self.flush(writer)
+
+            yield self.flush(writer)
 
-            return writer.read()
+    def flush(self, writer):
+        """
+        Returns the bytes written so far and empties the writer's buffer.
+        """
+        chunk = writer.read()
+        writer.f.seek(0)
+        writer.f.truncate()
+        return chunk
 
 
 
@@ -110,21 +393,58 @@ class WordsCsvAdapter(WordsMixin, CsvAdapter):
 json adapters
 
 The base json adapter replaces the default JsonIndex and applies the logic of
-clld's base excel adapter.
+clld's base excel adapter. The output is streamed: the opening of the rows list
+goes out first and then a chunk of row objects per YIELD_PER rows; the bytes
+are the same as those of json.dumps({'rows': rows}, ensure_ascii=False).
+
+The ndjson adapter is a variant that puts each row object on its own line
+instead, for consumers that process the download line by line.
 """
 
-class JsonAdapter(JsonIndex):
+class JsonAdapter(PrecomputedMixin, StreamingMixin, JsonIndex):
 
-    def render(self, ctx, req):
-        rows = []
+    attachment = False
 
+    def gen_chunks(self, ctx, req, items):
         header = self.header(ctx, req)
+        objects, separator = [], ''
+
+        yield b'{"rows": ['
+
+        for item in items:
+            objects.append(json.dumps(dict(zip(header, self.row(ctx, req, item))),
+                    ensure_ascii=False))
 
-        for item in ctx.get_query(limit=csv.QUERY_LIMIT):
-            rows.append({key: value
-                for key, value in zip(header, self.row(ctx, req, item))})
+            if len(objects) == YIELD_PER:
+                yield (separator + ', '.join(objects)).encode('utf-8')
+                objects, separator = [], ', '
 
-        return json.dumps({'rows': rows}, ensure_ascii=False)
+        if objects:
+            yield (separator + ', '.join(objects)).encode('utf-8')
+
+        yield b']}'
+
+
+
+class NdjsonAdapter(JsonAdapter):
+
+    name = 'NDJSON'
+    mimetype = 'application/x-ndjson'
+    extension = 'ndjson'
+
+    def gen_chunks(self, ctx, req, items):
+        header = self.header(ctx, req)
+        lines = []
+
+        for item in items:
+            lines.append(json.dumps(dict(zip(header, self.row(ctx, req, item))),
+                    ensure_ascii=False) + '\n')
+
+            if len(lines) == YIELD_PER:
+                yield ''.join(lines).encode('utf-8')
+                del lines[:]
+
+        yield ''.join(lines).encode('utf-8')
 
 
 
@@ -140,6 +460,341 @@ class WordsJsonAdapter(WordsMixin, JsonAdapter):
     pass
 
 
+class LanguagesNdjsonAdapter(LanguagesMixin, NdjsonAdapter):
+    pass
+
+
+class ConceptsNdjsonAdapter(ConceptsMixin, NdjsonAdapter):
+    pass
+
+
+class WordsNdjsonAdapter(WordsMixin, NdjsonAdapter):
+    pass
+
+
+
+"""
+columnar adapters
+
+The words are also offered in the binary format of the columnar module, for
+tools that load all of them at once: the iso codes and concept ids are
+dictionary-encoded into integer arrays and the other columns are string
+tables, so the file can be memory-mapped and used without parsing (see
+columnar.ColumnarFile). As the format's header holds the columns' sizes, the
+file is rendered as a whole rather than streamed.
+"""
+
+class ColumnarAdapter(PrecomputedMixin, Index):
+
+    name = 'columnar'
+    mimetype = 'application/x-northeuralex-columns'
+    extension = 'columns'
+
+    dictionary_columns = []
+
+    def get_items(self, ctx, req):
+        return ctx.get_query(limit=QUERY_LIMIT)
+
+    def render(self, ctx, req):
+        with timed_render(self):
+            items = start_export(self.get_items(ctx, req))
+
+            return encode_columns(self.header(ctx, req),
+                    (self.row(ctx, req, item) for item in items),
+                    self.dictionary_columns)
+
+
+
+class WordsColumnarAdapter(WordsMixin, ColumnarAdapter):
+
+    dictionary_columns = ['lang_iso_code', 'concept_id']
+
+
+
+"""
+Export
+
+Renders the precomputed downloads. ExportTable stands in for the unconstrained
+and unfiltered datatables, yielding the same items in the same order.
+"""
+
+class ExportTable:
+
+    __constraints__ = []
+
+    def __init__(self, model):
+        self.model = model
+        self.cols = []
+
+    def __unicode__(self):
+        return '{}s'.format(self.model.__name__)
+
+    def __repr__(self):
+        return '{}s'.format(self.model.__name__)
+
+    def get_query(self, limit=1000, offset=0):
+        return DBSession.query(self.model) \
+                .filter(self.model.active == True) \
+                .order_by(self.model.pk).limit(limit).offset(offset)
+
+
+
+EXPORTS = [
+    (Doculect, [LanguagesCsvAdapter, LanguagesExcelAdapter,
+                LanguagesJsonAdapter, LanguagesNdjsonAdapter]),
+    (Concept, [ConceptsCsvAdapter, ConceptsExcelAdapter,
+                ConceptsJsonAdapter, ConceptsNdjsonAdapter]),
+    (Word, [WordsCsvAdapter, WordsExcelAdapter,
+                WordsJsonAdapter, WordsNdjsonAdapter, WordsColumnarAdapter]) ]
+
+
+def write_downloads(downloads_dir=DOWNLOADS_DIR):
+    """
+    Renders the downloads of each of the EXPORTS adapters into the given dir
+    and writes the manifest. Each file is first written under a temporary name
+    and then moved into place so that a running app never serves a partial
+    file. Returns the dict that is written as manifest.
+    """
+    if not downloads_dir.exists():
+        downloads_dir.mkdir(parents=True)
+
+    req = Request.blank('/')
+    hashes = {}
+
+    for model, adapters in EXPORTS:
+        for adapter_cls in adapters:
+            adapter = adapter_cls(None)
+
+            content = adapter.render(ExportTable(model), req)
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+
+            filename = '{}.{}'.format(adapter.download_name, adapter.extension)
+            write_file(downloads_dir.joinpath(filename), content)
+
+            hashes[filename] = hashlib.sha1(content).hexdigest()
+
+    write_file(downloads_dir.joinpath(MANIFEST_NAME),
+            json.dumps(hashes, indent=4, sort_keys=True).encode('utf-8'))
+
+    return hashes
+
+
+def write_file(path, content):
+    """
+    Writes the given bytes to the given path via a temporary file.
+    """
+    temp_path = path.with_name(path.name + '.tmp')
+
+    with temp_path.open('wb') as f:
+        f.write(content)
+
+    os.replace(str(temp_path), str(path))
+
+
+
+"""
+GeoJSON adapters
+
+These replace clld's adapters for the map layers of the languages index and
+of the concepts. The features are built from plain column queries and are kept
+compact: the coordinates are rounded to COORD_DIGITS and the icon property
+holds the icon's name instead of its URL (project.js resolves the names).
+
+The gzip-compressed feature collections are kept in GEOJSON_CACHE until the
+data version changes. For the layers' default names, these are also written
+into GEOJSON_DIR by initializedb's prime_cache step (see write_geojson below),
+so that even the first request for a layer does not hit the db.
+"""
+
+GEOJSON_DIR = Path(__file__).parent.joinpath('static', 'geojson')
+
+GEOJSON_CACHE = VersionedCache(max_bytes=32*1024*1024)
+
+COORD_DIGITS = 4
+
+
+def make_feature(language_id, name, latitude, longitude, family, label=None):
+    """
+    Returns a GeoJSON feature dict with the properties that clld's map js
+    needs for placing a doculect's marker.
+    """
+    properties = {
+        'language': {'id': language_id, 'name': name},
+        'icon': FAMILY_ICONS.get(family, FAMILY_ICONS['_default']).name}
+
+    if label:
+        properties['label'] = label
+
+    return {
+        'type': 'Feature',
+        'id': language_id,
+        'geometry': {'type': 'Point', 'coordinates': [
+            round(longitude, COORD_DIGITS), round(latitude, COORD_DIGITS)]},
+        'properties': properties}
+
+
+
+def gzip_bytes(content):
+    """
+    Returns the given bytes gzip-compressed. The header's timestamp is zeroed
+    so that the same content always yields the same bytes.
+    """
+    out = io.BytesIO()
+
+    with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as f:
+        f.write(content)
+
+    return out.getvalue()
+
+
+
+class CachedGeoJsonMixin:
+    """
+    Subclasses have to implement:
+    - gen_features(ctx, req), a generator yielding the features' dicts;
+    - get_cache_name(ctx, req), which returns the path, relative to
+      GEOJSON_DIR and without the .gz suffix, of the file holding the ctx's
+      features; None if the request's features should not be cached (e.g.
+      because it is filtered);
+    - get_default_layer(ctx), which returns the name of the layer that
+      clld's map for the ctx requests.
+    """
+
+    attachment = False
+
+    def render(self, ctx, req):
+        return json.dumps({
+            'type': 'FeatureCollection',
+            'properties': self._featurecollection_properties(ctx, req),
+            'features': list(self.gen_features(ctx, req))},
+            ensure_ascii=False, separators=(',', ':'))
+
+    def get_gzipped(self, ctx, req, name):
+        """
+        Returns the gzipped feature collection for the given ctx, either from
+        the cache, from the precomputed file, or rendered.
+        """
+        version = get_data_version(req)
+        layer = req.params.get('layer', '')
+
+        def load():
+            path = GEOJSON_DIR.joinpath(name + '.gz')
+            manifest = read_json_file(GEOJSON_DIR.joinpath(MANIFEST_NAME)) or {}
+
+            if version is not None and manifest.get('data_version') == version \
+                    and layer == self.get_default_layer(ctx) and path.exists():
+                with path.open('rb') as f:
+                    return f.read()
+
+            return gzip_bytes(self.render(ctx, req).encode('utf-8'))
+
+        return GEOJSON_CACHE.get(version, (name, layer), load)
+
+    def render_to_response(self, ctx, req):
+        name = self.get_cache_name(ctx, req)
+        if name is None:
+            return super().render_to_response(ctx, req)
+
+        content = self.get_gzipped(ctx, req, name)
+
+        res = set_headers(self, Response(), ctx)
+        res.vary = ('Accept', 'Accept-Encoding')
+        res.cache_control = 'public, no-cache'
+
+        if get_encoding_qvalue(req, 'gzip') > 0:
+            res.body = content
+            res.content_encoding = 'gzip'
+            res.etag = hashlib.sha1(content).hexdigest() + '-gz'
+        else:
+            res.body = gzip.decompress(content)
+            res.etag = hashlib.sha1(content).hexdigest()
+
+        res.conditional_response = True
+
+        return res
+
+
+
+class GeoJsonDoculects(CachedGeoJsonMixin, geojson.GeoJsonLanguages):
+
+    def gen_features(self, ctx, req):
+        for doculect in ctx.get_query(limit=5000):
+            if doculect.latitude is not None and doculect.longitude is not None:
+                yield make_feature(doculect.id, doculect.name,
+                        doculect.latitude, doculect.longitude, doculect.family)
+
+    def get_cache_name(self, ctx, req):
+        return 'languages.geojson' if is_unfiltered(ctx, req) else None
+
+    def get_default_layer(self, ctx):
+        return 'id'
+
+
+
+class GeoJsonConcept(CachedGeoJsonMixin, geojson.GeoJsonParameter):
+
+    def featurecollection_properties(self, ctx, req):
+        """
+        Concepts have no domain elements, so there is no need to look these
+        up as the base class would.
+        """
+        return {'name': ctx.name, 'domain': []}
+
+    def gen_features(self, ctx, req):
+        """
+        Yields one feature per synset, labelled with the synset's words.
+        """
+        query = DBSession.query(Word.valueset_pk, Doculect.id, Doculect.name,
+                    Doculect.latitude, Doculect.longitude, Doculect.family, Word.name) \
+                .select_from(Word) \
+                .join(Doculect, Word.language_pk == Doculect.pk) \
+                .filter(Word.parameter_pk == ctx.pk) \
+                .order_by(Word.valueset_pk, Word.pk)
+
+        for _, rows in itertools.groupby(query, key=lambda row: row[0]):
+            rows = list(rows)
+            _, language_id, name, latitude, longitude, family, _ = rows[0]
+
+            if latitude is not None and longitude is not None:
+                label = ', '.join(filter(None, [row[-1] for row in rows]))
+                yield make_feature(language_id, name,
+                        latitude, longitude, family, label or name)
+
+    def get_cache_name(self, ctx, req):
+        if req.params.get('domainelement'):
+            return None
+        return 'parameters/{}.geojson'.format(ctx.id)
+
+    def get_default_layer(self, ctx):
+        return str(ctx.id)
+
+
+
+def write_geojson(geojson_dir=GEOJSON_DIR):
+    """
+    Renders the gzipped feature collections of the languages and of each of
+    the concepts into the given dir, along with a manifest noting the data
+    version. Returns the number of files written, not counting the manifest.
+    """
+    if not geojson_dir.joinpath('parameters').exists():
+        geojson_dir.joinpath('parameters').mkdir(parents=True)
+
+    layers = [('languages.geojson', GeoJsonDoculects(None), ExportTable(Doculect))]
+    layers += [('parameters/{}.geojson'.format(concept.id), GeoJsonConcept(None), concept)
+            for concept in DBSession.query(Concept).order_by(Concept.pk)]
+
+    for name, adapter, ctx in layers:
+        req = Request.blank('/?' + urlencode({'layer': adapter.get_default_layer(ctx)}))
+        content = gzip_bytes(adapter.render(ctx, req).encode('utf-8'))
+        write_file(geojson_dir.joinpath(name + '.gz'), content)
+
+    write_file(geojson_dir.joinpath(MANIFEST_NAME),
+            json.dumps({'data_version': get_data_version()}).encode('utf-8'))
+
+    return len(layers)
+
+
 
 """
 Hooks
@@ -148,7 +803,8 @@ Hooks
 def includeme(config):
     """
     Magical (not in the good sense) hook that replaces the default download
-    adapters with the custom ones defined in this module.
+    and GeoJSON adapters with the custom ones defined in this module and adds
+    the columnar download of the words.
     """
     config.register_adapter(LanguagesCsvAdapter, interfaces.ILanguage)
     config.register_adapter(ConceptsCsvAdapter, interfaces.IParameter)
@@ -161,3 +817,14 @@ def includeme(config):
     config.register_adapter(LanguagesJsonAdapter, interfaces.ILanguage)
     config.register_adapter(ConceptsJsonAdapter, interfaces.IParameter)
     config.register_adapter(WordsJsonAdapter, interfaces.IValue)
+
+    config.register_adapter(LanguagesNdjsonAdapter, interfaces.ILanguage)
+    config.register_adapter(ConceptsNdjsonAdapter, interfaces.IParameter)
+    config.register_adapter(WordsNdjsonAdapter, interfaces.IValue)
+
+    config.register_adapter(WordsColumnarAdapter, interfaces.IValue)
+
+    config.register_adapter(GeoJsonDoculects, interfaces.ILanguage,
+            interfaces.IIndex, name=geojson.GeoJson.mimetype)
+    config.register_adapter(GeoJsonConcept, interfaces.IParameter,
+            interfaces.IRepresentation, name=geojson.GeoJson.mimetype)
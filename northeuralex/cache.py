@@ -0,0 +1,204 @@
+import collections
+import datetime
+import threading
+
+from clld.db.meta import DBSession
+from clld.db.models import common
+
+
+
+"""
+Data version
+
+The data only changes when initializedb is run. Each run stores a new version
+string in the jsondata of the common.Dataset instance, so that the caches
+defined here can tell when their contents have become stale.
+"""
+
+def new_data_version():
+    """
+    Returns a new data version string; these are UTC timestamps and thus
+    unique for each run of initializedb.
+    """
+    return datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+
+
+def get_data_version(req=None):
+    """
+    Returns the data version of the db or None if there is none (e.g. the db
+    is empty). If a request is given, its (reified) dataset property is used
+    instead of a new query.
+    """
+    if req is not None:
+        dataset = req.dataset
+    else:
+        dataset = DBSession.query(common.Dataset).first()
+
+    if dataset is None:
+        return None
+
+    return dataset.jsondata.get('data_version')
+
+
+
+"""
+Caches
+"""
+
+class VersionedCache:
+    """
+    Process-wide dict-like cache the contents of which are tied to a data
+    version: looking up a key with a version different from the one the cache
+    has been filled with empties the cache first.
+
+    If max_size is set, the least recently used entries are evicted so that
+    the cache never holds more than that many entries. Likewise, if max_bytes
+    is set, entries are evicted so that the sum of the values' lengths does not
+    exceed it; this is meant for caches holding bytes.
+
+    Nothing is cached under a version of None, as there is no telling when
+    such data changes: the values are computed anew on each call.
+    """
+
+    def __init__(self, max_size=None, max_bytes=None):
+        """
+        Constructor.
+        """
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.version = None
+        self.data = collections.OrderedDict()
+        self.num_bytes = 0
+
+
+    def get(self, version, key, func):
+        """
+        Returns the value cached under the given key; if there is none, the
+        value is computed by calling the given func with no args.
+        """
+        if version is None:
+            return func()
+
+        with self.lock:
+            self.check_version(version)
+
+            if key in self.data:
+                self.data.move_to_end(key)
+                return self.data[key]
+
+        value = func()
+
+        with self.lock:
+            if version == self.version:
+                self.put(key, value)
+
+        return value
+
+
+    def lookup(self, version, key, default=None):
+        """
+        Returns the value cached under the given key or the default if there
+        is none. Unlike get, this is for callers that decide themselves whether
+        to store a value (see store).
+        """
+        if version is None:
+            return default
+
+        with self.lock:
+            self.check_version(version)
+
+            if key in self.data:
+                self.data.move_to_end(key)
+                return self.data[key]
+
+        return default
+
+
+    def store(self, version, key, value):
+        """
+        Caches the given value under the given key.
+        """
+        if version is None:
+            return
+
+        with self.lock:
+            self.check_version(version)
+            self.put(key, value)
+
+
+    def update(self, version, key, func):
+        """
+        Caches the value returned by calling the given func with the value
+        cached under the given key (or None if there is none) under that key.
+        The func is called while holding the lock, so that concurrent updates
+        of a key are not lost; it should return a new value rather than change
+        the cached one, as other threads may be reading that.
+        """
+        if version is None:
+            return
+
+        with self.lock:
+            self.check_version(version)
+            self.put(key, func(self.data.get(key)))
+
+
+    def check_version(self, version):
+        """
+        Empties the cache if the given version differs from the one that the
+        cache has been filled with. Should only be called while holding the
+        lock.
+        """
+        if version != self.version:
+            self.data = collections.OrderedDict()
+            self.num_bytes = 0
+            self.version = version
+
+
+    def put(self, key, value):
+        """
+        Adds the key/value pair and evicts the entries that exceed the limits.
+        Should only be called while holding the lock.
+        """
+        if self.max_bytes is not None:
+            if key in self.data:
+                self.num_bytes -= len(self.data[key])
+            self.num_bytes += len(value)
+
+        self.data[key] = value
+        self.data.move_to_end(key)
+
+        while self.data and (
+                (self.max_size is not None and len(self.data) > self.max_size) or
+                (self.max_bytes is not None and self.num_bytes > self.max_bytes)):
+            _, evicted = self.data.popitem(last=False)
+            if self.max_bytes is not None:
+                self.num_bytes -= len(evicted)
+
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        with self.lock:
+            self.data = collections.OrderedDict()
+            self.num_bytes = 0
+            self.version = None
+
+
+
+"""
+Distinct values
+"""
+
+DISTINCT_VALUES = VersionedCache()
+
+
+def get_distinct_values(req, model_col):
+    """
+    Returns the sorted list of the distinct non-NULL values of the given model
+    column, cached until the data version changes.
+    """
+    return DISTINCT_VALUES.get(get_data_version(req), str(model_col),
+            lambda: sorted([x[0] for x in DBSession.query(model_col).distinct()
+                if x[0] is not None]))
@@ -0,0 +1,271 @@
+import json
+import struct
+
+import numpy as np
+
+
+
+"""
+Columnar format
+
+A compact binary format for the downloads that are loaded as a whole by other
+tools, e.g. the words. The file is laid out so that its columns can be used
+straight from a numpy.memmap or mmap of it, without parsing:
+
+    magic (8 bytes) | version (uint32) | header length (uint32) | header | data
+
+The header is a utf-8 json object, padded with spaces so that the data starts
+at a multiple of ALIGN bytes. It gives the number of rows and, for each column,
+its name, its type, and the arrays it consists of; each array is described by
+its numpy dtype string, its offset from the start of the data, and its length
+(in items), and starts at a multiple of ALIGN bytes. All numbers are little
+endian.
+
+There are two types of columns:
+- string: a string table, i.e. an offsets array of num_rows + 1 integers and a
+  data array of the utf-8 bytes of all the values; the i-th value is
+  data[offsets[i]:offsets[i+1]];
+- dictionary: a codes array of num_rows integers, the indices into the
+  column's values, which are stored as a string table.
+
+As in the csv downloads, None values are stored as empty strings.
+
+The module only depends on numpy, so it can be copied into other projects to
+read the files without installing the app.
+"""
+
+MAGIC = b'NELEXCOL'
+
+VERSION = 1
+
+ALIGN = 64
+
+PRELUDE = struct.Struct('<8sII')
+
+
+
+def get_offsets_dtype(size):
+    return np.dtype('<u4') if size < 2**32 else np.dtype('<u8')
+
+
+
+def get_codes_dtype(size):
+    return np.dtype('<u2') if size < 2**16 else np.dtype('<u4')
+
+
+
+class Writer:
+    """
+    Collects the arrays of the columns, keeping track of their offsets.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.chunks = []
+        self.size = 0
+
+
+    def add_array(self, array):
+        """
+        Appends the given array, padded to ALIGN, and returns its description.
+        """
+        data = array.tobytes()
+
+        spec = {'dtype': array.dtype.str, 'offset': self.size, 'length': len(array)}
+
+        self.chunks.append(data)
+        self.chunks.append(b'\0' * (-len(data) % ALIGN))
+        self.size += len(data) + (-len(data) % ALIGN)
+
+        return spec
+
+
+    def add_strings(self, values):
+        """
+        Appends the string table of the given strings and returns the
+        descriptions of its offsets and data arrays.
+        """
+        encoded = [value.encode('utf-8') for value in values]
+
+        lengths = np.fromiter(map(len, encoded), dtype=np.uint64, count=len(encoded))
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return {
+            'offsets': self.add_array(offsets.astype(get_offsets_dtype(offsets[-1]))),
+            'data': self.add_array(np.frombuffer(b''.join(encoded), dtype=np.uint8))}
+
+
+
+def encode_columns(names, rows, dictionary_columns=()):
+    """
+    Returns the bytes of the columnar file of the given rows, the columns
+    being named by the given names. The columns whose names are listed in
+    dictionary_columns are dictionary-encoded, the rest are string columns.
+    """
+    columns = [[] for _ in names]
+
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append('' if value is None else str(value))
+
+    writer = Writer()
+    header = {'num_rows': len(columns[0]) if columns else 0, 'columns': []}
+
+    for name, values in zip(names, columns):
+        if name in dictionary_columns:
+            dictionary = sorted(set(values))
+            indices = {value: index for index, value in enumerate(dictionary)}
+
+            header['columns'].append({
+                'name': name,
+                'type': 'dictionary',
+                'codes': writer.add_array(np.fromiter(
+                    (indices[value] for value in values),
+                    dtype=get_codes_dtype(len(dictionary)), count=len(values))),
+                'values': writer.add_strings(dictionary)})
+        else:
+            header['columns'].append(dict(writer.add_strings(values),
+                name=name, type='string'))
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    header_bytes += b' ' * (-(PRELUDE.size + len(header_bytes)) % ALIGN)
+
+    return b''.join([PRELUDE.pack(MAGIC, VERSION, len(header_bytes)),
+        header_bytes] + writer.chunks)
+
+
+
+"""
+Reading
+"""
+
+class StringTable:
+    """
+    Sequence of the strings of a string table, decoded on access.
+    """
+
+    def __init__(self, offsets, data):
+        """
+        Constructor.
+        """
+        self.offsets = offsets
+        self.data = data
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        start, end = self.offsets[index], self.offsets[index+1]
+        return self.data[start:end].tobytes().decode('utf-8')
+
+
+    def tolist(self):
+        """
+        Returns the list of all the strings.
+        """
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+
+        return [data[start:end].decode('utf-8')
+                for start, end in zip(offsets, offsets[1:])]
+
+
+
+class ColumnarFile:
+    """
+    Read-only view of a columnar file, given either its path, in which case
+    the file is memory-mapped, or its bytes. The arrays returned are views
+    into the file; nothing is copied until strings are decoded.
+    """
+
+    def __init__(self, source):
+        """
+        Constructor. Raises a ValueError if the source is not a columnar file
+        of a version that the module can read.
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.buffer = np.frombuffer(source, dtype=np.uint8)
+        else:
+            self.buffer = np.memmap(source, dtype=np.uint8, mode='r')
+
+        if len(self.buffer) < PRELUDE.size:
+            raise ValueError('not a columnar file')
+
+        magic, version, header_len = PRELUDE.unpack(self.buffer[:PRELUDE.size].tobytes())
+
+        if magic != MAGIC:
+            raise ValueError('not a columnar file')
+        if version != VERSION:
+            raise ValueError('unsupported columnar file version: {}'.format(version))
+
+        header = json.loads(self.buffer[PRELUDE.size:PRELUDE.size+header_len]
+                .tobytes().decode('utf-8'))
+
+        self.data_start = PRELUDE.size + header_len
+        self.num_rows = header['num_rows']
+        self.columns = {column['name']: column for column in header['columns']}
+        self.names = [column['name'] for column in header['columns']]
+
+
+    def get_array(self, spec):
+        """
+        Returns the array described by the given header entry.
+        """
+        dtype = np.dtype(spec['dtype'])
+        start = self.data_start + spec['offset']
+
+        return self.buffer[start:start + spec['length'] * dtype.itemsize].view(dtype)
+
+
+    def get_strings(self, spec):
+        return StringTable(self.get_array(spec['offsets']), self.get_array(spec['data']))
+
+
+    def codes(self, name):
+        """
+        Returns the integer codes array of the given dictionary column.
+        """
+        return self.get_array(self.columns[name]['codes'])
+
+
+    def dictionary(self, name):
+        """
+        Returns the StringTable of the values of the given dictionary column.
+        """
+        return self.get_strings(self.columns[name]['values'])
+
+
+    def strings(self, name):
+        """
+        Returns the StringTable of the given string column.
+        """
+        return self.get_strings(self.columns[name])
+
+
+    def values(self, name):
+        """
+        Returns the list of the given column's values, decoded.
+        """
+        if self.columns[name]['type'] == 'dictionary':
+            dictionary = self.dictionary(name).tolist()
+            return [dictionary[code] for code in self.codes(name).tolist()]
+
+        return self.strings(name).tolist()
+
+
+    def rows(self):
+        """
+        Returns the list of the rows as tuples of strings, in column order.
+        """
+        return list(zip(*[self.values(name) for name in self.names]))
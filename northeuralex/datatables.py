@@ -1,10 +1,17 @@
 from clld.db.meta import DBSession
+from clld.db.models.common import ValueSet
 from clld.web.datatables.base import Col, IntegerIdCol, LinkToMapCol, LinkCol
 from clld.web.util.helpers import external_link, link, map_marker_img
 from clld.web.util.htmllib import HTML
 from clld.web import datatables
 
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query, joinedload, undefer
+
+from northeuralex.cache import VersionedCache, get_data_version, get_distinct_values
+from northeuralex.glosses import get_gloss_index
 from northeuralex.models import Concept, Doculect, Word
+from northeuralex.search import get_clauses
 
 
 
@@ -36,53 +43,75 @@ class GlottoCodeCol(Col):
 
 
 
-class FamilyCol(Col):
+class DistinctChoicesCol(Col):
+    """
+    Base for columns that replace the search with a drop-down of the distinct
+    values of their model column. These are cached per process and data
+    version (see the cache module), so the db is only queried once per import.
+
+    The choices have to be set in the constructor rather than in __kw__
+    because otherwise the unit tests do not work. Subclasses can override
+    make_choices in order to change the order or the labels.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if not hasattr(self, 'choices'):
+            self.choices = self.make_choices(
+                    get_distinct_values(self.dt.req, self.model_col))
+
+    def make_choices(self, values):
+        return values
+
+
+
+class FamilyCol(DistinctChoicesCol):
     """
     Custom column to replace the search with a drop-down and to add icons for
     the family column of the languages table.
 
-    Unlike in, e.g., NextStepCol, the choices have to be set in the constructor
-    because otherwise the unit tests do not work.
-
     The icons are handled in the format method, the code being stolen from the
     datatable module of the clld-glottologfamily-plugin repo.
     """
 
-    def __init__(self, *args, **kwargs):
-        kwargs['choices'] = sorted([
-            x[0] for x in DBSession.query(Doculect.family).distinct()])
-
-        super().__init__(*args, **kwargs)
-
     def format(self, doculect):
         return HTML.div(map_marker_img(self.dt.req, doculect), ' ', doculect.family)
 
 
 
-class SubfamilyCol(Col):
+class SubfamilyCol(DistinctChoicesCol):
     """
     Custom column to replace the search with a drop-down for the subfamily
     column of the languages table.
-
-    Unlike in, e.g., NextStepCol, the choices have to be set in the constructor
-    because otherwise the unit tests do not work.
     """
 
-    def __init__(self, *args, **kwargs):
-        kwargs['choices'] = sorted([
-            x[0] for x in DBSession.query(Doculect.subfamily).distinct()])
+    pass
 
-        super().__init__(*args, **kwargs)
+
+
+class GlossSearchCol(Col):
+    """
+    Custom column for the gloss columns of the concepts table: the search
+    matches the tokens of the gloss by prefix, ignoring case and diacritics,
+    via the in-memory index of the glosses module. The field kwarg is the
+    index field to search.
+    """
+
+    def search(self, qs):
+        index, _ = get_gloss_index(self.dt.req)
+        return Concept.id.in_(index.search(qs, [self.field]))
 
 
 
-class ConcepticonCol(Col):
+class ConcepticonCol(GlossSearchCol):
     """
     Custom column to present the concepticon_name column of the concepts table
-    as a link to the respective concept in the Concepticon.
+    as a link to the respective concept in the Concepticon. The search is that
+    of GlossSearchCol.
     """
 
-    __kw__ = {'sTitle': 'Concepticon'}
+    __kw__ = {'sTitle': 'Concepticon', 'field': 'concepticon_name'}
 
     def format(self, concept):
         if concept.concepticon_id:
@@ -125,20 +154,130 @@ class DoculectLinkCol(LinkCol):
 
 
 
-class NextStepCol(Col):
+class TrigramSearchCol(Col):
+    """
+    Custom column for the form and IPA columns of the words table: the search
+    is a case-insensitive substring match that looks the candidates up in the
+    trigram index (see the search module) instead of scanning the table.
+    """
+
+    def search(self, qs):
+        return get_clauses(self.model_col.key, qs)
+
+
+
+class NextStepCol(DistinctChoicesCol):
     """
     Custom column to replace the search with a drop-down for the next_step
     column of the words table. Also provides help info in the column's header.
+    The choices are ordered as in the workflow, the last step first.
     """
 
     __kw__ = {
         'sTitle': (
             '<abbr title="'
             'process → review → validate'
-            '">Next action</abbr>'),
-        'choices': [('validate', 'validate'),
-                    ('review', 'review'),
-                    ('process', 'process')] }
+            '">Next action</abbr>') }
+
+    steps = ['validate', 'review', 'process']
+
+    def make_choices(self, values):
+        values = sorted(values, key=lambda value: (
+            self.steps.index(value) if value in self.steps else len(self.steps), value))
+        return [(value, value) for value in values]
+
+
+
+"""
+Filtering
+"""
+
+def apply_filters(dt, req, query):
+    """
+    Applies the column filters of the given datatable, as specified by the
+    sSearch_* params of the given request, to the given query. Mirrors the
+    filtering part of clld's DataTable.get_query for the words table and for
+    the adapters that bring their own query. Returns the query and a hashable
+    key describing the filters: the sorted tuple of their (col index, value)
+    pairs.
+    """
+    filters = set()
+
+    for name, value in req.params.items():
+        if not value or not name.startswith('sSearch_'):
+            continue
+
+        try:
+            index = int(name.split('_')[1])
+            clauses = dt.cols[index].search(value)
+        except (ValueError, IndexError):
+            clauses = None
+
+        if clauses is None:
+            continue
+
+        if not isinstance(clauses, (tuple, list)):
+            clauses = [clauses]
+
+        for clause in clauses:
+            if clause is not None:
+                query = query.filter(clause)
+                filters.add((index, value))
+
+    return query, tuple(sorted(filters))
+
+
+
+"""
+Keyset pagination
+
+Instead of skipping iDisplayStart rows with OFFSET, the words table seeks past
+the last row of the previous page: WHERE (sort col, pk) > (last value, last
+pk). The last rows of the pages served are remembered as boundaries, per
+filter and sort combination, so that paging through the table only ever reads
+the rows shown. Jumping to a page without a known boundary seeks to the nearest
+known one before it and offsets from there.
+
+The sort columns may hold NULLs, which PostgreSQL sorts after and SQLite
+before all the other values; the seek condition takes this into account (see
+WordsDataTable.after), so that no rows are skipped. Keyset pagination is only
+used if the table is sorted by a single expression and then by pk; otherwise
+the page is selected with OFFSET, as in clld.
+
+The counts per filter combination are cached as well, so that neither of the
+two COUNT queries is repeated for the next page.
+"""
+
+COUNTS = VersionedCache(max_size=10000)
+
+BOUNDARIES = VersionedCache(max_size=1000)
+
+
+
+class KeysetQuery(Query):
+    """
+    Query that calls its on_complete callback with the number of rows yielded
+    and the last of them, once it has been iterated through. The callback is
+    not copied over to the queries generated from this one, as these (e.g.
+    the query of first) do not select the same rows.
+    """
+
+    on_complete = None
+
+    def _clone(self):
+        query = super()._clone()
+        query.on_complete = None
+        return query
+
+    def __iter__(self):
+        count, last = 0, None
+
+        for item in super().__iter__():
+            count, last = count + 1, item
+            yield item
+
+        if self.on_complete is not None:
+            self.on_complete(count, last)
 
 
 
@@ -167,15 +306,39 @@ class ConceptsDataTable(datatables.Parameters):
         return [
             IntegerIdCol(self, 'id', model_col=Concept.id),
             LinkCol(self, 'name'),
-            Col(self, 'english', model_col=Concept.english_name),
-            Col(self, 'german', model_col=Concept.german_name),
-            Col(self, 'russian', model_col=Concept.russian_name),
+            GlossSearchCol(self, 'english', model_col=Concept.english_name,
+                field='english'),
+            GlossSearchCol(self, 'german', model_col=Concept.german_name,
+                field='german'),
+            GlossSearchCol(self, 'russian', model_col=Concept.russian_name,
+                field='russian'),
             ConcepticonCol(self, 'concepticon', model_col=Concept.concepticon_name) ]
 
 
 
 class WordsDataTable(datatables.Values):
 
+    def base_query(self, query):
+        """
+        Unlike clld's Values.base_query, filters on the word table's own
+        language_pk and parameter_pk columns and only joins the table that the
+        linked column is sorted and searched by.
+        """
+        if self.contribution:
+            return super().base_query(query)
+
+        if self.language:
+            query = query.join(Concept, Word.parameter_pk == Concept.pk).options(
+                    joinedload(Word.valueset).joinedload(ValueSet.parameter))
+            return query.filter(Word.language_pk == self.language.pk)
+
+        if self.parameter:
+            query = query.join(Doculect, Word.language_pk == Doculect.pk).options(
+                    joinedload(Word.valueset).joinedload(ValueSet.language))
+            return query.filter(Word.parameter_pk == self.parameter.pk)
+
+        return query
+
     def col_defs(self):
         res = []
 
@@ -192,13 +355,181 @@ class WordsDataTable(datatables.Values):
                     get_object=lambda x: x.valueset.language) ])
 
         res.extend([
-            Col(self, 'form', model_col=Word.name, sTitle='Orthographic form'),
-            Col(self, 'raw_ipa', model_col=Word.raw_ipa, sTitle='Automatically generated IPA'),
+            TrigramSearchCol(self, 'form', model_col=Word.name, sTitle='Orthographic form'),
+            TrigramSearchCol(self, 'raw_ipa', model_col=Word.raw_ipa,
+                sTitle='Automatically generated IPA'),
             # Col(self, 'norm_ipa', model_col=Word.norm_ipa, sTitle='Normalised IPA'),
             NextStepCol(self, 'next_step', model_col=Word.next_step) ])
 
         return res
 
+    def get_query(self, limit=1000, offset=0, undefer_cols=()):
+        """
+        Does the same as clld's DataTable.get_query but with cached counts and
+        keyset pagination (see above) whenever the table is sorted by at most
+        one expression.
+        """
+        version = get_data_version(self.req)
+        constraints = tuple(sorted(self.xhr_query().items()))
+
+        query = self.base_query(
+                KeysetQuery(self.db_model(), session=DBSession())
+                .filter(self.db_model().active == True))
+        self.count_all = COUNTS.get(version, ('all', constraints), query.count)
+
+        query, filters = apply_filters(self, self.req, query)
+        self.filters.extend((self.cols[index].js_args['sTitle'], value)
+                for index, value in filters)
+        self.count_filtered = COUNTS.get(version,
+                ('filtered', constraints, filters), query.count)
+
+        query, sorting = self.apply_sorting(query)
+
+        default_order = self.default_order()
+        if not isinstance(default_order, (tuple, list)):
+            default_order = (default_order,)
+        query = query.order_by(*default_order)
+
+        if 'iDisplayLength' in self.req.params:
+            # make sure no more than 1000 items can be selected
+            limit = min([int(self.req.params['iDisplayLength']), 1000])
+        limit = limit if limit != -1 else 1000
+
+        offset = int(self.req.params.get('iDisplayStart', offset))
+
+        keyset = len(sorting) <= 1 and all(len(orders) == 1 for _, _, orders, _ in sorting) \
+                and len(default_order) == 1 and default_order[0] is self.db_model().pk
+
+        if keyset:
+            page_key = (constraints, filters, tuple(
+                (index, desc) for index, _, _, desc in sorting))
+            sort = (sorting[0][1], sorting[0][2][0], sorting[0][3]) if sorting else None
+            query, on_complete = self.seek(query, sort, page_key, version, limit, offset)
+        else:
+            query, on_complete = query.limit(limit).offset(offset), None
+
+        if undefer_cols:
+            query = query.options(*(undefer(col) for col in undefer_cols))
+
+        query.on_complete = on_complete
+
+        return query
+
+    def apply_sorting(self, query):
+        """
+        Applies the sorting of the iSortCol_* request params to the given
+        query, in the same way as clld's DataTable.get_query. Returns the query
+        and a list of (col index, col, order clauses, desc) tuples.
+        """
+        sorting = []
+
+        try:
+            num_cols = int(self.req.params.get('iSortingCols', 0))
+        except ValueError:
+            num_cols = 0
+
+        for sort_index in range(num_cols):
+            try:
+                index = int(self.req.params.get('iSortCol_{}'.format(sort_index)))
+                col = self.cols[index]
+            except (TypeError, ValueError, IndexError):
+                continue
+
+            if not col.js_args.get('bSortable', True):
+                continue
+
+            orders = col.order()
+            if orders is None:
+                continue
+
+            if not isinstance(orders, (tuple, list)):
+                orders = [orders]
+
+            desc = self.req.params.get('sSortDir_{}'.format(sort_index)) == 'desc'
+            for order in orders:
+                query = query.order_by(order.desc() if desc else order)
+
+            sorting.append((index, col, tuple(orders), desc))
+
+        return query, sorting
+
+    def seek(self, query, sort, page_key, version, limit, offset):
+        """
+        Applies the limit and the offset to the given query, seeking past the
+        nearest known boundary at or before the offset if there is one. The
+        sort arg is either None or a (col, order clause, desc) tuple. Returns
+        the query and the callback that records the boundary after the page.
+
+        The boundaries of a page key are kept in a dict that is replaced
+        rather than changed when a boundary is added, so that it can be read
+        without holding the cache's lock.
+        """
+        boundaries = BOUNDARIES.lookup(version, page_key, {})
+
+        known = [key for key in boundaries if key <= offset]
+        if known:
+            start = max(known)
+            nulls_first = (query.session.get_bind().dialect.name == 'postgresql') \
+                    == (sort is not None and sort[2])
+            query = query.filter(self.after(sort, *boundaries[start],
+                    nulls_first=nulls_first))
+        else:
+            start = 0
+
+        query = query.limit(limit).offset(offset - start)
+
+        def on_complete(count, last):
+            if last is None:
+                return
+
+            boundary = (self.get_sort_value(sort, last), last.pk)
+
+            def add(boundaries):
+                boundaries = dict(boundaries or {})
+                boundaries[offset + count] = boundary
+                return boundaries
+
+            BOUNDARIES.update(version, page_key, add)
+
+        return query, on_complete
+
+    def after(self, sort, value, pk, nulls_first=False):
+        """
+        Returns the WHERE clause selecting the rows that come after the row
+        with the given sort value and pk. The value may be None, in which case
+        nulls_first tells whether the NULLs come before the other values in
+        the sort order or after them.
+        """
+        pk_col = self.db_model().pk
+
+        if sort is None:
+            return pk_col > pk
+
+        col, expr, desc = sort
+
+        if value is None:
+            clause = and_(expr == None, pk_col > pk)
+            return or_(clause, expr != None) if nulls_first else clause
+
+        clause = or_(expr < value if desc else expr > value,
+                and_(expr == value, pk_col > pk))
+        return clause if nulls_first else or_(clause, expr == None)
+
+    def get_sort_value(self, sort, word):
+        """
+        Returns the value that the given word has in the sort column.
+        """
+        if sort is None:
+            return word.pk
+
+        col, expr, desc = sort
+        value = getattr(col.get_obj(word), col.model_col.key, None)
+
+        if value is not None and isinstance(col, IntegerIdCol):
+            value = int(value)
+
+        return value
+
 
 
 class SourcesDataTable(datatables.Sources):
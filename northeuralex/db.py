@@ -0,0 +1,240 @@
+import configparser
+import logging
+import sqlite3
+
+from clld.db.meta import DBSession
+
+from pyramid.settings import asbool
+
+from sqlalchemy import event, exc, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.pool import QueuePool
+
+from zope.sqlalchemy import mark_changed as zope_mark_changed
+
+
+
+"""
+Connections
+
+The engine is created by clld.web.app from the sqlalchemy. settings, so the
+pool is configured there: sqlalchemy.pool_size, sqlalchemy.max_overflow,
+sqlalchemy.pool_recycle, and sqlalchemy.pool_timeout are passed on to
+create_engine (see production.ini.template). This module adds what the
+engine's options do not cover.
+
+The settings, all prefixed with northeuralex.db.:
+- pool_pre_ping: whether to test the connections when they are checked out
+  of the pool, so that those dropped by the server are replaced rather than
+  failing the request; false by default;
+- statement_timeout: the PostgreSQL statement_timeout of the connections in
+  ms, unset by default;
+- export_statement_timeout: the statement_timeout of the download queries in
+  ms, unset by default;
+- server_threads: the number of threads serving requests; main sets it from
+  the threads option of the ini file's waitress server.
+"""
+
+SETTINGS_PREFIX = 'northeuralex.db.'
+
+"""
+The number of threads that waitress runs if the ini file does not say.
+"""
+WAITRESS_THREADS = 4
+
+log = logging.getLogger(__name__)
+
+
+
+def get_server_threads(ini_path):
+    """
+    Returns the number of threads of the waitress server configured in the
+    server:main section of the given ini file or None if the file does not
+    configure a waitress server.
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+
+    if not ini_path or not parser.read(ini_path) \
+            or not parser.has_section('server:main'):
+        return None
+
+    server = parser['server:main']
+
+    if 'waitress' not in server.get('use', ''):
+        return None
+
+    return int(server.get('threads', WAITRESS_THREADS))
+
+
+
+def ping_connection(conn, branch):
+    """
+    Handler of the engine_connect event: runs a SELECT 1 on the connection
+    and, if this fails because the connection has been dropped, runs it again
+    so that the pool reconnects. This is the pessimistic disconnect handling
+    of SQLAlchemy's docs, which has become the pool_pre_ping option in later
+    versions.
+    """
+    if branch:
+        return
+
+    should_close_with_result = conn.should_close_with_result
+    conn.should_close_with_result = False
+
+    try:
+        conn.scalar(select([1]))
+    except exc.DBAPIError as error:
+        if error.connection_invalidated:
+            conn.scalar(select([1]))
+        else:
+            raise
+    finally:
+        conn.should_close_with_result = should_close_with_result
+
+
+
+def set_statement_timeout(engine, timeout):
+    """
+    Makes the new connections of the given PostgreSQL engine use the given
+    statement timeout in ms.
+    """
+    def on_connect(dbapi_conn, conn_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute('SET statement_timeout = {:d}'.format(timeout))
+        cursor.close()
+
+    event.listen(engine, 'connect', on_connect)
+
+
+
+"""
+Case folding
+
+SQLite's lower() only folds the ASCII letters, unlike PostgreSQL's and
+Python's str.lower, which the trigram index of the search module is built
+with. Thus, the latter replaces lower() on all the SQLite connections, so that
+the case-insensitive matches agree with the index, e.g. for Cyrillic or IPA.
+"""
+
+def fold_case(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+
+def set_sqlite_lower(dbapi_conn, conn_record):
+    """
+    Handler of the connect event of all the engines: makes the new SQLite
+    connections' lower() use str.lower.
+    """
+    if isinstance(dbapi_conn, sqlite3.Connection):
+        dbapi_conn.create_function('lower', 1, fold_case)
+
+
+event.listen(Engine, 'connect', set_sqlite_lower)
+
+
+
+"""
+Sessions
+"""
+
+def mark_changed(session):
+    """
+    Tells zope.sqlalchemy that the given session has written to the db with
+    statements that the ORM does not track (e.g. inserts through execute), so
+    that its transaction is committed. Unlike zope.sqlalchemy's mark_changed,
+    this also accepts a scoped session such as DBSession.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+
+    zope_mark_changed(session)
+
+
+
+"""
+Exports
+
+The download adapters stream their rows through yield_per, which with psycopg2
+makes the queries run through server-side cursors. The planner optimises the
+queries of such cursors for returning their first rows fast (by default it
+assumes that a tenth of the rows is fetched); the downloads fetch all of them,
+so the export profile sets cursor_tuple_fraction to 1. The profile also allows
+the downloads a statement timeout that differs from the pages' one. The SET
+LOCALs only last until the end of the transaction that the query runs in.
+"""
+
+_export_statement_timeout = [None]
+
+
+def start_export(query):
+    """
+    Applies the export profile to the transaction that the given query is
+    going to run in, if the db is PostgreSQL. Returns the query.
+    """
+    conn = query.session.connection()
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute('SET LOCAL cursor_tuple_fraction = 1.0')
+
+        if _export_statement_timeout[0] is not None:
+            conn.execute('SET LOCAL statement_timeout = {:d}'.format(
+                _export_statement_timeout[0]))
+
+    return query
+
+
+
+"""
+Self-check
+"""
+
+def check_pool_size(settings):
+    """
+    Logs a warning if the pool of the engine that the DBSession is bound to
+    holds fewer connections than there are server threads, as the threads
+    would then have to wait for a connection or open overflow ones. There is
+    nothing to check if there is no pool (e.g. SQLite files) or the number of
+    threads is not known. Returns whether the check has passed.
+    """
+    pool = DBSession.get_bind().pool
+    threads = settings.get(SETTINGS_PREFIX + 'server_threads')
+
+    if not isinstance(pool, QueuePool) or not threads:
+        return True
+
+    if pool.size() < int(threads):
+        log.warning('the db pool size ({}) is smaller than the number of server '
+                'threads ({}); raise sqlalchemy.pool_size'.format(pool.size(), threads))
+        return False
+
+    return True
+
+
+
+def includeme(config):
+    """
+    Adds the pre-ping and the statement timeouts to the engine that
+    clld.web.app has bound the DBSession to. The pool size is checked once the
+    configuration is committed, i.e. after the snapshot module may have
+    replaced the engine.
+    """
+    settings = config.registry.settings
+
+    def get(name, default=None):
+        return settings.get(SETTINGS_PREFIX + name, default)
+
+    engine = DBSession.get_bind()
+
+    if asbool(get('pool_pre_ping', False)):
+        event.listen(engine, 'engine_connect', ping_connection)
+
+    if engine.dialect.name == 'postgresql':
+        if get('statement_timeout'):
+            set_statement_timeout(engine, int(get('statement_timeout')))
+
+        if get('export_statement_timeout'):
+            _export_statement_timeout[0] = int(get('export_statement_timeout'))
+
+    config.action(None, check_pool_size, args=(settings,))
@@ -0,0 +1,335 @@
+import unicodedata
+
+import numpy as np
+
+from clld.db.meta import DBSession
+
+from northeuralex.cache import VersionedCache, get_data_version
+from northeuralex.models import Doculect, Word
+
+
+
+"""
+Segments
+
+The norm_ipa column holds the transcriptions without the whitespace that
+separates the segments in the dataset files, so these are segmented again:
+a segment is a base char followed by its diacritics and modifier letters
+(e.g. ʲ, ː); tie bars join the next base char to the segment.
+
+The distances are computed over integer-coded segments: each distinct segment
+is given a code > 0, the 0 being used for padding.
+"""
+
+TIE_BARS = {'\u0361', '\u035c'}
+
+
+
+def segment_ipa(ipa):
+    """
+    Returns the list of the segments of the given IPA string.
+    """
+    segments = []
+    joined = False
+
+    for char in unicodedata.normalize('NFD', ipa or ''):
+        if char.isspace():
+            joined = False
+            continue
+
+        is_modifier = unicodedata.category(char) in ('Mn', 'Me', 'Lm', 'Sk')
+
+        if segments and (is_modifier or joined):
+            segments[-1] += char
+        else:
+            segments.append(char)
+
+        joined = char in TIE_BARS
+
+    return [unicodedata.normalize('NFC', segment) for segment in segments]
+
+
+
+class SegmentCoder:
+    """
+    Maps segments to integer codes, assigning the next free code to each new
+    segment.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.codes = {}
+
+
+    def encode(self, segments):
+        """
+        Returns the list of the codes of the given segments.
+        """
+        return [self.codes.setdefault(segment, len(self.codes) + 1)
+                for segment in segments]
+
+
+
+"""
+Forms
+
+The forms of a doculect are kept as a (codes, lengths) pair of arrays: the
+codes array has a row per concept, holding the padded segment codes of the
+doculect's form for that concept; lengths holds the forms' lengths, the 0
+meaning that the doculect has no form for the concept. If a doculect has
+several words for a concept, the first one (by pk) is used.
+"""
+
+class Forms:
+    """
+    The integer-coded forms of all the doculects, with the concepts indexed
+    in the same way across doculects.
+    """
+
+    def __init__(self, rows):
+        """
+        Constructor. Expects an iterable of (doculect id, concept pk, norm_ipa)
+        tuples, ordered by word pk.
+        """
+        coder = SegmentCoder()
+        concepts, encoded = {}, {}
+
+        for doculect_id, concept_pk, ipa in rows:
+            codes = coder.encode(segment_ipa(ipa))
+            if codes:
+                index = concepts.setdefault(concept_pk, len(concepts))
+                encoded.setdefault(doculect_id, {}).setdefault(index, codes)
+
+        max_len = max((len(codes) for forms in encoded.values()
+                for codes in forms.values()), default=0)
+
+        self.num_concepts = len(concepts)
+        self.codes, self.lengths = {}, {}
+
+        for doculect_id, forms in encoded.items():
+            codes = np.zeros((len(concepts), max_len), dtype=np.int16)
+            lengths = np.zeros(len(concepts), dtype=np.int16)
+
+            for index, form in forms.items():
+                codes[index, :len(form)] = form
+                lengths[index] = len(form)
+
+            self.codes[doculect_id] = codes
+            self.lengths[doculect_id] = lengths
+
+
+    def __contains__(self, doculect_id):
+        return doculect_id in self.codes
+
+
+    def get_pair(self, doculect_a, doculect_b):
+        """
+        Returns the (codes a, lengths a, codes b, lengths b) arrays of the
+        concepts that both doculects have forms for.
+        """
+        shared = (self.lengths[doculect_a] > 0) & (self.lengths[doculect_b] > 0)
+
+        return (self.codes[doculect_a][shared], self.lengths[doculect_a][shared],
+                self.codes[doculect_b][shared], self.lengths[doculect_b][shared])
+
+
+
+"""
+Distances
+
+The edit distances of a batch of form pairs are computed cell by cell of the
+dynamic programming table, each cell for all the pairs at once, so that the
+number of array operations only depends on the length of the longest forms
+rather than on the number of pairs.
+"""
+
+def edit_distances(codes_a, lengths_a, codes_b, lengths_b):
+    """
+    Returns the array of the Levenshtein distances between the rows of the
+    two padded code arrays, the forms' lengths being given. The table rows
+    are kept transposed, i.e. with a row per cell and a column per pair, so
+    that each step operates on contiguous memory.
+    """
+    width = int(lengths_b.max()) if len(lengths_b) else 0
+    codes_b = np.ascontiguousarray(codes_b[:, :width].T)
+
+    prev = np.repeat(np.arange(width + 1, dtype=np.int16)[:, np.newaxis],
+            len(lengths_b), axis=1)
+    distances = lengths_b.astype(np.int16)
+
+    for i in range(1, int(lengths_a.max()) + 1 if len(lengths_a) else 1):
+        cost = codes_b != codes_a[:, i-1]
+
+        cur = np.empty_like(prev)
+        cur[0] = i
+        np.minimum(prev[1:] + 1, prev[:-1] + cost, out=cur[1:])
+        for j in range(1, width + 1):
+            np.minimum(cur[j], cur[j-1] + 1, out=cur[j])
+
+        done = np.flatnonzero(lengths_a == i)
+        distances[done] = cur[lengths_b[done], done]
+
+        prev = cur
+
+    return distances
+
+
+
+def normalised_edit_distances(codes_a, lengths_a, codes_b, lengths_b):
+    """
+    Returns the array of the edit distances divided by the length of the
+    longer form of the respective pair. The pairs are grouped by that length,
+    so that a few long forms do not make edit_distances go through the longest
+    forms' number of cells for all the pairs.
+    """
+    max_lengths = np.maximum(lengths_a, lengths_b)
+    distances = np.empty(len(max_lengths), dtype=np.int16)
+
+    order = np.argsort(max_lengths, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(max_lengths[order])) + 1
+
+    for group in np.split(order, bounds):
+        distances[group] = edit_distances(codes_a[group], lengths_a[group],
+                codes_b[group], lengths_b[group])
+
+    return distances / np.maximum(max_lengths, 1)
+
+
+
+def compute_distances(forms, pairs, batch_size=200000):
+    """
+    Returns a dict mapping the given (doculect id, doculect id) pairs to
+    (distance, number of shared concepts) tuples, the distance being the mean
+    NED over the shared concepts or None if there are none. The pairs' forms
+    are concatenated and processed in batches of about batch_size form pairs.
+    """
+    results, batch, batch_pairs = {}, [], []
+
+    def flush():
+        if not batch:
+            return
+
+        sizes = [len(part[1]) for part in batch]
+        neds = normalised_edit_distances(*[np.concatenate([part[index] for part in batch])
+                for index in range(4)])
+
+        sums = np.add.reduceat(neds, np.cumsum([0] + sizes[:-1]))
+        for pair, size, total in zip(batch_pairs, sizes, sums):
+            results[pair] = (float(total) / size, size)
+
+        del batch[:], batch_pairs[:]
+
+    num_rows = 0
+
+    for pair in pairs:
+        part = forms.get_pair(*pair)
+
+        if not len(part[1]):
+            results[pair] = (None, 0)
+            continue
+
+        if num_rows + len(part[1]) > batch_size:
+            flush()
+            num_rows = 0
+
+        num_rows += len(part[1])
+        batch.append(part)
+        batch_pairs.append(pair)
+
+    flush()
+
+    return results
+
+
+
+"""
+Caching
+
+The forms are loaded once per data version; the distances are cached per
+doculect pair and data version, so that a matrix only computes the pairs that
+have not been asked for before.
+"""
+
+FORMS = VersionedCache()
+
+DISTANCES = VersionedCache(max_size=100000)
+
+
+def load_forms():
+    """
+    Returns a Forms instance holding the norm_ipa forms of the db's words.
+    """
+    query = DBSession.query(Doculect.id, Word.parameter_pk, Word.norm_ipa) \
+            .select_from(Word) \
+            .join(Doculect, Word.language_pk == Doculect.pk) \
+            .order_by(Word.pk)
+
+    return Forms(query)
+
+
+
+def get_distance_matrix(req, doculect_ids):
+    """
+    Returns the (distances, shared concept counts) pair of square matrices,
+    as lists of lists, for the given doculects.
+    """
+    version = get_data_version(req)
+    forms = FORMS.get(version, 'forms', load_forms)
+
+    pairs = {tuple(sorted([a, b])) for a in doculect_ids for b in doculect_ids if a != b}
+    cached = {pair: DISTANCES.lookup(version, pair) for pair in pairs}
+
+    missing = sorted(pair for pair, value in cached.items() if value is None)
+    for pair, value in compute_distances(forms, missing).items():
+        DISTANCES.store(version, pair, value)
+        cached[pair] = value
+
+    def get(a, b, index):
+        if a == b:
+            return 0.0 if index == 0 else int(np.count_nonzero(forms.lengths[a]))
+        return cached[tuple(sorted([a, b]))][index]
+
+    return ([[get(a, b, 0) for b in doculect_ids] for a in doculect_ids],
+            [[get(a, b, 1) for b in doculect_ids] for a in doculect_ids])
+
+
+
+"""
+Views
+"""
+
+def distances_view(req):
+    """
+    Returns the NED matrix of the doculects given by the comma-separated ids
+    in the languages param as json; without the param, the matrix of all the
+    doculects is returned.
+    """
+    version = get_data_version(req)
+    forms = FORMS.get(version, 'forms', load_forms)
+
+    if req.params.get('languages'):
+        doculect_ids = [value.strip() for value in req.params['languages'].split(',')]
+    else:
+        doculect_ids = sorted(forms.codes)
+
+    unknown = [doculect_id for doculect_id in doculect_ids if doculect_id not in forms]
+
+    if len(doculect_ids) < 2 or unknown:
+        req.response.status = 400
+        return {'error': 'languages must list two or more doculects with words; '
+                'unknown: {}'.format(', '.join(unknown) or '-')}
+
+    distances, shared = get_distance_matrix(req, doculect_ids)
+
+    return {
+        'languages': doculect_ids,
+        'distances': distances,
+        'shared_concepts': shared}
+
+
+
+def includeme(config):
+    config.add_route_and_view('distances', '/distances', distances_view,
+            renderer='json')
@@ -0,0 +1,236 @@
+import bisect
+import collections
+import heapq
+import re
+import unicodedata
+
+from clld.db.meta import DBSession
+
+from northeuralex.cache import VersionedCache, get_data_version
+from northeuralex.models import Concept
+
+
+
+"""
+Gloss search
+
+The concepts can be looked up by their English, German, and Russian glosses
+and their Concepticon names. The FIELDS are normalised (see normalise) and
+split into word tokens; for each field, the sorted list of the distinct tokens
+and the postings (token → concept positions) are kept in memory. A query
+matches the concepts that, in one of the fields searched, have a token
+starting with each of the query's tokens, so that autocomplete works while the
+last token is still being typed.
+
+The index is built from records with the FIELDS as attributes, i.e. the
+output of ConceptDataset.gen_concepts or the concepts in the db, see
+gen_db_concepts.
+"""
+
+FIELDS = ['english', 'german', 'russian', 'concepticon_name']
+
+TOKEN_RE = re.compile(r'\w+')
+
+"""
+The matches of the prefixes up to this length are computed when the index is
+built, as these are the prefixes that match the most tokens.
+"""
+SHORT_PREFIX_LEN = 2
+
+"""
+The combining marks that are kept by normalise, as with their bases they make
+up letters of the Cyrillic alphabet rather than accented ones: the breve of й.
+ё is normalised to е, as in most Russian texts.
+"""
+CYRILLIC_MARKS = {('и', '\u0306')}
+
+
+
+def normalise(text):
+    """
+    Returns the given string casefolded and stripped of diacritics, except for
+    those in CYRILLIC_MARKS.
+    """
+    chars = []
+
+    for char in unicodedata.normalize('NFD', text.casefold()):
+        if unicodedata.combining(char):
+            if not chars or (chars[-1], char) not in CYRILLIC_MARKS:
+                continue
+        chars.append(char)
+
+    return unicodedata.normalize('NFC', ''.join(chars))
+
+
+
+def tokenise(text):
+    """
+    Returns the list of the normalised word tokens of the given string.
+    """
+    return TOKEN_RE.findall(normalise(text or ''))
+
+
+
+class GlossIndex:
+    """
+    In-memory token index over the FIELDS of a sequence of concept records.
+    The concepts are identified by their positions in that sequence, which are
+    also used to order the results.
+    """
+
+    def __init__(self, records):
+        """
+        Constructor. Expects an iterable of records having the FIELDS and id
+        attributes.
+        """
+        self.ids = []
+        self.tokens = {}
+        self.postings = {}
+        self.short_prefixes = {}
+
+        postings = {field: collections.defaultdict(set) for field in FIELDS}
+
+        for position, record in enumerate(records):
+            self.ids.append(record.id)
+            for field in FIELDS:
+                for token in tokenise(getattr(record, field)):
+                    postings[field][token].add(position)
+
+        for field in FIELDS:
+            self.tokens[field] = sorted(postings[field])
+            self.postings[field] = dict(postings[field])
+
+            short_prefixes = collections.defaultdict(set)
+            for token, positions in self.postings[field].items():
+                for length in range(1, SHORT_PREFIX_LEN + 1):
+                    short_prefixes[token[:length]] |= positions
+
+            self.short_prefixes[field] = {prefix: frozenset(positions)
+                    for prefix, positions in short_prefixes.items()}
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def match_prefix(self, field, prefix):
+        """
+        Returns the set of the positions of the concepts that have a token
+        starting with the given prefix in the given field.
+        """
+        if len(prefix) <= SHORT_PREFIX_LEN:
+            return set(self.short_prefixes[field].get(prefix, ()))
+
+        tokens = self.tokens[field]
+        positions = set()
+
+        index = bisect.bisect_left(tokens, prefix)
+        while index < len(tokens) and tokens[index].startswith(prefix):
+            positions |= self.postings[field][tokens[index]]
+            index += 1
+
+        return positions
+
+
+    def search(self, query, fields=FIELDS, limit=None):
+        """
+        Returns the list of the ids of the concepts matching the given query
+        in any of the given fields. The concepts having a token equal to the
+        query's last token come first; otherwise, the records' order is kept.
+        """
+        query_tokens = tokenise(query)
+        if not query_tokens:
+            return []
+
+        matches, exact = set(), set()
+
+        for field in fields:
+            positions = self.match_prefix(field, query_tokens[0])
+            for token in query_tokens[1:]:
+                if not positions:
+                    break
+                positions &= self.match_prefix(field, token)
+
+            matches |= positions
+            exact |= positions & self.postings[field].get(query_tokens[-1], set())
+
+        key = lambda position: (position not in exact, position)
+
+        if limit is None:
+            positions = sorted(matches, key=key)
+        else:
+            positions = heapq.nsmallest(limit, matches, key=key)
+
+        return [self.ids[position] for position in positions]
+
+
+
+"""
+The index of the concepts in the db
+"""
+
+GlossRecord = collections.namedtuple('GlossRecord', ['id', 'name'] + FIELDS)
+
+GLOSS_INDEX = VersionedCache()
+
+
+def gen_db_concepts():
+    """
+    Yields a GlossRecord for each concept in the db, in the order of the
+    concepts dataset.
+    """
+    query = DBSession.query(Concept.id, Concept.name, Concept.english_name,
+                Concept.german_name, Concept.russian_name, Concept.concepticon_name) \
+            .order_by(Concept.pk)
+
+    yield from map(GlossRecord._make, query)
+
+
+
+def get_gloss_index(req):
+    """
+    Returns the GlossIndex of the concepts in the db, built once per data
+    version. Also keeps the records, so that the search results can be shown
+    without querying the db.
+    """
+    def build():
+        records = list(gen_db_concepts())
+        return GlossIndex(records), {record.id: record for record in records}
+
+    return GLOSS_INDEX.get(get_data_version(req), 'index', build)
+
+
+
+"""
+Views
+"""
+
+def autocomplete_view(req):
+    """
+    Returns the concepts matching the q param as json. The optional params are
+    field (one of FIELDS, all of them by default) and limit (at most 100).
+    """
+    value = req.params.get('q', '')
+    field = req.params.get('field')
+
+    try:
+        limit = min(int(req.params.get('limit', 10)), 100)
+    except ValueError:
+        limit = 10
+
+    if field and field not in FIELDS:
+        req.response.status = 400
+        return {'error': 'field must be one of {}'.format(', '.join(FIELDS))}
+
+    index, records = get_gloss_index(req)
+    ids = index.search(value, [field] if field else FIELDS, limit)
+
+    return {
+        'q': value,
+        'concepts': [records[concept_id]._asdict() for concept_id in ids]}
+
+
+
+def includeme(config):
+    config.add_route_and_view('search_concepts', '/search/concepts',
+            autocomplete_view, renderer='json')
@@ -0,0 +1,393 @@
+import bisect
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from clld.db.meta import DBSession
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+
+from sqlalchemy import event
+
+
+
+"""
+Metrics
+
+The tween times each request and, via the engine's cursor events, counts the
+SQL statements run while the request is handled and sums up their durations;
+the three values are recorded in per-route histograms. The download adapters
+record the time it takes to render them (see adapters.StreamingMixin and
+adapters.ExcelAdapter) and the response cache counts its hits, misses, and
+stores. Statements that take longer than the threshold are logged along with
+the path of the request they were run for.
+
+Everything is kept in the process' memory and served on /_metrics in the
+Prometheus text format; the endpoint should not be exposed to the public by
+the reverse proxy.
+
+The settings, all prefixed with northeuralex.metrics.:
+- enabled: true by default;
+- slow_query_threshold: in seconds, 0.5 by default.
+"""
+
+SETTINGS_PREFIX = 'northeuralex.metrics.'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+RENDER_BUCKETS = (0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+log = logging.getLogger(__name__)
+
+
+
+class Histogram:
+    """
+    Counts the observed values per bucket, a bucket holding the values less
+    than or equal to its upper bound; the +Inf bucket is implied.
+    """
+
+    def __init__(self, buckets):
+        """
+        Constructor.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.lock = threading.Lock()
+
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+    def get_state(self):
+        """
+        Returns a (cumulative bucket counts, sum) tuple, the last count being
+        that of the +Inf bucket and thus the number of observations.
+        """
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+
+        return cumulative, total
+
+
+
+def format_value(value):
+    """
+    Returns the given number as the text format expects it.
+    """
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+
+def format_labels(labels):
+    """
+    Returns the {key="value",...} string of the given (key, value) pairs, or
+    the empty string if there are none.
+    """
+    if not labels:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join('{}="{}"'.format(key, escape(value))
+            for key, value in labels) + '}'
+
+
+
+class Metrics:
+    """
+    Registry of the histograms and counters, each metric having a child per
+    combination of label values.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.metrics = collections.OrderedDict()  # name: (type, help, buckets)
+        self.children = {}  # (name, labels): Histogram or [count]
+        self.lock = threading.Lock()
+
+
+    def add_histogram(self, name, help_text, buckets):
+        self.metrics[name] = ('histogram', help_text, buckets)
+
+
+    def add_counter(self, name, help_text):
+        self.metrics[name] = ('counter', help_text, None)
+
+
+    def get_child(self, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        if key not in self.children:
+            kind, _, buckets = self.metrics[name]
+            with self.lock:
+                self.children.setdefault(key,
+                        Histogram(buckets) if kind == 'histogram' else [0])
+
+        return self.children[key]
+
+
+    def observe(self, name, value, **labels):
+        """
+        Records the given value in the histogram with the given name.
+        """
+        self.get_child(name, labels).observe(value)
+
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increments the counter with the given name.
+        """
+        child = self.get_child(name, labels)
+        with self.lock:
+            child[0] += value
+
+
+    def clear(self):
+        with self.lock:
+            self.children.clear()
+
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        with self.lock:
+            children = sorted(self.children.items())
+
+        lines = []
+
+        for name, (kind, help_text, _) in self.metrics.items():
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+            for (child_name, labels), child in children:
+                if child_name != name:
+                    continue
+
+                if kind == 'counter':
+                    lines.append('{}{} {}'.format(
+                        name, format_labels(labels), format_value(child[0])))
+                    continue
+
+                counts, total = child.get_state()
+                bounds = child.buckets + (float('inf'),)
+
+                for bound, count in zip(bounds, counts):
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(
+                        labels + (('le', format_value(bound)),)), count))
+
+                lines.append('{}_sum{} {}'.format(
+                    name, format_labels(labels), format_value(total)))
+                lines.append('{}_count{} {}'.format(
+                    name, format_labels(labels), counts[-1]))
+
+        return '\n'.join(lines) + '\n'
+
+
+
+"""
+The metrics of the app, shared by the threads of the process.
+"""
+METRICS = Metrics()
+
+METRICS.add_histogram('northeuralex_request_duration_seconds',
+        'Time spent handling the request, per route.', LATENCY_BUCKETS)
+METRICS.add_histogram('northeuralex_request_sql_statements',
+        'Number of SQL statements run per request, per route.', COUNT_BUCKETS)
+METRICS.add_histogram('northeuralex_request_sql_duration_seconds',
+        'Time spent in SQL statements per request, per route.', LATENCY_BUCKETS)
+METRICS.add_histogram('northeuralex_adapter_render_seconds',
+        'Time spent rendering a download, per adapter.', RENDER_BUCKETS)
+METRICS.add_counter('northeuralex_slow_queries_total',
+        'Number of SQL statements that took longer than the threshold.')
+METRICS.add_counter('northeuralex_response_cache_total',
+        'Number of response cache hits, misses, and stores.')
+
+
+
+"""
+SQL
+
+The cursor events of the engine run in the thread that handles the request,
+so the statements are attributed to the request via a thread-local. Those run
+outside of the tween, e.g. while a streamed download is being sent, are not
+attributed to any request but are still checked against the threshold.
+"""
+
+class QueryStats:
+    """
+    The number and the total duration of the SQL statements of a request.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.count = 0
+        self.duration = 0
+
+
+_current = threading.local()
+
+_slow_query_threshold = [0.5]
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('northeuralex_query_start', []).append(time.perf_counter())
+
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Adds the statement to the current request's stats and logs it if it has
+    crossed the threshold.
+    """
+    duration = time.perf_counter() - conn.info['northeuralex_query_start'].pop()
+
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats.count += 1
+        stats.duration += duration
+
+    if duration >= _slow_query_threshold[0]:
+        METRICS.inc('northeuralex_slow_queries_total')
+        log.warning('slow query ({:.3f}s, {}): {}'.format(duration,
+            getattr(_current, 'path', None) or 'no request',
+            ' '.join(statement.split())[:1000]))
+
+
+
+def instrument_engine(engine, slow_query_threshold=0.5):
+    """
+    Adds the cursor event listeners to the given engine, unless these have
+    been added already, and sets the threshold for logging slow queries.
+    """
+    _slow_query_threshold[0] = slow_query_threshold
+
+    if not event.contains(engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+
+"""
+Adapters
+"""
+
+@contextlib.contextmanager
+def timed_render(adapter):
+    """
+    Records the time spent within the with block as the render time of the
+    given adapter.
+    """
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        METRICS.observe('northeuralex_adapter_render_seconds',
+                time.perf_counter() - start, adapter=type(adapter).__name__)
+
+
+
+"""
+Tween
+"""
+
+def get_route_name(req):
+    """
+    Returns the name of the route that the request has been or would be
+    matched by; the latter is the case if another tween, such as the response
+    cache, has answered the request before the router. Returns None if no
+    route matches.
+    """
+    route = getattr(req, 'matched_route', None)
+
+    if route is None:
+        route = req.registry.getUtility(IRoutesMapper)(req)['route']
+
+    return route.name if route is not None else None
+
+
+
+def metrics_tween_factory(handler, registry):
+    """
+    Tween factory.
+    """
+    def tween(req):
+        _current.stats = stats = QueryStats()
+        _current.path = req.path
+        start = time.perf_counter()
+
+        try:
+            return handler(req)
+        finally:
+            duration = time.perf_counter() - start
+            route = get_route_name(req) or 'none'
+
+            METRICS.observe('northeuralex_request_duration_seconds', duration, route=route)
+            METRICS.observe('northeuralex_request_sql_statements', stats.count, route=route)
+            METRICS.observe('northeuralex_request_sql_duration_seconds',
+                    stats.duration, route=route)
+
+            _current.stats = _current.path = None
+
+    return tween
+
+
+
+"""
+Views
+"""
+
+def metrics_view(req):
+    """
+    Returns the metrics in the Prometheus text format.
+    """
+    return Response(METRICS.render(), content_type=CONTENT_TYPE, charset='utf-8')
+
+
+
+def includeme(config):
+    """
+    Adds the tween on top of all the others, so that the time spent in these
+    is included, instruments the engine that clld.web.app has bound the
+    DBSession to, and adds the /_metrics view.
+    """
+    settings = config.registry.settings
+
+    if not asbool(settings.get(SETTINGS_PREFIX + 'enabled', True)):
+        return
+
+    instrument_engine(DBSession.get_bind(), float(
+        settings.get(SETTINGS_PREFIX + 'slow_query_threshold', 0.5)))
+
+    config.add_tween('northeuralex.metrics.metrics_tween_factory', under=INGRESS)
+    config.add_route_and_view('_metrics', '/_metrics', metrics_view)
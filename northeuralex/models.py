@@ -1,8 +1,8 @@
-from clld.db.meta import CustomModelMixin
+from clld.db.meta import Base, CustomModelMixin
 from clld.db.models.common import Language, Parameter, ValueSet, Value
 from clld import interfaces
 
-from sqlalchemy import Column, ForeignKey, Integer, Unicode
+from sqlalchemy import Column, ForeignKey, Index, Integer, Table, Unicode
 
 from zope.interface import implementer
 
@@ -15,11 +15,11 @@ class Doculect(CustomModelMixin, Language):
     (float).
     """
     pk = Column(Integer, ForeignKey('language.pk'), primary_key=True)
-    iso_code = Column(Unicode)
+    iso_code = Column(Unicode, index=True)
     glotto_code = Column(Unicode)
 
-    family = Column(Unicode)
-    subfamily = Column(Unicode)
+    family = Column(Unicode, index=True)
+    subfamily = Column(Unicode, index=True)
 
 
 
@@ -34,7 +34,7 @@ class Concept(CustomModelMixin, Parameter):
     german_name = Column(Unicode)
     russian_name = Column(Unicode)
 
-    concepticon_id = Column(Integer)
+    concepticon_id = Column(Integer, index=True)
     concepticon_name = Column(Unicode)
 
 
@@ -52,10 +52,44 @@ class Synset(CustomModelMixin, ValueSet):
 class Word(CustomModelMixin, Value):
     """
     Relevant fields inherited from Value: id, name, valueset.
+
+    The language_pk and parameter_pk columns duplicate those of the word's
+    valueset so that the words table can be filtered without joining the
+    valueset and synset tables.
     """
     pk = Column(Integer, ForeignKey('value.pk'), primary_key=True)
 
     raw_ipa = Column(Unicode)
     norm_ipa = Column(Unicode)
 
-    next_step = Column(Unicode)
+    next_step = Column(Unicode, index=True)
+
+    language_pk = Column(Integer, ForeignKey('language.pk'), index=True)
+    parameter_pk = Column(Integer, ForeignKey('parameter.pk'), index=True)
+
+
+
+"""
+Indexes on clld's tables for the lookups of the importer, the data tables, and
+the download adapters.
+"""
+
+Index('ix_valueset_language_pk_parameter_pk',
+        ValueSet.__table__.c.language_pk, ValueSet.__table__.c.parameter_pk)
+
+Index('ix_value_valueset_pk', Value.__table__.c.valueset_pk)
+
+
+
+"""
+The trigram index of the words' name, raw_ipa, and norm_ipa columns, populated
+by initializedb (see the search module). It is a plain table rather than a
+model as it only ever is queried for word_pk sets.
+"""
+
+word_trigram = Table('word_trigram', Base.metadata,
+        Column('trigram', Unicode, nullable=False),
+        Column('field', Integer, nullable=False),
+        Column('word_pk', Integer, ForeignKey('word.pk'), nullable=False),
+        Index('ix_word_trigram_trigram_field', 'trigram', 'field'),
+        Index('ix_word_trigram_word_pk', 'word_pk'))
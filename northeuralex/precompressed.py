@@ -0,0 +1,305 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import shutil
+
+from pyramid.response import FileResponse
+from pyramid.static import QueryStringCacheBuster
+
+from clldutils.path import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+
+"""
+Pre-compressed static files
+
+The files in the app's static dir (mainly the downloads written by
+initializedb) are served as they are, even though the larger ones compress
+very well. The compress_static func writes .gz and, if the brotli package is
+installed, .br siblings of these files; the tween defined below serves such a
+sibling instead of the file itself if the client accepts its encoding.
+
+The tween only covers the /static/ URLs. The pages do not load project.css
+and project.js from there; they load clld's webassets bundles, which include
+these two files and are served from /clld-static/.
+
+The static URLs are fingerprinted with a hash of the file's contents (see
+ContentHashCacheBuster), so that responses to fingerprinted requests can be
+cached by clients for a year.
+"""
+
+STATIC_DIR = Path(__file__).parent.joinpath('static')
+
+STATIC_URL_PREFIX = '/static/'
+
+"""
+The extensions of the files worth compressing; images and the excel downloads
+are compressed already.
+"""
+COMPRESSIBLE = {'.css', '.js', '.csv', '.tsv', '.json', '.ndjson', '.geojson',
+        '.txt', '.svg', '.html', '.xml', '.bib'}
+
+"""
+The content types of the compressible extensions that the mimetypes module
+does not know in all the Python versions (or with all the system mime.types
+files) that the app runs on; these are registered when the module is imported.
+"""
+CONTENT_TYPES = {'.ndjson': 'application/x-ndjson',
+        '.geojson': 'application/geo+json'}
+
+for extension, content_type in CONTENT_TYPES.items():
+    mimetypes.add_type(content_type, extension)
+
+"""
+The encodings of the siblings, in order of preference.
+"""
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+MAX_AGE = 365*24*60*60
+
+
+
+def is_compressible(path, min_size=1024):
+    """
+    Checks whether a sibling should be written for the file at the given path.
+    """
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE \
+            and os.path.getsize(path) >= min_size
+
+
+
+def is_fresh(path, sibling_path):
+    """
+    Checks whether the sibling exists and is not older than the file itself.
+    """
+    try:
+        return os.path.getmtime(sibling_path) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+
+def write_sibling(path, encoding, suffix):
+    """
+    Writes the compressed sibling of the file at the given path via a
+    temporary file and gives it the file's mtime.
+    """
+    temp_path = path + suffix + '.tmp'
+
+    with open(path, 'rb') as f_in, open(temp_path, 'wb') as f_out:
+        if encoding == 'gzip':
+            with gzip.GzipFile(fileobj=f_out, mode='wb', mtime=0) as gzip_out:
+                shutil.copyfileobj(f_in, gzip_out)
+        else:
+            f_out.write(brotli.compress(f_in.read()))
+
+    stat = os.stat(path)
+    os.utime(temp_path, (stat.st_atime, stat.st_mtime))
+    os.replace(temp_path, path + suffix)
+
+
+
+def compress_static(static_dir=STATIC_DIR, min_size=1024):
+    """
+    Writes the missing or stale compressed siblings of the compressible files
+    in the given dir and its sub-dirs. Returns the list of the paths written.
+    """
+    encodings = [(encoding, suffix) for encoding, suffix in ENCODINGS
+            if encoding != 'br' or brotli is not None]
+    written = []
+
+    for dir_path, dir_names, file_names in os.walk(str(static_dir)):
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+
+            if not is_compressible(path, min_size):
+                continue
+
+            for encoding, suffix in encodings:
+                if not is_fresh(path, path + suffix):
+                    write_sibling(path, encoding, suffix)
+                    written.append(path + suffix)
+
+    return written
+
+
+
+"""
+Serving
+"""
+
+_hashes = {}
+
+
+def get_file_hash(path):
+    """
+    Returns the first 12 hex digits of the sha1 of the file at the given path
+    or None if there is no such file. The hashes are kept until the file's
+    mtime or size changes.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    cached = _hashes.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            sha1.update(chunk)
+
+    _hashes[path] = (stat.st_mtime, stat.st_size, sha1.hexdigest()[:12])
+    return _hashes[path][2]
+
+
+
+class ContentHashCacheBuster(QueryStringCacheBuster):
+    """
+    Adds a v query param holding the file's hash to the static URLs.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR):
+        super().__init__(param='v')
+        self.static_dir = str(static_dir)
+
+    def tokenize(self, request, subpath, kw):
+        return get_file_hash(os.path.join(self.static_dir, subpath)) or '0'
+
+
+
+def get_static_path(static_dir, url_path):
+    """
+    Returns the path of the file that the given URL path refers to or None if
+    the URL path is outside the static dir or there is no such file.
+    """
+    if not url_path.startswith(STATIC_URL_PREFIX):
+        return None
+
+    static_dir = os.path.realpath(str(static_dir))
+    path = os.path.realpath(os.path.join(static_dir, url_path[len(STATIC_URL_PREFIX):]))
+
+    if not path.startswith(static_dir + os.sep) or not os.path.isfile(path):
+        return None
+
+    return path
+
+
+
+def parse_accept_encoding(header):
+    """
+    Returns the dict mapping the codings listed in the given Accept-Encoding
+    header value to their q values, the coding names being lower-cased. A
+    coding without a (valid) q value gets 1.0; one with an invalid q value,
+    0.0, i.e. it is not accepted.
+    """
+    qvalues = {}
+
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+
+        qvalue = 1.0
+
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+
+        qvalues[coding.lower()] = qvalue
+
+    return qvalues
+
+
+
+def get_encoding_qvalue(req, encoding):
+    """
+    Returns the q value that the request's Accept-Encoding header gives the
+    given encoding, either explicitly or via *; 0.0 if it is not accepted.
+    """
+    qvalues = parse_accept_encoding(req.headers.get('Accept-Encoding', ''))
+    return qvalues.get(encoding, qvalues.get('*', 0.0))
+
+
+
+def choose_encoding(req, path):
+    """
+    Returns the (encoding, sibling path) pair of the fresh sibling whose
+    encoding the client accepts with the highest q value, ties going to the
+    preferred encoding, or (None, path) if there is none. Encodings with a q
+    value of 0 are not accepted.
+    """
+    best = (0.0, None, path)
+
+    for encoding, suffix in ENCODINGS:
+        qvalue = get_encoding_qvalue(req, encoding)
+
+        if qvalue > best[0] and is_fresh(path, path + suffix):
+            best = (qvalue, encoding, path + suffix)
+
+    return best[1:]
+
+
+
+def precompressed_tween_factory(handler, registry):
+    """
+    Tween that serves the files in the static dir, picking the compressed
+    siblings where possible. Requests carrying the file's current hash (see
+    ContentHashCacheBuster) get a Cache-Control header allowing clients to
+    cache the response for a year; others have to revalidate.
+    """
+    static_dir = registry.settings.get('northeuralex.static_dir', STATIC_DIR)
+
+    def tween(req):
+        if req.method not in ('GET', 'HEAD'):
+            return handler(req)
+
+        path = get_static_path(static_dir, req.path_info)
+        if path is None:
+            return handler(req)
+
+        encoding, served_path = choose_encoding(req, path)
+        content_type, _ = mimetypes.guess_type(path)
+        file_hash = get_file_hash(path)
+
+        res = FileResponse(served_path, request=req,
+                content_type=content_type or 'application/octet-stream',
+                content_encoding=encoding)
+
+        res.vary = ('Accept-Encoding',)
+        res.etag = '{}-{}'.format(file_hash, encoding) if encoding else file_hash
+
+        if req.params.get('v') == file_hash:
+            res.cache_control = 'public, max-age={}, immutable'.format(MAX_AGE)
+        else:
+            res.cache_control = 'public, no-cache'
+
+        res.conditional_response = True
+
+        return res
+
+    return tween
+
+
+
+def includeme(config):
+    """
+    Adds the tween and the cache buster for the app's static view, the latter
+    being added by clld.
+    """
+    config.add_tween('northeuralex.precompressed.precompressed_tween_factory')
+    config.add_cache_buster('northeuralex:static/',
+            ContentHashCacheBuster(config.registry.settings.get(
+                'northeuralex.static_dir', STATIC_DIR)))
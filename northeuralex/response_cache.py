@@ -0,0 +1,441 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from clld import RESOURCES
+from clld.interfaces import IRepresentation
+from clld.web.adapters import get_adapter
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.response import Response
+from pyramid.settings import aslist
+from pyramid.tweens import INGRESS
+
+from northeuralex.cache import VersionedCache, get_data_version
+from northeuralex.metrics import METRICS
+
+
+
+"""
+Response cache
+
+The detail pages only change when the db is re-populated, so the rendered
+html responses are cached and tied to the data version. The cache is a tween
+placed under pyramid_tm: it matches the request's route itself, so that a
+cached page is served without the ctx being looked up or a template being
+rendered.
+
+The entries are keyed by what the views read from the request (see
+ResponseCache.get_key): the host URL, which the links in the pages start
+with; the route and resource id; the query params, of which the pages only
+use the first value of each (clld's request.query_params); and the mimetype
+that clld's content negotiation picks for the Accept header.
+
+The settings, all prefixed with northeuralex.response_cache.:
+- backend: memory (the default), disk, or none;
+- max_bytes: the size limit of the backend, 64 MiB by default for the memory
+  one and 1 GiB for the disk one;
+- directory: the dir of the disk backend, which requires it;
+- routes: the names of the routes to cache, by default language, parameter,
+  and valueset;
+- max_age: the max-age of the Cache-Control header, 0 by default;
+- version_ttl: how many seconds the data version is kept before being looked
+  up again, 5 by default.
+"""
+
+SETTINGS_PREFIX = 'northeuralex.response_cache.'
+
+DEFAULT_ROUTES = ['language', 'parameter', 'valueset']
+
+"""
+The headers of the rendered response that are not stored with the entries.
+"""
+SKIP_HEADERS = {'content-length', 'date', 'etag', 'last-modified',
+        'cache-control', 'set-cookie'}
+
+
+
+def encode_entry(res):
+    """
+    Returns the bytes to be cached for the given response: a json line with
+    the headers and the ETag, followed by the body.
+    """
+    meta = {
+        'headers': [[key, value] for key, value in res.headerlist
+            if key.lower() not in SKIP_HEADERS],
+        'etag': hashlib.sha1(res.body).hexdigest()}
+
+    return json.dumps(meta).encode('utf-8') + b'\n' + res.body
+
+
+
+def decode_entry(entry):
+    """
+    Inverse of encode_entry: returns a (headers, etag, body) tuple.
+    """
+    meta, body = entry.split(b'\n', 1)
+    meta = json.loads(meta.decode('utf-8'))
+
+    return meta['headers'], meta['etag'], body
+
+
+
+def parse_data_version(version):
+    """
+    Returns the datetime that the given data version (see cache.new_data_version)
+    stands for or None if the version is not a timestamp.
+    """
+    try:
+        return datetime.datetime.strptime(version, '%Y%m%d%H%M%S%f') \
+                .replace(tzinfo=datetime.timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+
+"""
+Backends
+
+A backend provides lookup(version, key) and store(version, key, entry), the
+entries being bytes. Like VersionedCache, the backends do not keep anything
+under a version of None.
+"""
+
+class MemoryBackend(VersionedCache):
+    """
+    Keeps the entries in the process' memory, evicting the least recently used
+    ones once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes=64*1024*1024):
+        """
+        Constructor.
+        """
+        super().__init__(max_bytes=max_bytes)
+
+
+
+class DiskBackend:
+    """
+    Keeps the entries as files in a sub-dir of the given dir, one per data
+    version; the sub-dirs of other versions are removed when an entry of a
+    new version is stored. The files can thus be shared among processes.
+
+    Once the files of the current version are estimated to exceed max_bytes,
+    the least recently used ones are removed until these take up at most
+    three quarters of it. The estimate is the size that the dir had when it
+    was last measured plus that of the entries stored since, so the files
+    stored by other processes are only accounted for when the dir is next
+    measured. Looking an entry up updates its file's mtime.
+    """
+
+    def __init__(self, directory, max_bytes=1024*1024*1024):
+        """
+        Constructor.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.num_bytes = None  # (version, estimated size of its dir)
+
+
+    def get_path(self, version, key):
+        """
+        Returns the path of the file holding the entry for the given key.
+        """
+        return os.path.join(self.directory, str(version),
+                hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+
+    def lookup(self, version, key, default=None):
+        if version is None:
+            return default
+
+        path = self.get_path(version, key)
+
+        try:
+            with open(path, 'rb') as f:
+                entry = f.read()
+            os.utime(path)
+        except OSError:
+            return default
+
+        return entry
+
+
+    def store(self, version, key, entry):
+        if version is None:
+            return
+
+        path = self.get_path(version, key)
+        version_dir = os.path.dirname(path)
+
+        if not os.path.exists(version_dir):
+            os.makedirs(version_dir, exist_ok=True)
+
+            for name in os.listdir(self.directory):
+                if name != str(version):
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'wb') as f:
+            f.write(entry)
+
+        os.replace(temp_path, path)
+
+        with self.lock:
+            if self.num_bytes is None or self.num_bytes[0] != version:
+                self.num_bytes = (version, self.measure(version_dir))
+            else:
+                self.num_bytes = (version, self.num_bytes[1] + len(entry))
+
+            if self.num_bytes[1] > self.max_bytes:
+                self.num_bytes = (version, self.evict(version_dir, self.max_bytes * 3 // 4))
+
+
+    def measure(self, version_dir):
+        """
+        Returns the sum of the sizes of the entry files in the given dir.
+        """
+        return sum(size for _, _, size in self.list_files(version_dir))
+
+
+    def evict(self, version_dir, max_bytes):
+        """
+        Removes the least recently used entry files of the given dir until the
+        rest take up at most max_bytes. Returns the size of the rest.
+        """
+        files = sorted(self.list_files(version_dir))
+        num_bytes = sum(size for _, _, size in files)
+
+        for _, path, size in files:
+            if num_bytes <= max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            num_bytes -= size
+
+        return num_bytes
+
+
+    def list_files(self, version_dir):
+        """
+        Returns a list of (mtime, path, size) tuples, one for each of the entry
+        files in the given dir.
+        """
+        files = []
+
+        try:
+            entries = list(os.scandir(version_dir))
+        except OSError:
+            return files
+
+        for entry in entries:
+            if entry.name.endswith('.tmp'):
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            files.append((stat.st_mtime, entry.path, stat.st_size))
+
+        return files
+
+
+
+"""
+Tween
+"""
+
+class ResponseCache:
+    """
+    Holds the backend and the settings. An instance is created by the tween
+    factory and attached to the registry. The hits, misses, and stores are
+    counted in the app's metrics (see the metrics module).
+    """
+
+    def __init__(self, backend, routes=DEFAULT_ROUTES, max_age=0, version_ttl=5):
+        """
+        Constructor.
+        """
+        self.backend = backend
+        self.routes = set(routes)
+        self.max_age = max_age
+        self.version_ttl = version_ttl
+
+        self.version = (None, None)  # (data version, time of the lookup)
+
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Returns a ResponseCache configured by the given app settings or None
+        if the cache is turned off.
+        """
+        def get(name, default=None):
+            return settings.get(SETTINGS_PREFIX + name, default)
+
+        backend_name = get('backend', 'memory')
+
+        if backend_name == 'memory':
+            backend = MemoryBackend(int(get('max_bytes', 64*1024*1024)))
+        elif backend_name == 'disk':
+            if not get('directory'):
+                raise ValueError('the disk response cache needs a directory')
+            backend = DiskBackend(get('directory'), int(get('max_bytes', 1024*1024*1024)))
+        elif backend_name == 'none':
+            return None
+        else:
+            raise ValueError('unknown response cache backend: {}'.format(backend_name))
+
+        return cls(backend,
+                routes=aslist(get('routes', ' '.join(DEFAULT_ROUTES))),
+                max_age=int(get('max_age', 0)),
+                version_ttl=float(get('version_ttl', 5)))
+
+
+    def get_version(self):
+        """
+        Returns the data version, looking it up at most once per version_ttl
+        seconds.
+        """
+        version, checked = self.version
+
+        if checked is None or time.monotonic() - checked > self.version_ttl:
+            version = get_data_version()
+            self.version = (version, time.monotonic())
+
+        return version
+
+
+    def get_key(self, req, route, match):
+        """
+        Returns the cache key for the given request and matched route or None
+        if the request is not to be served from the cache, i.e. if no adapter
+        of the route's resource matches its Accept header.
+        """
+        mimetype = self.get_mimetype(req, route)
+
+        if mimetype is None:
+            return None
+
+        params = tuple(sorted((key, values[0])
+            for key, values in req.GET.dict_of_lists().items()))
+
+        return (req.host_url, route.name, match.get('id'), params, mimetype)
+
+
+    def get_mimetype(self, req, route):
+        """
+        Returns the mimetype of the adapter that clld's resource view would
+        render the request with or None if there is none. The adapters are
+        looked up for an instance of the resource's model, as clld does for
+        the datatables; this does not touch the db.
+        """
+        resources = [rsc for rsc in RESOURCES if rsc.name == route.name]
+
+        if not resources:
+            return None
+
+        adapter = get_adapter(IRepresentation, resources[0].model(), req)
+
+        return adapter.mimetype if adapter is not None else None
+
+
+    def make_response(self, entry, version):
+        """
+        Returns a response built from the given cache entry.
+        """
+        headers, etag, body = decode_entry(entry)
+
+        res = Response(body=body, headerlist=[tuple(header) for header in headers])
+        self.set_cache_headers(res, etag, version)
+
+        return res
+
+
+    def set_cache_headers(self, res, etag, version):
+        """
+        Sets the ETag, Last-Modified, and Cache-Control headers; the response
+        answers conditional requests with 304s.
+        """
+        res.etag = etag
+        res.last_modified = parse_data_version(version)
+        res.cache_control = 'public, max-age={}'.format(self.max_age)
+        res.conditional_response = True
+
+
+    def __call__(self, handler, req):
+        """
+        Serves the request from the cache or, on a miss, passes it on to the
+        handler and caches the response if it is an html page.
+        """
+        if req.method not in ('GET', 'HEAD'):
+            return handler(req)
+
+        info = req.registry.getUtility(IRoutesMapper)(req)
+        route = info['route']
+
+        if route is None or route.name not in self.routes:
+            return handler(req)
+
+        key = self.get_key(req, route, info['match'])
+
+        if key is None:
+            return handler(req)
+
+        version = self.get_version()
+
+        entry = self.backend.lookup(version, key)
+        if entry is not None:
+            METRICS.inc('northeuralex_response_cache_total', outcome='hit')
+            res = self.make_response(entry, version)
+            res.headers['X-Cache'] = 'HIT'
+            return res
+
+        METRICS.inc('northeuralex_response_cache_total', outcome='miss')
+        res = handler(req)
+
+        if res.status_int == 200 and res.content_type == 'text/html':
+            entry = encode_entry(res)
+            self.backend.store(version, key, entry)
+            self.set_cache_headers(res, decode_entry(entry)[1], version)
+            METRICS.inc('northeuralex_response_cache_total', outcome='store')
+
+        res.headers['X-Cache'] = 'MISS'
+        return res
+
+
+
+def response_cache_tween_factory(handler, registry):
+    """
+    Tween factory; returns the handler itself if the cache is turned off.
+    """
+    cache = ResponseCache.from_settings(registry.settings)
+    registry.response_cache = cache
+
+    if cache is None:
+        return handler
+
+    return lambda req: cache(handler, req)
+
+
+
+def includeme(config):
+    """
+    Adds the tween under pyramid_tm, so that the data version lookup happens
+    within the request's transaction.
+    """
+    config.add_tween('northeuralex.response_cache.response_cache_tween_factory',
+            under=('pyramid_tm.tm_tween_factory', INGRESS))
@@ -0,0 +1,26 @@
+import argparse
+
+from northeuralex.precompressed import STATIC_DIR, compress_static
+
+
+
+"""
+The cli
+
+Writes the compressed siblings of the app's static files, see the
+precompressed module. initializedb's prime_cache step does the same after
+writing the downloads; this is for when files in the static dir are added or
+changed by hand.
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='write .gz and .br siblings of the static files')
+    parser.add_argument('--static-dir', default=str(STATIC_DIR),
+            help='the dir to compress the files of; defaults to the app\'s')
+    parser.add_argument('--min-size', type=int, default=1024,
+            help='files smaller than this many bytes are skipped')
+
+    args = parser.parse_args()
+
+    for path in compress_static(args.static_dir, args.min_size):
+        print(path)
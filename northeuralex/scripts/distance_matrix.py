@@ -0,0 +1,187 @@
+import concurrent.futures
+import os
+import os.path
+import tempfile
+import time
+
+import numpy as np
+
+from clld.scripts.util import parsed_args
+
+from northeuralex.adapters import DOWNLOADS_DIR
+from northeuralex.distances import compute_distances, load_forms
+
+
+
+"""
+Shared forms
+
+The integer-coded forms (see the distances module) are written once into .npy
+files in a temporary dir, stacked into a (doculect, concept, segment) codes
+array and a (doculect, concept) lengths array. The worker processes map these
+files into memory, so that the forms are shared via the page cache rather than
+pickled for each task; the tasks only carry the temp dir's path and the
+doculect index pairs.
+"""
+
+class SharedForms:
+    """
+    Read-only view of the forms written by write_shared_forms, with the same
+    get_pair method as distances.Forms but taking doculect indices.
+    """
+
+    def __init__(self, directory):
+        """
+        Constructor.
+        """
+        self.codes = np.load(os.path.join(directory, 'codes.npy'), mmap_mode='r')
+        self.lengths = np.load(os.path.join(directory, 'lengths.npy'), mmap_mode='r')
+
+
+    def get_pair(self, index_a, index_b):
+        """
+        Returns the (codes a, lengths a, codes b, lengths b) arrays of the
+        concepts that both doculects have forms for.
+        """
+        lengths_a, lengths_b = self.lengths[index_a], self.lengths[index_b]
+        shared = (lengths_a > 0) & (lengths_b > 0)
+
+        return (self.codes[index_a][shared], lengths_a[shared],
+                self.codes[index_b][shared], lengths_b[shared])
+
+
+
+def write_shared_forms(forms, directory):
+    """
+    Writes the given distances.Forms instance into the given dir. Returns the
+    list of the doculect ids in the order of the arrays' first axis.
+    """
+    doculect_ids = sorted(forms.codes)
+
+    np.save(os.path.join(directory, 'codes.npy'),
+            np.stack([forms.codes[doculect_id] for doculect_id in doculect_ids]))
+    np.save(os.path.join(directory, 'lengths.npy'),
+            np.stack([forms.lengths[doculect_id] for doculect_id in doculect_ids]))
+
+    return doculect_ids
+
+
+
+"""
+The workers keep the SharedForms instance of the dir they have been pointed
+to, so that the files are only opened once per process.
+"""
+_shared_forms = {}
+
+
+def compute_chunk(directory, pairs):
+    """
+    Task run in the worker processes: returns the list of the (index a, index
+    b, distance, number of shared concepts) tuples of the given pairs.
+    """
+    if directory not in _shared_forms:
+        _shared_forms[directory] = SharedForms(directory)
+
+    results = compute_distances(_shared_forms[directory], pairs)
+
+    return [(index_a, index_b, distance, shared)
+            for (index_a, index_b), (distance, shared) in results.items()]
+
+
+
+"""
+Matrix
+"""
+
+def build_matrix(forms, workers=None, chunk_size=100):
+    """
+    Computes the distances between all the doculects of the given Forms
+    instance, splitting the pairs into chunks of the given size that are run
+    across a pool of the given number of processes.
+
+    Returns the list of the doculect ids, the square float32 array of the
+    distances (NaN where two doculects share no concepts), and the int32 array
+    of the numbers of shared concepts.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doculect_ids = write_shared_forms(forms, temp_dir)
+        size = len(doculect_ids)
+
+        distances = np.zeros((size, size), dtype=np.float32)
+        shared = np.zeros((size, size), dtype=np.int32)
+        shared[np.diag_indices(size)] = np.count_nonzero(
+                np.load(os.path.join(temp_dir, 'lengths.npy')), axis=1)
+
+        pairs = [(index_a, index_b) for index_a in range(size)
+                for index_b in range(index_a + 1, size)]
+
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(compute_chunk, temp_dir,
+                    pairs[index:index+chunk_size])
+                    for index in range(0, len(pairs), chunk_size)]
+
+            for future in concurrent.futures.as_completed(futures):
+                for index_a, index_b, distance, num_shared in future.result():
+                    value = np.nan if distance is None else distance
+                    distances[index_a, index_b] = distances[index_b, index_a] = value
+                    shared[index_a, index_b] = shared[index_b, index_a] = num_shared
+
+    return doculect_ids, distances, shared
+
+
+
+def write_matrix(doculect_ids, distances, output_dir, name='distances'):
+    """
+    Writes the given matrix into the given dir as {name}.npy, which can be
+    loaded with numpy.load(path, mmap_mode='r'), and as {name}.tsv, the header
+    of which gives the order of the doculects in both files. Returns the
+    paths of the two files.
+    """
+    npy_path = os.path.join(str(output_dir), name + '.npy')
+    tsv_path = os.path.join(str(output_dir), name + '.tsv')
+
+    with open(npy_path + '.tmp', 'wb') as f:
+        np.save(f, distances)
+    os.replace(npy_path + '.tmp', npy_path)
+
+    with open(tsv_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('\t'.join([''] + doculect_ids) + '\n')
+        for doculect_id, row in zip(doculect_ids, distances):
+            f.write('\t'.join([doculect_id] + [
+                '' if np.isnan(value) else '{:.4f}'.format(value) for value in row]) + '\n')
+    os.replace(tsv_path + '.tmp', tsv_path)
+
+    return npy_path, tsv_path
+
+
+
+"""
+The cli
+
+Uses clld's argument parsing so that the db is specified in the same way as
+for initializedb, i.e. by the path to the app's ini file. The matrix is
+written into the static downloads dir by default, from where the app serves
+it as it is.
+"""
+if __name__ == '__main__':
+    args = parsed_args(
+        (('--workers',), {'type': int, 'default': os.cpu_count(),
+            'help': 'the number of worker processes'}),
+        (('--chunk-size',), {'type': int, 'default': 100,
+            'help': 'the number of doculect pairs per task'}),
+        (('--output-dir',), {'default': str(DOWNLOADS_DIR),
+            'help': 'the dir to write distances.npy and distances.tsv into'}),
+        description='write the NED matrix of all the doculects')
+
+    start = time.perf_counter()
+    forms = load_forms()
+    args.log.info('loaded the forms of {} doculects in {:.2f}s'.format(
+        len(forms.codes), time.perf_counter() - start))
+
+    start = time.perf_counter()
+    doculect_ids, distances, _ = build_matrix(forms, args.workers, args.chunk_size)
+    args.log.info('computed {} pairs in {:.2f}s'.format(
+        len(doculect_ids) * (len(doculect_ids) - 1) // 2, time.perf_counter() - start))
+
+    for path in write_matrix(doculect_ids, distances, args.output_dir):
+        args.log.info('wrote {}'.format(path))
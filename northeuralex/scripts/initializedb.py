@@ -1,19 +1,105 @@
+import array
 import collections
+import concurrent.futures
+import contextlib
 import csv
+import itertools
+import queue
+import threading
+import time
 
 from clld.db.meta import DBSession
 from clld.db.models import common
 from clld.lib import bibtex
 from clld.scripts.util import bibtex2source, initializedb
 
+from sqlalchemy import func
+
+from northeuralex.adapters import write_downloads, write_geojson
+from northeuralex.cache import new_data_version
+from northeuralex.db import mark_changed
+from northeuralex.precompressed import compress_static
 from northeuralex.models import Concept, Doculect, Synset, Word
+from northeuralex.search import build_search_index, delete_from_search_index
 
 
 
 """
 Dataset classes
+
+Each of the dataset files is read in a single pass into columns (see
+read_columns) and the per-field transformations, e.g. the IPA normalisation,
+are applied to whole columns at once. The gen_* methods are views over the
+load_columns output that yield one named tuple per row. The main dataset can
+also be read in batches of rows, see gen_word_batches.
 """
 
+def read_columns(dataset_fp, dialect):
+    """
+    Reads the tsv file at the given path and returns an OrderedDict mapping
+    the names in its header to lists holding the respective column's values.
+    """
+    return next(read_column_batches(dataset_fp, dialect, None))
+
+
+
+def read_column_batches(dataset_fp, dialect, batch_size):
+    """
+    Does the same as read_columns but yields an OrderedDict for each batch of
+    at most batch_size rows; if the latter is None, all the rows make up one
+    batch. A file without rows yields one batch of empty columns. Blank lines
+    are skipped, as csv.DictReader does; a row with the wrong number of fields
+    raises a ValueError.
+    """
+    with open(dataset_fp, 'r', encoding='utf-8') as f:
+        reader = csv.reader(f, dialect=dialect)
+        header = next(reader)
+        num_rows = 0
+
+        def gen_rows():
+            for row in reader:
+                if not row:
+                    continue
+
+                if len(row) != len(header):
+                    raise ValueError('{}: line {} has {} fields instead of {}'.format(
+                        dataset_fp, reader.line_num, len(row), len(header)))
+
+                yield row
+
+        row_iter = gen_rows()
+
+        while True:
+            rows = list(itertools.islice(row_iter, batch_size))
+
+            if rows:
+                columns = [list(column) for column in zip(*rows)]
+            elif num_rows:
+                break
+            else:
+                columns = [[] for field in header]
+
+            yield collections.OrderedDict(zip(header, columns))
+
+            num_rows += len(rows)
+            if not rows or batch_size is None:
+                break
+
+
+
+def map_column(column, func):
+    """
+    Applies a str -> str func to all the values of the given column at once by
+    joining these into a single string. The func must not add or remove line
+    breaks, which the values cannot contain as they come from a tsv file.
+    """
+    if not column:
+        return []
+
+    return func('\n'.join(column)).split('\n')
+
+
+
 class LangDataset:
     """
     Handles reading the NorthEuraLex' language data dataset.
@@ -34,24 +120,34 @@ class LangDataset:
         'family', 'subfamily', 'latitude', 'longitude'])
 
 
-    def __init__(self, dataset_fp):
+    def __init__(self, dataset_fp, columns=None):
         """
-        Constructor.
+        Constructor. The load_columns output can be given if the dataset has
+        been read already, e.g. in a worker thread.
         """
         self.dataset_fp = dataset_fp
+        self.columns = columns
+
+
+    def load_columns(self):
+        """
+        Returns an OrderedDict mapping the Language fields to the respective
+        columns of the dataset.
+        """
+        if self.columns is not None:
+            return self.columns
+
+        columns = read_columns(self.dataset_fp, self.LangDatasetDialect)
+
+        return collections.OrderedDict(
+                (field, columns[field]) for field in self.Language._fields)
 
 
     def gen_langs(self):
         """
         Yields a Language named tuple at a time.
         """
-        with open(self.dataset_fp, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f, dialect=self.LangDatasetDialect)
-            for row in reader:
-                yield self.Language(row['name'],
-                        row['iso_code'], row['glotto_code'],
-                        row['family'], row['subfamily'],
-                        row['latitude'], row['longitude'])
+        yield from map(self.Language._make, zip(*self.load_columns().values()))
 
 
 
@@ -102,29 +198,52 @@ class ConceptDataset:
             return gloss
 
 
-    def __init__(self, dataset_fp):
+    @staticmethod
+    def make_gloss_column(glosses, annotations):
         """
-        Constructor.
+        Column version of make_gloss_field.
+        """
+        return [gloss + ' ' + annotation if annotation and annotation != '[]' else gloss
+                for gloss, annotation in zip(glosses, annotations)]
+
+
+    def __init__(self, dataset_fp, columns=None):
+        """
+        Constructor. The load_columns output can be given if the dataset has
+        been read already, e.g. in a worker thread.
         """
         self.dataset_fp = dataset_fp
+        self.columns = columns
+
+
+    def load_columns(self):
+        """
+        Returns an OrderedDict mapping the Concept fields to the respective
+        columns of the dataset. The concepticon_id column is an array of ints.
+        """
+        if self.columns is not None:
+            return self.columns
+
+        columns = read_columns(self.dataset_fp, self.ConceptDatasetDialect)
+
+        germans = [self.extract_german(concept_id) for concept_id in columns['id_nelex']]
+
+        return collections.OrderedDict([
+            ('id', columns['id_nelex']),
+            ('name', map_column(columns['concepticon_proposed'],
+                    lambda s: s.replace('_', ' '))),
+            ('german', self.make_gloss_column(germans, columns['annotation_de'])),
+            ('english', self.make_gloss_column(columns['gloss_en'], columns['annotation_en'])),
+            ('russian', self.make_gloss_column(columns['gloss_ru'], columns['annotation_ru'])),
+            ('concepticon_id', array.array('l', map(int, columns['concepticon_id']))),
+            ('concepticon_name', columns['concepticon'])])
 
 
     def gen_concepts(self):
         """
         Yields a Concept named tuple at a time.
         """
-        with open(self.dataset_fp, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f, dialect=self.ConceptDatasetDialect)
-            for line in reader:
-                yield self.Concept(
-                        line['id_nelex'],
-                        line['concepticon_proposed'].replace('_', ' '),
-                        self.make_gloss_field(self.extract_german(line['id_nelex']),
-                                line['annotation_de']),
-                        self.make_gloss_field(line['gloss_en'], line['annotation_en']),
-                        self.make_gloss_field(line['gloss_ru'], line['annotation_ru']),
-                        int(line['concepticon_id']),
-                        line['concepticon'])
+        yield from map(self.Concept._make, zip(*self.load_columns().values()))
 
 
 
@@ -165,20 +284,46 @@ class MainDataset:
         self.dataset_fp = dataset_fp
 
 
+    def load_columns(self):
+        """
+        Returns an OrderedDict mapping the Word fields to the respective
+        columns of the dataset.
+        """
+        return self.make_columns(read_columns(self.dataset_fp, self.MainDatasetDialect))
+
+
+    def make_columns(self, columns):
+        """
+        Returns an OrderedDict mapping the Word fields to the respective
+        columns of the given read_columns output.
+        """
+        return collections.OrderedDict([
+            ('iso_code', columns['Language_ID']),
+            ('glotto_code', columns['Glottocode']),
+            ('concept', columns['Concept_ID']),
+            ('form', columns['Word_Form']),
+            ('raw_ipa', columns['rawIPA']),
+            ('norm_ipa', map_column(columns['IPA'], self.normalise_ipa)),
+            ('next_step', columns['Next_Step'])])
+
+
     def gen_words(self):
         """
         Yields a Word named tuple at a time.
         """
-        with open(self.dataset_fp, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f, dialect=self.MainDatasetDialect)
-            for line in reader:
-                yield self.Word(line['Language_ID'],
-                            line['Glottocode'],
-                            line['Concept_ID'],
-                            line['Word_Form'],
-                            line['rawIPA'],
-                            self.normalise_ipa(line['IPA']),
-                            line['Next_Step'])
+        yield from map(self.Word._make, zip(*self.load_columns().values()))
+
+
+    def gen_word_batches(self, batch_size=5000):
+        """
+        Yields lists of at most batch_size Word named tuples, reading the
+        dataset file one batch at a time.
+        """
+        for columns in read_column_batches(
+                self.dataset_fp, self.MainDatasetDialect, batch_size):
+            words = list(map(self.Word._make, zip(*self.make_columns(columns).values())))
+            if words:
+                yield words
 
 
 
@@ -192,7 +337,8 @@ def add_meta_data(session):
     related model instances that comprise the project's meta info.
 
     Helper for the main function that keeps the meta data in one place for
-    easier reference and editing.
+    easier reference and editing. Also sets a new data version, thus
+    invalidating the caches of any running app (see the cache module).
     """
     dataset = common.Dataset(id='northeuralex',
             name='NorthEuraLex',
@@ -202,7 +348,8 @@ def add_meta_data(session):
             license='https://creativecommons.org/licenses/by-sa/4.0/',
             jsondata={
                 'license_icon': 'cc-by-sa.png',
-                'license_name': 'Creative Commons Attribution-ShareAlike 4.0 International License'},
+                'license_name': 'Creative Commons Attribution-ShareAlike 4.0 International License',
+                'data_version': new_data_version()},
             contact='jdellert@sfs.uni-tuebingen.de',
             domain='northeuralex.org')
     session.add(dataset)
@@ -214,11 +361,12 @@ def add_meta_data(session):
 
 
 
-def add_sources(sources_file_path, session):
+def add_sources(sources_file_path, session, bibtex_db=None):
     """
     Creates and adds to the given SQLAlchemy session the common.Source model
     instances that comprise the project's references. Expects the path to a
-    bibtex file as its first argument.
+    bibtex file as its first argument; the bibtex.Database can be given
+    instead if the file has been parsed already.
 
     Returns a dict containing the added model instances with the bibtex IDs
     being the keys.
@@ -227,7 +375,8 @@ def add_sources(sources_file_path, session):
     """
     d = {}
 
-    bibtex_db = bibtex.Database.from_file(sources_file_path, encoding='utf-8')
+    if bibtex_db is None:
+        bibtex_db = bibtex.Database.from_file(sources_file_path, encoding='utf-8')
 
     for record in bibtex_db:
         d[record.id] = bibtex2source(record)
@@ -256,7 +405,8 @@ def add_concepts(concepts_dataset, session):
                 german_name=concept.german,
                 russian_name=concept.russian,
                 concepticon_id=concept.concepticon_id,
-                concepticon_name=concept.concepticon_name)
+                concepticon_name=concept.concepticon_name,
+                jsondata={'id_nelex': concept.id})
 
         session.add(d[concept.id])
 
@@ -305,23 +455,14 @@ def add_doculects(lang_dataset, session, sources={}):
 
 
 
-def main(args):
+def add_words(main_dataset, session, concepts, doculects):
     """
-    Populates the database. Expects: (1) the db to be empty; (2) the main_data,
-    lang_data, concept_data, and sources_data args to be present in the given
-    argparse.Namespace instance.
+    Creates and adds to the given SQLAlchemy session the Synset and Word
+    instances harvested from the given MainDataset instance. Expects the dicts
+    returned by add_concepts and add_doculects.
 
-    This function is called within a db transaction, the latter being handled
-    by initializedb.
+    Helper for the main function.
     """
-    main_dataset = MainDataset(args.main_data)
-
-    add_meta_data(DBSession)
-
-    sources = add_sources(args.sources_data, DBSession)
-    concepts = add_concepts(ConceptDataset(args.concept_data), DBSession)
-    doculects = add_doculects(LangDataset(args.lang_data), DBSession, sources)
-
     last_synset = None
 
     for word in main_dataset.gen_words():
@@ -335,14 +476,661 @@ def main(args):
             last_synset = Synset(id='{}-{}'.format(word.iso_code, word.concept),
                     language=doculects[word.iso_code],
                     parameter=concepts[word.concept])
-            DBSession.add(last_synset)
+            session.add(last_synset)
 
-        DBSession.add(Word(id='{}-{}-{}'.format(word.iso_code, word.concept, word.form),
+        session.add(Word(id='{}-{}-{}'.format(word.iso_code, word.concept, word.form),
                 valueset=last_synset,
                 name=word.form,
                 raw_ipa=word.raw_ipa,
                 norm_ipa=word.norm_ipa,
-                next_step=word.next_step))
+                next_step=word.next_step,
+                language_pk=doculects[word.iso_code].pk,
+                parameter_pk=concepts[word.concept].pk))
+
+
+
+class BulkWriter:
+    """
+    Writes rows into the tables of a joined-table inheritance model using
+    batched executemany inserts, bypassing the ORM's unit of work. The rows of
+    the base table are written before those of the subclass table so that the
+    foreign keys are always satisfied.
+
+    Keeps track of the number of rows written into and the time spent on each
+    of the tables.
+    """
+
+    def __init__(self, session, model, batch_size=5000, parent=None):
+        """
+        Constructor. The model should be a CustomModelMixin subclass, e.g. Word.
+        If the rows reference the rows of another BulkWriter, the latter should
+        be provided as parent so that it is always flushed first.
+        """
+        self.session = session
+        self.batch_size = batch_size
+        self.parent = parent
+
+        self.tables = [model.__mapper__.inherits.local_table,
+                        model.__mapper__.local_table]
+        self.batches = [[] for table in self.tables]
+
+        self.stats = collections.OrderedDict(
+                (table.name, [0, 0.0]) for table in self.tables)
+
+        self.next_pk = 1 + (session.query(
+                func.max(self.tables[0].c.pk)).scalar() or 0)
+
+
+    def add(self, base_row, sub_row):
+        """
+        Queues a row to be inserted; the args should be dicts mapping the
+        column names of the base and the subclass table to values. The primary
+        key is assigned here and returned.
+        """
+        pk = self.next_pk
+        self.next_pk += 1
+
+        base_row['pk'] = pk
+        sub_row['pk'] = pk
+
+        self.batches[0].append(base_row)
+        self.batches[1].append(sub_row)
+
+        if len(self.batches[0]) >= self.batch_size:
+            self.flush()
+
+        return pk
+
+
+    def flush(self):
+        """
+        Inserts the queued rows, one executemany statement per table.
+        """
+        if self.parent is not None:
+            self.parent.flush()
+
+        for table, batch in zip(self.tables, self.batches):
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            self.session.execute(table.insert(), batch)
+
+            self.stats[table.name][0] += len(batch)
+            self.stats[table.name][1] += time.perf_counter() - start
+
+            del batch[:]
+
+        mark_changed(self.session)
+
+
+
+def bulk_add_words(main_dataset, session, concepts, doculects, batch_size=5000):
+    """
+    Does the same as add_words but writes the value, word, valueset, and synset
+    tables directly with executemany inserts and pre-assigned primary keys. The
+    resulting rows are identical to those that add_words would produce.
+
+    Returns an OrderedDict mapping the table names to (number of rows, seconds)
+    tuples.
+
+    Helper for the main function.
+    """
+    synsets = BulkWriter(session, Synset, batch_size)
+    words = BulkWriter(session, Word, batch_size, parent=synsets)
+
+    last_key, last_synset_pk = None, None
+
+    for word in main_dataset.gen_words():
+        assert word.concept in concepts
+        assert word.iso_code in doculects
+
+        if (word.iso_code, word.concept) != last_key:
+            last_key = (word.iso_code, word.concept)
+            last_synset_pk = synsets.add({
+                    'id': '{}-{}'.format(word.iso_code, word.concept),
+                    'language_pk': doculects[word.iso_code].pk,
+                    'parameter_pk': concepts[word.concept].pk,
+                    'jsondata': {},
+                    'polymorphic_type': 'custom'}, {})
+
+        words.add({
+                'id': '{}-{}-{}'.format(word.iso_code, word.concept, word.form),
+                'valueset_pk': last_synset_pk,
+                'name': word.form,
+                'jsondata': {},
+                'polymorphic_type': 'custom'}, {
+                'raw_ipa': word.raw_ipa,
+                'norm_ipa': word.norm_ipa,
+                'next_step': word.next_step,
+                'language_pk': doculects[word.iso_code].pk,
+                'parameter_pk': concepts[word.concept].pk})
+
+    words.flush()
+
+    return collections.OrderedDict(
+            [(name, tuple(stat)) for name, stat in synsets.stats.items()] +
+            [(name, tuple(stat)) for name, stat in words.stats.items()])
+
+
+
+"""
+Incremental sync
+
+Instead of populating an empty db, the functions here bring a populated db in
+line with the datasets by diffing the two on the natural IDs: the NorthEuraLex
+concept IDs for the concepts, the ISO codes for the doculects, and the
+iso-concept-form IDs for the words. Only the rows that differ are inserted,
+updated, or deleted; the rest of the db is not touched.
+"""
+
+SyncStats = collections.namedtuple('SyncStats', ['inserted', 'updated', 'deleted'])
+
+
+def diff_keys(old, new):
+    """
+    Compares two dicts mapping natural IDs to tuples of field values. Returns
+    the lists of the keys to be inserted, updated, and deleted.
+    """
+    inserted = [key for key in new if key not in old]
+    updated = [key for key in new if key in old and new[key] != old[key]]
+    deleted = [key for key in old if key not in new]
+
+    return inserted, updated, deleted
+
+
+
+def query_by_pks(session, model, pks, chunk_size=500):
+    """
+    Yields the instances of the given model with the given primary keys,
+    querying these in chunks so as to stay within the db's parameter limits.
+    """
+    pks = list(pks)
+
+    for index in range(0, len(pks), chunk_size):
+        yield from session.query(model).filter(
+                model.pk.in_(pks[index:index+chunk_size]))
+
+
+
+def get_concept_keys(session):
+    """
+    Returns a dict mapping the db's concepts to their NorthEuraLex IDs. These
+    are stored in the concepts' jsondata by add_concepts; for dbs populated
+    before that, the IDs are recovered from the concepts' synsets.
+    """
+    keys = {}
+
+    for concept in session.query(Concept):
+        if (concept.jsondata or {}).get('id_nelex'):
+            keys[concept] = concept.jsondata['id_nelex']
+
+    missing = {concept.pk: concept
+            for concept in session.query(Concept) if concept not in keys}
+
+    if missing:
+        for parameter_pk, synset_id in session.query(
+                Synset.parameter_pk, Synset.id).select_from(Synset):
+            if parameter_pk in missing:
+                keys[missing.pop(parameter_pk)] = synset_id.split('-', 1)[1]
+
+    return keys
+
+
+
+def sync_concepts(concepts_dataset, session):
+    """
+    Syncs the db's concepts with the given ConceptDataset instance. The
+    concepts to be deleted are only returned as their synsets have to be
+    deleted first. New concepts get IDs following the highest existing one.
+
+    Returns a (concepts, removed, stats) tuple: a dict of the dataset's
+    Concept instances with the NorthEuraLex concept IDs being the keys, the
+    list of Concept instances that are not in the dataset, and a SyncStats.
+
+    Helper for the sync_db function.
+    """
+    fields = ['name', 'english_name', 'german_name', 'russian_name',
+            'concepticon_id', 'concepticon_name']
+
+    existing = {key: concept for concept, key in get_concept_keys(session).items()}
+    old = {key: tuple(getattr(concept, field) for field in fields)
+            for key, concept in existing.items()}
+    new = collections.OrderedDict(
+            (concept.id, (concept.name, concept.english, concept.german,
+                concept.russian, concept.concepticon_id, concept.concepticon_name))
+            for concept in concepts_dataset.gen_concepts())
+
+    inserted, updated, deleted = diff_keys(old, new)
+
+    next_id = 1 + max([int(concept.id) for concept in existing.values()] or [0])
+
+    for key in inserted:
+        existing[key] = Concept(id=str(next_id),
+                jsondata={'id_nelex': key}, **dict(zip(fields, new[key])))
+        session.add(existing[key])
+        next_id += 1
+
+    for key in updated:
+        for field, value in zip(fields, new[key]):
+            setattr(existing[key], field, value)
+
+    for key in new:
+        if (existing[key].jsondata or {}).get('id_nelex') != key:
+            existing[key].jsondata = dict(existing[key].jsondata or {}, id_nelex=key)
+
+    session.flush()
+
+    return ({key: existing[key] for key in new},
+            [existing[key] for key in deleted],
+            SyncStats(len(inserted), len(updated), len(deleted)))
+
+
+
+def sync_doculects(lang_dataset, session, sources={}):
+    """
+    Syncs the db's doculects with the given LangDataset instance. Works in the
+    same way as sync_concepts; the optional arg is the same as that of
+    add_doculects and is used for linking the newly inserted doculects.
+
+    Helper for the sync_db function.
+    """
+    fields = ['name', 'glotto_code', 'family', 'subfamily', 'latitude', 'longitude']
+
+    existing = {doculect.iso_code: doculect for doculect in session.query(Doculect)}
+    old = {key: tuple(getattr(doculect, field) for field in fields)
+            for key, doculect in existing.items()}
+    new = collections.OrderedDict(
+            (lang.iso_code, (lang.name, lang.glotto_code, lang.family,
+                lang.subfamily, float(lang.latitude), float(lang.longitude)))
+            for lang in lang_dataset.gen_langs())
+
+    inserted, updated, deleted = diff_keys(old, new)
+
+    for key in inserted:
+        existing[key] = Doculect(id=key, iso_code=key, **dict(zip(fields, new[key])))
+        session.add(existing[key])
+
+    for key in updated:
+        for field, value in zip(fields, new[key]):
+            setattr(existing[key], field, value)
+
+    session.flush()
+
+    for key, source in sources.items():
+        if key[:3] in inserted:
+            session.add(common.LanguageSource(
+                language_pk=existing[key[:3]].pk,
+                source_pk=source.pk))
+
+    session.flush()
+
+    return ({key: existing[key] for key in new},
+            [existing[key] for key in deleted],
+            SyncStats(len(inserted), len(updated), len(deleted)))
+
+
+
+def sync_words(main_dataset, session, concepts, doculects):
+    """
+    Syncs the db's words and synsets with the given MainDataset instance.
+    Expects the dicts returned by sync_concepts and sync_doculects. The synsets
+    that are left without words are deleted.
+
+    Returns a (synset stats, word stats) tuple of SyncStats.
+
+    Helper for the sync_db function.
+    """
+    fields = ['name', 'raw_ipa', 'norm_ipa', 'next_step']
+
+    old, word_pks = {}, {}
+    for row in session.query(Word.pk, Word.id,
+            *[getattr(Word, field) for field in fields]).select_from(Word):
+        word_pks[row[1]] = row[0]
+        old[row[1]] = tuple(row[2:])
+
+    new, keys = collections.OrderedDict(), {}
+    for word in main_dataset.gen_words():
+        assert word.concept in concepts
+        assert word.iso_code in doculects
+
+        word_id = '{}-{}-{}'.format(word.iso_code, word.concept, word.form)
+        new[word_id] = (word.form, word.raw_ipa, word.norm_ipa, word.next_step)
+        keys[word_id] = (word.iso_code, word.concept)
+
+    inserted, updated, deleted = diff_keys(old, new)
+
+    synset_pks = dict(session.query(Synset.id, Synset.pk).select_from(Synset))
+    new_synsets = []
+
+    for iso_code, concept in collections.OrderedDict.fromkeys(
+            keys[word_id] for word_id in inserted):
+        synset_id = '{}-{}'.format(iso_code, concept)
+        if synset_id not in synset_pks:
+            synset = Synset(id=synset_id,
+                    language=doculects[iso_code],
+                    parameter=concepts[concept])
+            session.add(synset)
+            new_synsets.append(synset)
+
+    session.flush()
+    synset_pks.update((synset.id, synset.pk) for synset in new_synsets)
+
+    new_words = []
+
+    for word_id in inserted:
+        iso_code, concept = keys[word_id]
+        new_words.append(Word(id=word_id,
+                valueset_pk=synset_pks['{}-{}'.format(iso_code, concept)],
+                language_pk=doculects[iso_code].pk,
+                parameter_pk=concepts[concept].pk,
+                **dict(zip(fields, new[word_id]))))
+        session.add(new_words[-1])
+
+    for word in query_by_pks(session, Word, [word_pks[word_id] for word_id in updated]):
+        for field, value in zip(fields, new[word.id]):
+            setattr(word, field, value)
+
+    delete_from_search_index(session, [word_pks[word_id] for word_id in deleted])
+
+    for word in query_by_pks(session, Word, [word_pks[word_id] for word_id in deleted]):
+        session.delete(word)
+
+    session.flush()
+
+    build_search_index(session, [word.pk for word in new_words]
+            + [word_pks[word_id] for word_id in updated])
+
+    empty = session.query(Synset).filter(~Synset.values.any()).all()
+    for synset in empty:
+        session.delete(synset)
+
+    session.flush()
+
+    return (SyncStats(len(new_synsets), 0, len(empty)),
+            SyncStats(len(inserted), len(updated), len(deleted)))
+
+
+
+def sync_db(main_dataset, lang_dataset, concepts_dataset, session):
+    """
+    Brings the db in line with the given datasets, see the section's comment.
+    Also sets a new data version if anything has changed. The sources are not
+    synced; the existing ones are linked to the newly added doculects.
+
+    Returns an OrderedDict mapping the table names to SyncStats.
+
+    Helper for the main function; runs within its transaction, so that either
+    all or none of the changes are applied.
+    """
+    sources = {source.id: source for source in session.query(common.Source)}
+
+    concepts, removed_concepts, concept_stats = sync_concepts(concepts_dataset, session)
+    doculects, removed_doculects, doculect_stats = sync_doculects(
+            lang_dataset, session, sources)
+    synset_stats, word_stats = sync_words(main_dataset, session, concepts, doculects)
+
+    for doculect in removed_doculects:
+        session.query(common.LanguageSource) \
+                .filter(common.LanguageSource.language_pk == doculect.pk) \
+                .delete(synchronize_session=False)
+        session.delete(doculect)
+
+    for concept in removed_concepts:
+        session.delete(concept)
+
+    session.flush()
+
+    stats = collections.OrderedDict([
+        ('concept', concept_stats), ('doculect', doculect_stats),
+        ('synset', synset_stats), ('word', word_stats)])
+
+    dataset = session.query(common.Dataset).first()
+    if dataset is not None and any(map(any, stats.values())):
+        dataset.jsondata = dict(dataset.jsondata, data_version=new_data_version())
+
+    return stats
+
+
+
+"""
+Pipelined import
+
+The files are parsed concurrently in worker threads: the sources, concepts,
+and doculects in one thread each, and the main dataset in batches of words by
+a producer thread that puts these into a bounded queue. The main thread is
+the only one to use the db session: it inserts the sources, concepts, and
+doculects once these are parsed and then the word batches as they come in,
+so that parsing the words and inserting them overlap. The producer blocks
+while the queue is full, so that no more than queue_size batches are held in
+memory.
+
+Threads rather than processes are used as the parsed records would have to be
+pickled back to the main process, whereas the db writes release the GIL.
+"""
+
+class StageTimer:
+    """
+    Thread-safe record of the time spent in each stage of the import, in the
+    order in which the stages are first entered.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.lock = threading.Lock()
+        self.stages = collections.OrderedDict()
+
+
+    def add(self, name, seconds):
+        """
+        Adds the given number of seconds to the given stage.
+        """
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager timing the code block as (part of) the given stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+
+
+class QueuedWords:
+    """
+    Stands in for a MainDataset in add_words and bulk_add_words, yielding the
+    words of the batches put into the queue by produce_words. The time spent
+    waiting for batches is added to the timer's wait stage.
+    """
+
+    DONE = object()
+
+    def __init__(self, batches, timer):
+        """
+        Constructor.
+        """
+        self.batches = batches
+        self.timer = timer
+
+
+    def gen_words(self):
+        """
+        Yields a Word named tuple at a time until the producer is done;
+        re-raises the producer's exception if it has failed.
+        """
+        while True:
+            with self.timer.stage('wait for words'):
+                batch = self.batches.get()
+
+            if batch is self.DONE:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+
+            yield from batch
+
+
+
+def produce_words(main_dataset, batches, stop, timer, batch_size=5000):
+    """
+    Puts the batches of the given MainDataset's words into the given queue,
+    followed by QueuedWords.DONE or the exception that has occurred. Returns
+    early if the stop event is set, i.e. if the consumer has failed.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        gen_batches = main_dataset.gen_word_batches(batch_size)
+        while True:
+            with timer.stage('parse words'):
+                batch = next(gen_batches, None)
+            if batch is None or not put(batch):
+                break
+    except Exception as error:
+        put(error)
+    else:
+        put(QueuedWords.DONE)
+
+
+
+def run_pipeline(args, session, batch_size=5000, queue_size=4):
+    """
+    Populates the db from the datasets given in args as described in the
+    section's comment. Returns the (word stats, timer) tuple, the word stats
+    being the bulk_add_words output if the bulk flag is set and None
+    otherwise.
+    """
+    timer = StageTimer()
+    batches, stop = queue.Queue(maxsize=queue_size), threading.Event()
+
+    def parse(name, func):
+        with timer.stage(name):
+            return func()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        producer = executor.submit(produce_words, MainDataset(args.main_data),
+                batches, stop, timer, batch_size)
+
+        sources_future = executor.submit(parse, 'parse sources',
+                lambda: bibtex.Database.from_file(args.sources_data, encoding='utf-8'))
+        concepts_future = executor.submit(parse, 'parse concepts',
+                ConceptDataset(args.concept_data).load_columns)
+        langs_future = executor.submit(parse, 'parse doculects',
+                LangDataset(args.lang_data).load_columns)
+
+        try:
+            bibtex_db = sources_future.result()
+            with timer.stage('write sources'):
+                sources = add_sources(args.sources_data, session, bibtex_db)
+
+            concepts_dataset = ConceptDataset(args.concept_data, concepts_future.result())
+            with timer.stage('write concepts'):
+                concepts = add_concepts(concepts_dataset, session)
+
+            lang_dataset = LangDataset(args.lang_data, langs_future.result())
+            with timer.stage('write doculects'):
+                doculects = add_doculects(lang_dataset, session, sources)
+
+            words = QueuedWords(batches, timer)
+            start = time.perf_counter()
+
+            if getattr(args, 'bulk', False):
+                stats = bulk_add_words(words, session, concepts, doculects, batch_size)
+            else:
+                stats = None
+                add_words(words, session, concepts, doculects)
+                session.flush()
+
+            timer.add('write words', time.perf_counter() - start
+                    - timer.stages.get('wait for words', 0.0))
+        finally:
+            stop.set()
+
+        producer.result()
+
+    return stats, timer
+
+
+
+def main(args):
+    """
+    Populates the database. Expects: (1) the db to be empty; (2) the main_data,
+    lang_data, concept_data, and sources_data args to be present in the given
+    argparse.Namespace instance.
+
+    The files are parsed and the rows inserted in a pipeline, see run_pipeline;
+    the time spent in each of its stages is logged. If the bulk flag is set,
+    the words are inserted via bulk_add_words and the insert rate for each
+    table is logged as well.
+
+    If the sync flag is set, the db is expected to be populated instead and is
+    synced with the datasets via sync_db; the changes are logged.
+
+    Either way, the words' trigram index (see the search module) is kept up to
+    date.
+
+    This function is called within a db transaction, the latter being handled
+    by initializedb.
+    """
+    if getattr(args, 'sync', False):
+        start = time.perf_counter()
+        stats = sync_db(MainDataset(args.main_data), LangDataset(args.lang_data),
+                ConceptDataset(args.concept_data), DBSession)
+        for table, (inserted, updated, deleted) in stats.items():
+            args.log.info('{}: {} inserted, {} updated, {} deleted'.format(
+                table, inserted, updated, deleted))
+        args.log.info('synced in {:.2f}s'.format(time.perf_counter() - start))
+        return
+
+    start = time.perf_counter()
+
+    add_meta_data(DBSession)
+
+    stats, timer = run_pipeline(args, DBSession)
+
+    if stats is not None:
+        for table, (num_rows, seconds) in stats.items():
+            args.log.info('{}: {} rows in {:.2f}s ({:.0f} rows/s)'.format(
+                table, num_rows, seconds, num_rows / seconds if seconds else 0))
+
+    with timer.stage('index words'):
+        args.log.info('word_trigram: {} rows'.format(build_search_index(DBSession)))
+
+    for stage, seconds in timer.stages.items():
+        args.log.info('{}: {:.2f}s'.format(stage, seconds))
+    args.log.info('total: {:.2f}s'.format(time.perf_counter() - start))
+
+
+
+def prime_cache(args):
+    """
+    Renders the unfiltered downloads into static/downloads and the map layers
+    into static/geojson, see the adapters module, and writes the compressed
+    siblings of the static files. Called by initializedb after main, in a
+    separate transaction; can be run on its own with --prime-cache-only.
+    """
+    hashes = write_downloads()
+
+    for filename, digest in sorted(hashes.items()):
+        args.log.info('{}: {}'.format(filename, digest))
+
+    args.log.info('geojson: {} files'.format(write_geojson()))
+    args.log.info('compressed: {} files'.format(len(compress_static())))
 
 
 
@@ -366,6 +1154,12 @@ if __name__ == '__main__':
         'help': 'path to the tsv file that contains the concept data'}]
     sources_data_arg = [('sources_data',), {
         'help': 'path to the bibtex file that contains the references'}]
+    bulk_arg = [('--bulk',), {
+        'action': 'store_true',
+        'help': 'insert the words with batched executemany statements'}]
+    sync_arg = [('--sync',), {
+        'action': 'store_true',
+        'help': 'sync an already populated db with the datasets'}]
 
     initializedb(main_data_arg, lang_data_arg, concept_data_arg,
-            sources_data_arg, create=main)
+            sources_data_arg, bulk_arg, sync_arg, create=main, prime_cache=prime_cache)
@@ -0,0 +1,137 @@
+from clld.db.meta import Base, DBSession
+from clld.db.models.common import Value, ValueSet
+from clld.scripts.util import parsed_args
+
+from sqlalchemy import func, inspect, select
+
+from northeuralex.models import Word, word_trigram
+from northeuralex.search import build_search_index
+
+
+
+"""
+Schema upgrades
+
+The dbs created by initializedb always have the schema defined by the models.
+The functions here bring an existing db in line with the models without having
+to re-populate it: the tables, columns, and indexes that the db lacks are
+added, the denormalised columns of the word table are filled in, and the
+words' trigram index is built. Running the upgrade again is a no-op.
+"""
+
+def add_missing_tables(conn, log=None):
+    """
+    Creates the models' tables (with their indexes) that are missing in the db.
+    """
+    table_names = set(inspect(conn).get_table_names())
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            table.create(conn)
+            if log:
+                log.info('created table {}'.format(table.name))
+
+
+
+def add_missing_columns(conn, log=None):
+    """
+    Adds the columns of the models' tables that are missing in the db. The
+    columns are added without constraints as SQLite cannot alter these.
+    """
+    inspector = inspect(conn)
+    table_names = set(inspector.get_table_names())
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+
+        for col in table.c:
+            if col.name not in existing:
+                conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, col.name, col.type.compile(conn.dialect)))
+                if log:
+                    log.info('added column {}.{}'.format(table.name, col.name))
+
+
+
+def add_missing_indexes(conn, log=None):
+    """
+    Creates the indexes of the models' tables that are missing in the db.
+    """
+    inspector = inspect(conn)
+    table_names = set(inspector.get_table_names())
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+                if log:
+                    log.info('created index {}'.format(index.name))
+
+
+
+def fill_word_columns(conn, log=None):
+    """
+    Copies language_pk and parameter_pk from the words' valuesets into the
+    rows of the word table where these are not set yet.
+    """
+    value, valueset, word = Value.__table__, ValueSet.__table__, Word.__table__
+
+    def from_valueset(col):
+        return select([col]) \
+                .select_from(value.join(valueset, value.c.valueset_pk == valueset.c.pk)) \
+                .where(value.c.pk == word.c.pk).as_scalar()
+
+    res = conn.execute(word.update()
+            .where(word.c.language_pk == None)
+            .values(language_pk=from_valueset(valueset.c.language_pk),
+                    parameter_pk=from_valueset(valueset.c.parameter_pk)))
+
+    if log:
+        log.info('filled in the valueset columns of {} words'.format(res.rowcount))
+
+
+
+def fill_search_index(conn, log=None):
+    """
+    Builds the words' trigram index (see the search module) if it is empty.
+    """
+    if conn.execute(select([func.count()]).select_from(word_trigram)).scalar():
+        return
+
+    num_rows = build_search_index(conn)
+
+    if log:
+        log.info('added {} rows to the trigram index'.format(num_rows))
+
+
+
+def upgrade(engine, log=None):
+    """
+    Runs the schema upgrades against the given engine in one transaction.
+    """
+    with engine.begin() as conn:
+        add_missing_tables(conn, log)
+        add_missing_columns(conn, log)
+        add_missing_indexes(conn, log)
+        fill_word_columns(conn, log)
+        fill_search_index(conn, log)
+
+
+
+"""
+The cli
+
+Uses clld's argument parsing so that the db is specified in the same way as
+for initializedb, i.e. by the path to the app's ini file.
+"""
+if __name__ == '__main__':
+    args = parsed_args()
+    upgrade(DBSession.get_bind(), args.log)
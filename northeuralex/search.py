@@ -0,0 +1,239 @@
+import collections
+
+from clld.db.meta import DBSession
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query
+
+from northeuralex.db import mark_changed
+from northeuralex.models import Concept, Doculect, Word, word_trigram
+
+
+
+"""
+Word search
+
+Substring searches over the words' forms and transcriptions would otherwise be
+LIKE '%...%' scans of the whole word table. Instead, each of the FIELDS is
+split into trigrams (of the lowercased value, with START and END marking its
+boundaries), which are stored in the word_trigram table. A word can only
+contain a string if it has all of the string's trigrams, so the candidates
+are looked up via the trigram index and only these are checked with LIKE,
+on the lowercased field; SQLite's lower() is made to fold case as str.lower
+does (see the db module). Prefix searches use the trigrams of START + the
+string instead.
+
+Strings that are too short to have trigrams fall back to plain LIKE.
+"""
+
+FIELDS = collections.OrderedDict([('name', 1), ('raw_ipa', 2), ('norm_ipa', 3)])
+
+START = '\x02'
+
+END = '\x03'
+
+MODES = ['contains', 'prefix']
+
+
+
+def make_trigrams(value, prefix=False, complete=True):
+    """
+    Returns the set of the trigrams of the given string. If complete is set,
+    the string is a field value and gets both boundary markers; otherwise it
+    is a search string and gets the start marker only if prefix is set.
+    """
+    value = value.lower()
+
+    if complete:
+        value = START + value + END
+    elif prefix:
+        value = START + value
+
+    return {value[index:index+3] for index in range(len(value) - 2)}
+
+
+
+def escape_like(value):
+    """
+    Escapes the LIKE wildcards in the given string, using \\ as escape char.
+    """
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+
+def get_candidates(field, value, prefix=False):
+    """
+    Returns a select of the pks of the words the given field of which may
+    contain (or start with) the given string or None if the string is too
+    short for the index to be of use.
+    """
+    trigrams = make_trigrams(value, prefix=prefix, complete=False)
+
+    if not trigrams:
+        return None
+
+    return select([word_trigram.c.word_pk]) \
+            .where(and_(word_trigram.c.field == FIELDS[field],
+                    word_trigram.c.trigram.in_(sorted(trigrams)))) \
+            .group_by(word_trigram.c.word_pk) \
+            .having(func.count(word_trigram.c.trigram.distinct()) == len(trigrams))
+
+
+
+def get_clauses(field, value, prefix=False):
+    """
+    Returns the list of the WHERE clauses selecting the words the given field
+    of which contains (or starts with) the given string, case-insensitively.
+    """
+    pattern = escape_like(value.lower()) + '%'
+    if not prefix:
+        pattern = '%' + pattern
+
+    clauses = []
+
+    candidates = get_candidates(field, value, prefix)
+    if candidates is not None:
+        clauses.append(Word.pk.in_(candidates))
+
+    clauses.append(func.lower(getattr(Word, field)).like(pattern, escape='\\'))
+
+    return clauses
+
+
+
+def search_words(session, value, fields=tuple(FIELDS), mode='contains', limit=100):
+    """
+    Returns the list of the (word id, iso code, concept id, name, raw ipa, norm
+    ipa) tuples of the words any of the given fields of which match the given
+    string, ordered by word pk.
+    """
+    matches = [and_(*get_clauses(field, value, prefix=(mode == 'prefix')))
+            for field in fields]
+
+    query = session.query(Word.id, Doculect.iso_code, Concept.id,
+                Word.name, Word.raw_ipa, Word.norm_ipa) \
+            .select_from(Word) \
+            .join(Doculect, Word.language_pk == Doculect.pk) \
+            .join(Concept, Word.parameter_pk == Concept.pk) \
+            .filter(Word.active == True) \
+            .filter(or_(*matches))
+
+    return query.order_by(Word.pk).limit(limit).all()
+
+
+
+"""
+Index building
+
+The index is written through either a session, e.g. by initializedb, or a
+connection, e.g. by upgradedb, which runs outside of the zope transaction that
+the sessions join. A session is flushed before the words are read and its
+transaction is marked as changed afterwards (see the db module); a
+connection's transaction is left to whoever began it.
+"""
+
+def build_search_index(bind, word_pks=None, batch_size=10000):
+    """
+    (Re-)builds the trigram index of the given words or, if no pks are given,
+    of all the words, using the given session or connection. Returns the
+    number of rows written.
+    """
+    if not isinstance(bind, Connection):
+        bind.flush()
+
+    if word_pks is not None:
+        word_pks = list(word_pks)
+        delete_from_search_index(bind, word_pks)
+    else:
+        bind.execute(word_trigram.delete())
+
+    query = Query([Word.pk] + [getattr(Word, field) for field in FIELDS]) \
+            .select_from(Word) \
+            .order_by(Word.pk)
+
+    if word_pks is not None:
+        chunks = [word_pks[index:index+500] for index in range(0, len(word_pks), 500)]
+        rows = (row for chunk in chunks
+                for row in bind.execute(query.filter(Word.pk.in_(chunk)).statement))
+    else:
+        rows = bind.execute(query.statement.execution_options(stream_results=True))
+
+    batch, num_rows = [], 0
+
+    for row in rows:
+        for field_code, value in zip(FIELDS.values(), row[1:]):
+            if value:
+                batch.extend({'trigram': trigram, 'field': field_code, 'word_pk': row[0]}
+                        for trigram in make_trigrams(value))
+
+        if len(batch) >= batch_size:
+            bind.execute(word_trigram.insert(), batch)
+            num_rows += len(batch)
+            batch = []
+
+    if batch:
+        bind.execute(word_trigram.insert(), batch)
+        num_rows += len(batch)
+
+    if not isinstance(bind, Connection):
+        mark_changed(bind)
+
+    return num_rows
+
+
+
+def delete_from_search_index(bind, word_pks):
+    """
+    Removes the given words from the trigram index, using the given session
+    or connection.
+    """
+    word_pks = list(word_pks)
+
+    for index in range(0, len(word_pks), 500):
+        bind.execute(word_trigram.delete().where(
+            word_trigram.c.word_pk.in_(word_pks[index:index+500])))
+
+    if not isinstance(bind, Connection):
+        mark_changed(bind)
+
+
+
+"""
+Views
+"""
+
+def search_view(req):
+    """
+    Returns the words matching the q param as json. The optional params are
+    field (one of FIELDS, all of them by default), mode (one of MODES), and
+    limit (between 1 and 1000; out-of-range values are clamped, as SQLite
+    takes a negative LIMIT to mean no limit).
+    """
+    value = req.params.get('q', '')
+    field = req.params.get('field')
+    mode = req.params.get('mode', 'contains')
+
+    try:
+        limit = max(1, min(int(req.params.get('limit', 100)), 1000))
+    except ValueError:
+        limit = 100
+
+    if not value or mode not in MODES or (field and field not in FIELDS):
+        req.response.status = 400
+        return {'error': 'q must be set; field must be one of {}; mode one of {}'
+                .format(', '.join(FIELDS), ', '.join(MODES))}
+
+    fields = [field] if field else list(FIELDS)
+    words = search_words(DBSession, value, fields, mode, limit)
+
+    return {
+        'q': value, 'fields': fields, 'mode': mode,
+        'words': [dict(zip(['id', 'lang_iso_code', 'concept_id', 'ortho_form',
+            'raw_ipa', 'norm_ipa'], word)) for word in words]}
+
+
+
+def includeme(config):
+    config.add_route_and_view('search_words', '/search/words', search_view,
+            renderer='json')
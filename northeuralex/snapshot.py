@@ -0,0 +1,243 @@
+import logging
+import os
+import resource
+import sqlite3
+import time
+import uuid
+
+from urllib.parse import quote
+
+from clld.db.meta import Base, DBSession
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+
+"""
+Snapshot
+
+Between the runs of initializedb the db is read-only, so the app can serve it
+from a snapshot instead of the file that sqlalchemy.url points to. There are
+two modes:
+- memory: the db is copied into an in-memory db at startup; the connections
+  share it via SQLite's shared cache, so that it is held in memory only once
+  per process;
+- mmap: the connections open the file as immutable, which skips the file
+  locking and change detection, and map all of it into memory, so that the
+  pages are shared with the other processes via the OS' page cache.
+
+Either way the connections are pooled and set to query_only. The time it
+takes to set up the snapshot and the process' resident memory before and
+after are logged; in mmap mode, the mapped pages only add to the resident
+memory once they are read. The app has to be restarted after initializedb has
+been run; in memory mode, it keeps serving the old data until then.
+
+The settings, all prefixed with northeuralex.snapshot.:
+- mode: memory, mmap, or off (the default);
+- pool_size: the number of pooled connections, 10 by default;
+- cache_size: the page cache size in KiB, 65536 by default;
+- mmap_size: the max bytes mapped in mmap mode, by default the file size.
+"""
+
+SETTINGS_PREFIX = 'northeuralex.snapshot.'
+
+MODES = ('memory', 'mmap')
+
+log = logging.getLogger(__name__)
+
+
+
+def get_resident_memory():
+    """
+    Returns the resident memory of the process in bytes or, where there is no
+    /proc, the peak resident memory.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+
+def get_db_path(url):
+    """
+    Returns the path of the SQLite db file that the given sqlalchemy url
+    points to; raises a ValueError if the url is not that of an SQLite file.
+    """
+    url = make_url(url)
+
+    if url.get_backend_name() != 'sqlite' or not url.database \
+            or url.database == ':memory:':
+        raise ValueError('the snapshot needs an sqlite file db, got {}'.format(url))
+
+    return os.path.abspath(url.database)
+
+
+
+def copy_db(path, target):
+    """
+    Copies the SQLite db at the given path into the given sqlite3 connection.
+    Where Python's sqlite3 module lacks the backup API, the schema is re-run
+    and the tables' rows copied over via an attached connection.
+    """
+    source = sqlite3.connect('file:{}?mode=ro'.format(quote(path)), uri=True)
+
+    try:
+        if hasattr(source, 'backup'):
+            source.backup(target)
+            return
+
+        schema = source.execute("SELECT type, name, sql FROM sqlite_master "
+                "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+                "ORDER BY type = 'table' DESC").fetchall()
+    finally:
+        source.close()
+
+    target.execute("ATTACH DATABASE ? AS source",
+            ('file:{}?mode=ro'.format(quote(path)),))
+
+    for kind, name, sql in schema:
+        target.execute(sql)
+        if kind == 'table':
+            target.execute('INSERT INTO main."{0}" SELECT * FROM source."{0}"'.format(name))
+
+    target.commit()
+    target.execute("DETACH DATABASE source")
+
+
+
+class Snapshot:
+    """
+    Sets up the snapshot of the db at the given path and creates its
+    connections. In memory mode, the instance holds a connection to the
+    in-memory db for as long as it lives, as SQLite drops a shared in-memory
+    db once its last connection is closed.
+    """
+
+    def __init__(self, path, mode='memory', cache_size=65536, mmap_size=None):
+        """
+        Constructor.
+        """
+        if mode not in MODES:
+            raise ValueError('unknown snapshot mode: {}'.format(mode))
+
+        self.path = path
+        self.mode = mode
+        self.size = os.path.getsize(path)
+
+        self.pragmas = [
+            ('query_only', 'ON'),
+            ('temp_store', 'MEMORY'),
+            ('cache_size', -int(cache_size))]
+
+        if mode == 'memory':
+            self.uri = 'file:northeuralex-{}?mode=memory&cache=shared'.format(uuid.uuid4().hex)
+            self.keeper = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            copy_db(path, self.keeper)
+        else:
+            self.uri = 'file:{}?mode=ro&immutable=1'.format(quote(path))
+            self.keeper = None
+            self.pragmas.append(('mmap_size', int(mmap_size or self.size)))
+
+
+    def connect(self):
+        """
+        Returns a new read-only connection to the snapshot, the pragmas being
+        set; used as the creator of the engine's pool.
+        """
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+        for name, value in self.pragmas:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+
+        return conn
+
+
+    def create_engine(self, pool_size=10):
+        """
+        Returns an engine of a pool of the given size of the snapshot's
+        connections.
+        """
+        return create_engine('sqlite://', creator=self.connect,
+                poolclass=QueuePool, pool_size=pool_size, max_overflow=0)
+
+
+    def close(self):
+        if self.keeper is not None:
+            self.keeper.close()
+            self.keeper = None
+
+
+
+"""
+The snapshot that the app serves from, so that the in-memory db lives for as
+long as the process.
+"""
+_snapshot = [None]
+
+
+def setup_snapshot(settings):
+    """
+    Sets up the snapshot configured by the given app settings, binds the
+    DBSession to its engine, and returns a dict with the mode, the seconds
+    it took, the size of the db, and the resident memory before and after.
+    Returns None if the snapshot is turned off.
+    """
+    def get(name, default=None):
+        return settings.get(SETTINGS_PREFIX + name, default)
+
+    mode = get('mode', 'off')
+
+    if mode == 'off':
+        return None
+
+    path = get_db_path(settings['sqlalchemy.url'])
+    mmap_size = get('mmap_size')
+
+    memory_before = get_resident_memory()
+    start = time.perf_counter()
+
+    snapshot = Snapshot(path, mode,
+            cache_size=int(get('cache_size', 65536)),
+            mmap_size=int(mmap_size) if mmap_size else None)
+
+    engine = snapshot.create_engine(int(get('pool_size', 10)))
+    with engine.connect() as conn:
+        conn.execute('SELECT count(*) FROM sqlite_master').scalar()
+
+    if _snapshot[0] is not None:
+        _snapshot[0].close()
+    _snapshot[0] = snapshot
+
+    DBSession.remove()
+    DBSession.configure(bind=engine)
+    Base.metadata.bind = engine
+
+    stats = {
+        'mode': mode,
+        'seconds': time.perf_counter() - start,
+        'db_bytes': snapshot.size,
+        'memory_before': memory_before,
+        'memory_after': get_resident_memory()}
+
+    log.info('snapshot ({mode}) of {mib:.1f} MiB set up in {seconds:.2f}s; '
+            'resident memory {before:.1f} MiB -> {after:.1f} MiB'.format(
+                mode=mode, seconds=stats['seconds'],
+                mib=stats['db_bytes'] / 2**20,
+                before=stats['memory_before'] / 2**20,
+                after=stats['memory_after'] / 2**20))
+
+    return stats
+
+
+
+def includeme(config):
+    """
+    Replaces the engine that clld.web.app has bound the DBSession to with that
+    of the snapshot, if the latter is turned on. Has to be included before
+    the modules that use the engine, e.g. metrics.
+    """
+    config.registry.snapshot_stats = setup_snapshot(config.registry.settings)
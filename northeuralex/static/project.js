@@ -1 +1,17 @@
+/**
+ * The GeoJSON layers served by the app carry the names of the marker icons
+ * instead of their URLs (see the adapters module); these are resolved here.
+ */
+(function() {
+	var baseIcon = CLLD.MapIcons.base;
 
+	CLLD.MapIcons.base = function(feature, size, url) {
+		var icon = feature.properties.icon;
+
+		if (url === undefined && icon && icon.indexOf('/') === -1) {
+			url = CLLD.url('/clld-static/icons/' + icon + '.png');
+		}
+
+		return baseIcon(feature, size, url);
+	};
+})();
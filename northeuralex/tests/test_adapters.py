@@ -0,0 +1,234 @@
+import gzip
+import hashlib
+import json
+import os.path
+import tempfile
+import types
+import unittest
+
+from clld.db.meta import DBSession
+from clld.tests.util import WithDbMixin
+
+from clldutils.path import Path
+
+from pyramid.request import Request
+
+from sqlalchemy import event
+
+from northeuralex.adapters import (
+        WordsColumnarAdapter, WordsCsvAdapter, WordsExcelAdapter,
+        WordsJsonAdapter, WordsNdjsonAdapter, ExportTable,
+        GEOJSON_CACHE, GeoJsonConcept, GeoJsonDoculects,
+        write_downloads, write_geojson)
+from northeuralex.columnar import ColumnarFile
+from northeuralex.models import Doculect
+from northeuralex.scripts.initializedb import (
+        LangDataset, ConceptDataset, MainDataset,
+        add_concepts, add_doculects, add_words)
+
+
+
+FIXTURES_DIR = 'northeuralex/tests/fixtures'
+
+
+
+class WordsTable:
+    """
+    Stands in for a WordsDataTable, i.e. the ctx the adapters are invoked with.
+    """
+
+    def __init__(self, language=None, parameter=None):
+        self.language = language
+        self.parameter = parameter
+        self.cols = []
+
+    def __unicode__(self):
+        return 'Words'
+
+
+
+class WordsAdaptersTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.concepts = add_concepts(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')), DBSession)
+        doculects = add_doculects(LangDataset(
+            os.path.join(FIXTURES_DIR, 'lang_data.tsv')), DBSession)
+
+        words = [word for word in MainDataset(
+            os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words()
+            if word.concept in self.concepts]
+        add_words(types.SimpleNamespace(gen_words=lambda: iter(words)),
+                DBSession, self.concepts, doculects)
+
+        DBSession.flush()
+        DBSession.expunge_all()
+
+        self.req = types.SimpleNamespace(params={})
+
+        self.statements = []
+        event.listen(DBSession.get_bind(), 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        event.remove(DBSession.get_bind(), 'before_cursor_execute', self.count)
+        super().tearDown()
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def count_statements(self, adapter, ctx):
+        del self.statements[:]
+        adapter.render(ctx, self.req)
+        return len(self.statements)
+
+    def test_statements_per_download(self):
+        concept = self.concepts['Auge::N']
+
+        for adapter_cls in [WordsCsvAdapter, WordsExcelAdapter,
+                WordsJsonAdapter, WordsNdjsonAdapter, WordsColumnarAdapter]:
+            adapter = adapter_cls(None)
+
+            one = self.count_statements(adapter, WordsTable(parameter=concept))
+            all_ = self.count_statements(adapter, WordsTable())
+
+            self.assertEqual(one, 1)
+            self.assertEqual(all_, one)
+
+    def test_rows(self):
+        adapter = WordsCsvAdapter(None)
+
+        res = adapter.render(WordsTable(parameter=self.concepts['Auge::N']), self.req)
+        lines = res.decode('utf-8').splitlines()
+
+        self.assertEqual(lines[0], 'lang_iso_code,concept_id,ortho_form,raw_ipa,next_step')
+        self.assertEqual(lines[1], 'gle,1,súil,sˠuːlʲ,validate')
+
+    def test_json(self):
+        ctx = WordsTable()
+        words = [list(word) for word in WordsJsonAdapter(None).get_items(ctx, self.req)]
+
+        res = WordsJsonAdapter(None).render(ctx, self.req).decode('utf-8')
+        self.assertEqual([list(row.values()) for row in json.loads(res)['rows']], words)
+
+        res = WordsNdjsonAdapter(None).render(ctx, self.req).decode('utf-8')
+        self.assertEqual([list(json.loads(line).values())
+            for line in res.splitlines()], words)
+
+    def test_columnar(self):
+        ctx = WordsTable()
+        words = [tuple('' if value is None else str(value) for value in word)
+                for word in WordsColumnarAdapter(None).get_items(ctx, self.req)]
+
+        columns = ColumnarFile(WordsColumnarAdapter(None).render(ctx, self.req))
+
+        self.assertEqual(columns.names, ['lang_iso_code', 'concept_id',
+            'ortho_form', 'raw_ipa', 'next_step'])
+        self.assertEqual(columns.rows(), words)
+        self.assertEqual(columns.dictionary('lang_iso_code').tolist(), ['gle'])
+        self.assertEqual(set(columns.codes('lang_iso_code').tolist()), {0})
+
+    def test_write_downloads(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            hashes = write_downloads(Path(temp_dir))
+
+            self.assertEqual(len(hashes), 13)
+
+            with open(os.path.join(temp_dir, 'manifest.json'), encoding='utf-8') as f:
+                self.assertEqual(json.load(f), hashes)
+
+            for filename, digest in hashes.items():
+                with open(os.path.join(temp_dir, filename), 'rb') as f:
+                    self.assertEqual(hashlib.sha1(f.read()).hexdigest(), digest)
+
+
+
+class GeoJsonAdaptersTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.concepts = add_concepts(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')), DBSession)
+        doculects = add_doculects(LangDataset(
+            os.path.join(FIXTURES_DIR, 'lang_data.tsv')), DBSession)
+
+        words = [word for word in MainDataset(
+            os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words()
+            if word.concept in self.concepts]
+        add_words(types.SimpleNamespace(gen_words=lambda: iter(words)),
+                DBSession, self.concepts, doculects)
+
+        DBSession.flush()
+        DBSession.expire_all()
+        GEOJSON_CACHE.clear()
+
+    def make_request(self, query, **headers):
+        req = Request.blank('/?' + query, headers=headers)
+        req.dataset = types.SimpleNamespace(jsondata={'data_version': '1'})
+        return req
+
+    def test_concept(self):
+        concept = self.concepts['Auge::N']
+        res = GeoJsonConcept(None).render_to_response(concept,
+                self.make_request('layer=1', **{'Accept-Encoding': 'gzip'}))
+
+        self.assertEqual(res.content_encoding, 'gzip')
+        data = json.loads(gzip.decompress(res.body).decode('utf-8'))
+
+        self.assertEqual(data['properties'], {
+            'layer': '1', 'name': concept.name, 'domain': []})
+        self.assertEqual(data['features'], [{
+            'type': 'Feature',
+            'id': 'gle',
+            'geometry': {'type': 'Point', 'coordinates': [-7.6151, 53.2186]},
+            'properties': {
+                'language': {'id': 'gle', 'name': 'Irish'},
+                'icon': 'c009900',
+                'label': 'súil'}}])
+
+        res = GeoJsonConcept(None).render_to_response(concept, self.make_request('layer=1'))
+        self.assertEqual(res.content_encoding, None)
+        self.assertEqual(json.loads(res.body.decode('utf-8')), data)
+
+        res = GeoJsonConcept(None).render_to_response(concept,
+                self.make_request('layer=1', **{'Accept-Encoding': 'gzip;q=0'}))
+        self.assertEqual(res.content_encoding, None)
+
+    def test_cache(self):
+        concept = self.concepts['Auge::N']
+        req = self.make_request('layer=1')
+
+        res = GeoJsonConcept(None).render_to_response(concept, req)
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(DBSession.get_bind(), 'before_cursor_execute', listener)
+
+        try:
+            self.assertEqual(GeoJsonConcept(None).render_to_response(
+                concept, req).body, res.body)
+        finally:
+            event.remove(DBSession.get_bind(), 'before_cursor_execute', listener)
+
+        self.assertEqual(statements, [])
+
+    def test_languages(self):
+        res = GeoJsonDoculects(None).render_to_response(
+                ExportTable(Doculect), self.make_request('layer=id'))
+        data = json.loads(res.body.decode('utf-8'))
+
+        self.assertEqual(len(data['features']), 107)
+        self.assertEqual(data['features'][0]['properties'], {
+            'language': {'id': 'fin', 'name': 'Finnish'}, 'icon': 'c0000dd'})
+
+    def test_write_geojson(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertEqual(write_geojson(Path(temp_dir)), 1 + len(self.concepts))
+
+            with open(os.path.join(temp_dir, 'parameters', '1.geojson.gz'), 'rb') as f:
+                data = json.loads(gzip.decompress(f.read()).decode('utf-8'))
+
+            self.assertEqual(data['properties']['layer'], '1')
+            self.assertEqual(len(data['features']), 1)
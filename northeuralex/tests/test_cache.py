@@ -0,0 +1,83 @@
+import unittest
+
+from northeuralex.cache import VersionedCache
+
+
+
+class VersionedCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = VersionedCache()
+        self.calls = []
+
+    def compute(self, value):
+        self.calls.append(value)
+        return value
+
+    def test_get(self):
+        self.assertEqual(self.cache.get('1', 'key', lambda: self.compute('a')), 'a')
+        self.assertEqual(self.cache.get('1', 'key', lambda: self.compute('b')), 'a')
+        self.assertEqual(self.calls, ['a'])
+
+        self.assertEqual(self.cache.get('2', 'key', lambda: self.compute('c')), 'c')
+        self.assertEqual(self.calls, ['a', 'c'])
+
+    def test_clear(self):
+        self.cache.get('1', 'key', lambda: self.compute('a'))
+        self.cache.clear()
+        self.cache.get('1', 'key', lambda: self.compute('b'))
+        self.assertEqual(self.calls, ['a', 'b'])
+
+    def test_max_size(self):
+        cache = VersionedCache(max_size=2)
+
+        cache.get('1', 'a', lambda: self.compute('a'))
+        cache.get('1', 'b', lambda: self.compute('b'))
+        cache.get('1', 'a', lambda: self.compute('a'))
+        cache.get('1', 'c', lambda: self.compute('c'))
+        cache.get('1', 'a', lambda: self.compute('a'))
+        cache.get('1', 'b', lambda: self.compute('b'))
+
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'b'])
+
+    def test_max_bytes(self):
+        cache = VersionedCache(max_bytes=5)
+
+        cache.get('1', 'a', lambda: self.compute(b'aa'))
+        cache.get('1', 'b', lambda: self.compute(b'bbb'))
+        self.assertEqual(cache.num_bytes, 5)
+
+        cache.get('1', 'c', lambda: self.compute(b'c'))
+        self.assertEqual(list(cache.data.keys()), ['b', 'c'])
+        self.assertEqual(cache.num_bytes, 4)
+
+        cache.get('1', 'd', lambda: self.compute(b'dddddd'))
+        self.assertEqual(list(cache.data.keys()), [])
+        self.assertEqual(cache.num_bytes, 0)
+
+    def test_no_version(self):
+        self.assertEqual(self.cache.get(None, 'key', lambda: self.compute('a')), 'a')
+        self.assertEqual(self.cache.get(None, 'key', lambda: self.compute('b')), 'b')
+        self.assertEqual(self.calls, ['a', 'b'])
+
+        self.cache.store(None, 'key', 'c')
+        self.assertEqual(self.cache.lookup(None, 'key'), None)
+        self.assertEqual(len(self.cache.data), 0)
+
+    def test_lookup_store(self):
+        self.assertEqual(self.cache.lookup('1', 'key'), None)
+
+        self.cache.store('1', 'key', 'a')
+        self.assertEqual(self.cache.lookup('1', 'key'), 'a')
+        self.assertEqual(self.cache.get('1', 'key', lambda: self.compute('b')), 'a')
+
+        self.assertEqual(self.cache.lookup('2', 'key', 'default'), 'default')
+        self.assertEqual(self.calls, [])
+
+    def test_update(self):
+        self.cache.update('1', 'key', lambda value: (value or ()) + ('a',))
+        self.cache.update('1', 'key', lambda value: (value or ()) + ('b',))
+        self.assertEqual(self.cache.lookup('1', 'key'), ('a', 'b'))
+
+        self.cache.update('2', 'key', lambda value: (value or ()) + ('c',))
+        self.assertEqual(self.cache.lookup('2', 'key'), ('c',))
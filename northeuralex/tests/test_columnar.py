@@ -0,0 +1,72 @@
+import os.path
+import tempfile
+import unittest
+
+from northeuralex.columnar import ALIGN, ColumnarFile, encode_columns
+
+
+
+class ColumnarTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ['lang_iso_code', 'concept_id', 'ortho_form', 'raw_ipa', 'next_step']
+        self.rows = [
+            ('gle', '1', 'súil', 'sˠuːlʲ', 'validate'),
+            ('fin', '1', 'silmä', 'silmæ', None),
+            ('gle', '2', 'cluas', '', 'validate'),
+            ('rus', 12, 'глаз', 'ɡlas', 'validate')]
+
+        self.content = encode_columns(self.names, self.rows,
+                ['lang_iso_code', 'concept_id'])
+
+    def test_round_trip(self):
+        columns = ColumnarFile(self.content)
+
+        self.assertEqual(columns.num_rows, 4)
+        self.assertEqual(columns.names, self.names)
+        self.assertEqual(columns.rows(), [tuple('' if value is None else str(value)
+            for value in row) for row in self.rows])
+
+    def test_arrays(self):
+        columns = ColumnarFile(self.content)
+
+        self.assertEqual(columns.dictionary('lang_iso_code').tolist(), ['fin', 'gle', 'rus'])
+        self.assertEqual(columns.codes('lang_iso_code').tolist(), [1, 0, 1, 2])
+        self.assertEqual(columns.codes('concept_id').dtype.str, '<u2')
+
+        ortho_forms = columns.strings('ortho_form')
+        self.assertEqual(len(ortho_forms), 4)
+        self.assertEqual(ortho_forms[3], 'глаз')
+        self.assertEqual(ortho_forms[-4], 'súil')
+        with self.assertRaises(IndexError):
+            ortho_forms[4]
+
+        for column in columns.columns.values():
+            for spec in [column.get('codes'), column.get('offsets'), column.get('data')]:
+                if spec is not None:
+                    self.assertEqual((columns.data_start + spec['offset']) % ALIGN, 0)
+
+    def test_memmap(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'values.columns')
+            with open(path, 'wb') as f:
+                f.write(self.content)
+
+            columns = ColumnarFile(path)
+            self.assertEqual(columns.values('raw_ipa'), ['sˠuːlʲ', 'silmæ', '', 'ɡlas'])
+            self.assertEqual(columns.values('concept_id'), ['1', '1', '2', '12'])
+
+            del columns
+
+    def test_empty(self):
+        columns = ColumnarFile(encode_columns(self.names, [], ['concept_id']))
+
+        self.assertEqual(columns.num_rows, 0)
+        self.assertEqual(columns.rows(), [])
+        self.assertEqual(len(columns.codes('concept_id')), 0)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            ColumnarFile(b'NOTCOLUMNS' + self.content[10:])
+        with self.assertRaises(ValueError):
+            ColumnarFile(b'')
@@ -0,0 +1,148 @@
+import os.path
+import types
+import unittest
+
+from urllib.parse import urlencode
+
+from clld.db.meta import DBSession
+from clld.tests.util import WithDbMixin
+
+from pyramid import testing
+from pyramid.request import Request
+
+from northeuralex.datatables import (
+        BOUNDARIES, COUNTS, WordsDataTable, apply_filters)
+from northeuralex.models import Word
+from northeuralex.scripts.initializedb import (
+        LangDataset, ConceptDataset, MainDataset,
+        add_concepts, add_doculects, add_words)
+
+
+
+FIXTURES_DIR = 'northeuralex/tests/fixtures'
+
+
+
+class WordsDataTableTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.config = testing.setUp()
+
+        self.concepts = add_concepts(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')), DBSession)
+        doculects = add_doculects(LangDataset(
+            os.path.join(FIXTURES_DIR, 'lang_data.tsv')), DBSession)
+
+        words = [word for word in MainDataset(
+            os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words()
+            if word.concept in self.concepts]
+        add_words(types.SimpleNamespace(gen_words=lambda: iter(words)),
+                DBSession, self.concepts, doculects)
+
+        for index, word in enumerate(DBSession.query(Word).order_by(Word.pk)):
+            if index % 3 == 0:
+                word.next_step = None
+            if index % 4 == 0:
+                word.raw_ipa = None
+
+        DBSession.flush()
+
+        COUNTS.clear()
+        BOUNDARIES.clear()
+
+    def tearDown(self):
+        testing.tearDown()
+        super().tearDown()
+
+    def make_table(self, params, **kwargs):
+        req = Request.blank('/values?' + urlencode(params))
+        req.dataset = types.SimpleNamespace(jsondata={'data_version': '1'})
+        req.registry = self.config.registry
+        req.translate = lambda s, **kw: s
+        return WordsDataTable(req, Word, **kwargs)
+
+    def get_page(self, params, offset, **kwargs):
+        """
+        Returns the pks of the page at the given offset, as served by the table.
+        """
+        dt = self.make_table(dict(params, iDisplayStart=offset), **kwargs)
+        return [word.pk for word in dt.get_query()]
+
+    def get_offset_page(self, params, offset, **kwargs):
+        """
+        Returns the pks of the page at the given offset, as selected with OFFSET.
+        """
+        dt = self.make_table(params, **kwargs)
+        query = dt.base_query(DBSession.query(Word).filter(Word.active == True))
+        query, _ = apply_filters(dt, dt.req, query)
+        query, _ = dt.apply_sorting(query)
+
+        limit = int(params['iDisplayLength'])
+        return [word.pk for word in query.order_by(Word.pk).limit(limit).offset(offset)]
+
+    def assert_pages(self, params, **kwargs):
+        """
+        Pages forward through the table, then jumps to pages between the
+        boundaries recorded and pages backward, comparing the pages with the
+        OFFSET ones.
+        """
+        limit = int(params['iDisplayLength'])
+
+        dt = self.make_table(params, **kwargs)
+        dt.get_query()
+        total = dt.count_filtered
+        self.assertTrue(total > 2 * limit)
+
+        offsets = list(range(0, total + limit, limit))
+        offsets += [offset + limit // 2 for offset in offsets[::2]] + offsets[::-1]
+
+        for offset in offsets:
+            self.assertEqual(self.get_page(params, offset, **kwargs),
+                    self.get_offset_page(params, offset, **kwargs),
+                    '{} at {}'.format(params, offset))
+
+    def test_sort_columns(self):
+        for index in range(3):
+            for direction in ['asc', 'desc']:
+                self.assert_pages({'iDisplayLength': 10, 'iSortingCols': 1,
+                    'iSortCol_0': index, 'sSortDir_0': direction})
+
+    def test_no_sorting(self):
+        self.assert_pages({'iDisplayLength': 10})
+
+    def test_filters(self):
+        for index in [0, 1]:
+            for direction in ['asc', 'desc']:
+                self.assert_pages({'iDisplayLength': 5, 'iSortingCols': 1,
+                    'iSortCol_0': index, 'sSortDir_0': direction,
+                    'sSearch_2': 'validate'})
+
+    def test_language(self):
+        language = DBSession.query(Word).first().valueset.language
+
+        for index in range(5):
+            for direction in ['asc', 'desc']:
+                self.assert_pages({'iDisplayLength': 10, 'iSortingCols': 1,
+                    'iSortCol_0': index, 'sSortDir_0': direction}, language=language)
+
+    def test_boundaries(self):
+        params = {'iDisplayLength': 10, 'iSortingCols': 1,
+                'iSortCol_0': 2, 'sSortDir_0': 'desc'}
+
+        self.get_page(params, 0)
+        self.get_page(params, 10)
+        self.assertEqual(sorted(list(BOUNDARIES.data.values())[0]), [10, 20])
+
+        query = self.make_table(dict(params, iDisplayStart=20)).get_query()
+        query.first()
+        list(query.limit(5))
+        self.assertEqual(sorted(list(BOUNDARIES.data.values())[0]), [10, 20])
+
+    def test_counts(self):
+        dt = self.make_table({'iDisplayLength': 10, 'sSearch_2': 'validate'})
+        dt.get_query()
+
+        self.assertEqual(dt.count_filtered, DBSession.query(Word)
+                .filter(Word.next_step == 'validate').count())
+        self.assertEqual(dt.filters, [(dt.cols[2].js_args['sTitle'], 'validate')])
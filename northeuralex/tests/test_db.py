@@ -0,0 +1,61 @@
+import os.path
+import tempfile
+import unittest
+
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from northeuralex.db import check_pool_size, get_server_threads, start_export
+
+
+
+INI_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+
+
+
+class DbTestCase(unittest.TestCase):
+
+    def test_server_threads(self):
+        self.assertEqual(get_server_threads(
+            os.path.join(INI_DIR, 'production.ini.template')), 8)
+        self.assertEqual(get_server_threads(
+            os.path.join(INI_DIR, 'development.ini')), 4)
+
+        self.assertIsNone(get_server_threads(None))
+        self.assertIsNone(get_server_threads(os.path.join(INI_DIR, 'nowhere.ini')))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'gunicorn.ini')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('[server:main]\nuse = egg:gunicorn#main\nworkers = 4\n')
+            self.assertIsNone(get_server_threads(path))
+
+    def test_check_pool_size(self):
+        engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=4)
+        settings = {'northeuralex.db.server_threads': '8'}
+
+        with mock.patch('northeuralex.db.DBSession') as session:
+            session.get_bind.return_value = engine
+
+            with self.assertLogs('northeuralex.db', 'WARNING'):
+                self.assertFalse(check_pool_size(settings))
+
+            settings['northeuralex.db.server_threads'] = '4'
+            self.assertTrue(check_pool_size(settings))
+            self.assertTrue(check_pool_size({}))
+
+            session.get_bind.return_value = create_engine('sqlite://')
+            self.assertTrue(check_pool_size({'northeuralex.db.server_threads': 8}))
+
+    def test_start_export(self):
+        query = mock.Mock()
+        query.session.connection.return_value.dialect.name = 'sqlite'
+        self.assertIs(start_export(query), query)
+        self.assertFalse(query.session.connection.return_value.execute.called)
+
+        query.session.connection.return_value.dialect.name = 'postgresql'
+        start_export(query)
+        query.session.connection.return_value.execute.assert_called_with(
+                'SET LOCAL cursor_tuple_fraction = 1.0')
@@ -0,0 +1,152 @@
+import itertools
+import os.path
+import tempfile
+import types
+import unittest
+
+import numpy as np
+
+from clld.db.meta import DBSession
+from clld.tests.util import WithDbMixin
+
+from northeuralex.distances import (
+        Forms, compute_distances, edit_distances, get_distance_matrix, segment_ipa)
+from northeuralex.scripts.distance_matrix import build_matrix, write_matrix
+from northeuralex.scripts.initializedb import (
+        LangDataset, ConceptDataset, MainDataset,
+        add_concepts, add_doculects, add_words)
+
+
+
+FIXTURES_DIR = 'northeuralex/tests/fixtures'
+
+
+
+def levenshtein(a, b):
+    """
+    The textbook version, for comparison.
+    """
+    prev = list(range(len(b) + 1))
+
+    for i, x in enumerate(a, 1):
+        cur = [i]
+        for j, y in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j-1] + 1, prev[j-1] + (x != y)))
+        prev = cur
+
+    return prev[-1]
+
+
+
+def make_words():
+    """
+    Returns the fixture words, which are all Irish, plus made-up words of two
+    other doculects: the reversed forms of two thirds and of a half of the
+    Irish words, respectively.
+    """
+    words = list(MainDataset(os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words())
+
+    return words \
+        + [word._replace(iso_code='fin', norm_ipa=word.norm_ipa[::-1])
+            for index, word in enumerate(words) if index % 3] \
+        + [word._replace(iso_code='krl', norm_ipa=word.norm_ipa[::-1])
+            for index, word in enumerate(words) if index % 2]
+
+
+
+class DistancesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.words = make_words()
+        self.forms = Forms((word.iso_code, word.concept, word.norm_ipa)
+                for word in self.words)
+
+    def test_segment_ipa(self):
+        self.assertEqual(segment_ipa('sˠuːlʲ'), ['sˠ', 'uː', 'lʲ'])
+        self.assertEqual(segment_ipa('t͡ʃaj'), ['t͡ʃ', 'a', 'j'])
+        self.assertEqual(segment_ipa(''), [])
+
+    def test_edit_distances(self):
+        pairs = [('kitten', 'sitting'), ('', 'abc'), ('abc', ''), ('abc', 'abc'),
+                ('flaw', 'lawn'), ('a', 'b')]
+
+        def encode(strings):
+            codes = np.zeros((len(strings), 7), dtype=np.int16)
+            for index, string in enumerate(strings):
+                codes[index, :len(string)] = [ord(char) for char in string]
+            return codes, np.array([len(string) for string in strings], dtype=np.int16)
+
+        codes_a, lengths_a = encode([a for a, b in pairs])
+        codes_b, lengths_b = encode([b for a, b in pairs])
+
+        self.assertEqual(list(edit_distances(codes_a, lengths_a, codes_b, lengths_b)),
+                [levenshtein(a, b) for a, b in pairs])
+
+    def test_compute_distances(self):
+        segments = {}
+        for word in self.words:
+            segments.setdefault(word.iso_code, {}).setdefault(
+                    word.concept, segment_ipa(word.norm_ipa))
+
+        pairs = list(itertools.combinations(sorted(segments), 2))
+        results = compute_distances(self.forms, pairs, batch_size=50)
+
+        for a, b in pairs:
+            shared = [concept for concept in segments[a]
+                    if segments[a][concept] and segments[b].get(concept)]
+            expected = sum(levenshtein(segments[a][concept], segments[b][concept])
+                    / max(len(segments[a][concept]), len(segments[b][concept]))
+                    for concept in shared) / len(shared)
+
+            self.assertAlmostEqual(results[(a, b)][0], expected)
+            self.assertEqual(results[(a, b)][1], len(shared))
+
+
+    def test_build_matrix(self):
+        doculect_ids, distances, shared = build_matrix(self.forms, workers=2, chunk_size=1)
+        self.assertEqual(doculect_ids, ['fin', 'gle', 'krl'])
+
+        results = compute_distances(self.forms,
+                list(itertools.combinations(doculect_ids, 2)))
+
+        for (a, b), (distance, num_shared) in results.items():
+            index_a, index_b = doculect_ids.index(a), doculect_ids.index(b)
+            self.assertAlmostEqual(distances[index_a, index_b], distance, places=5)
+            self.assertEqual(distances[index_b, index_a], distances[index_a, index_b])
+            self.assertEqual(shared[index_a, index_b], num_shared)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            npy_path, tsv_path = write_matrix(doculect_ids, distances, temp_dir)
+
+            self.assertTrue(np.array_equal(np.load(npy_path, mmap_mode='r'), distances))
+            with open(tsv_path, encoding='utf-8') as f:
+                self.assertEqual(f.readline(), '\tfin\tgle\tkrl\n')
+
+
+
+class DistanceMatrixTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        concepts = add_concepts(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')), DBSession)
+        doculects = add_doculects(LangDataset(
+            os.path.join(FIXTURES_DIR, 'lang_data.tsv')), DBSession)
+        words = [word for word in make_words() if word.concept in concepts]
+        add_words(types.SimpleNamespace(gen_words=lambda: iter(words)),
+                DBSession, concepts, doculects)
+
+        self.req = types.SimpleNamespace(dataset=None)
+
+    def test_matrix(self):
+        doculect_ids = ['fin', 'gle', 'krl']
+        distances, shared = get_distance_matrix(self.req, doculect_ids)
+
+        self.assertEqual(len(distances), len(doculect_ids))
+        for index, row in enumerate(distances):
+            self.assertEqual(row[index], 0.0)
+            self.assertEqual(row, [line[index] for line in distances])
+            self.assertTrue(all(0 <= value <= 1 for value in row))
+
+        self.assertEqual(get_distance_matrix(self.req, doculect_ids), (distances, shared))
@@ -1,8 +1,35 @@
+import csv
+import io
+import json
+import os.path
+import tempfile
+import types
+import unittest
+
+from unittest import mock
+
 from clldutils.path import Path
+from clld.db.meta import Base, DBSession
 from clld.tests.util import TestWithApp
 
+from pyramid.request import Request
+
+from sqlalchemy import create_engine, event
+
+import transaction
+
 import northeuralex
 
+from northeuralex.models import Word
+from northeuralex.scripts.initializedb import (
+        LangDataset, ConceptDataset, MainDataset,
+        add_meta_data, add_concepts, add_doculects, add_words)
+
+
+
+FIXTURES_DIR = 'northeuralex/tests/fixtures'
+
+
 
 class Tests(TestWithApp):
     __cfg__ = Path(northeuralex.__file__).parent.joinpath('..', 'development.ini').resolve()
@@ -10,3 +37,126 @@ class Tests(TestWithApp):
 
     def test_home(self):
         res = self.app.get('/', status=200)
+        self.assertEqual(res.content_type, 'text/html')
+
+
+
+class Synch:
+    """
+    Transaction synchroniser recording the transactions that the thread's
+    transaction manager completes, i.e. commits or aborts.
+    """
+
+    def __init__(self):
+        self.completed = []
+
+    def newTransaction(self, txn):
+        pass
+
+    def beforeCompletion(self, txn):
+        pass
+
+    def afterCompletion(self, txn):
+        self.completed.append(txn)
+
+
+
+class StreamingTests(unittest.TestCase):
+    """
+    Drives the words downloads through the whole app, pyramid_tm included,
+    against a db populated with the fixtures.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        url = 'sqlite:///' + os.path.join(self.temp_dir.name, 'db.sqlite')
+
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+
+        DBSession.remove()
+        DBSession.configure(bind=engine)
+
+        with transaction.manager:
+            add_meta_data(DBSession)
+            concepts = add_concepts(ConceptDataset(
+                os.path.join(FIXTURES_DIR, 'concept_data.tsv')), DBSession)
+            doculects = add_doculects(LangDataset(
+                os.path.join(FIXTURES_DIR, 'lang_data.tsv')), DBSession)
+
+            words = [word for word in MainDataset(
+                os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words()
+                if word.concept in concepts]
+            add_words(types.SimpleNamespace(gen_words=lambda: iter(words)),
+                    DBSession, concepts, doculects)
+
+        self.num_words = DBSession.query(Word).count()
+        transaction.abort()
+        DBSession.remove()
+        engine.dispose()
+
+        self.app = northeuralex.main({}, **{
+            'sqlalchemy.url': url,
+            'pyramid.includes': 'pyramid_tm',
+            'northeuralex.response_cache.backend': 'none'})
+
+        self.connections = []
+        event.listen(DBSession.get_bind(), 'checkout', self.on_checkout)
+        event.listen(DBSession.get_bind(), 'checkin', self.on_checkin)
+
+        self.synch = Synch()
+        transaction.manager.registerSynch(self.synch)
+
+        patcher = mock.patch('northeuralex.adapters.YIELD_PER', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        transaction.manager.unregisterSynch(self.synch)
+        transaction.abort()
+
+        engine = DBSession.get_bind()
+        DBSession.remove()
+        engine.dispose()
+
+        self.temp_dir.cleanup()
+
+    def on_checkout(self, dbapi_conn, conn_record, conn_proxy):
+        self.connections.append('checkout')
+
+    def on_checkin(self, dbapi_conn, conn_record):
+        self.connections.append('checkin')
+
+    def assert_streamed(self, path):
+        """
+        Checks that the download at the given path is sent in chunks as the
+        rows are fetched, after the request's transaction has been committed,
+        and that the transaction and connection used for the fetching are
+        done with once the download is complete. Returns the download.
+        """
+        status, headers, app_iter = Request.blank(path).call_application(self.app)
+
+        self.assertEqual(status, '200 OK')
+        self.assertNotIn('Content-Length', dict(headers))
+        self.assertNotIsInstance(app_iter, (list, tuple, bytes))
+        self.assertEqual(len(self.synch.completed), 1)
+
+        chunks = list(app_iter)
+
+        self.assertTrue(len(chunks) > self.num_words // 10)
+        self.assertEqual(len(self.synch.completed), 2)
+        self.assertEqual(self.connections.count('checkout'),
+                self.connections.count('checkin'))
+
+        return b''.join(chunks).decode('utf-8')
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.assert_streamed('/values.csv'))))
+
+        self.assertEqual(rows[0], ['lang_iso_code', 'concept_id',
+            'ortho_form', 'raw_ipa', 'next_step'])
+        self.assertEqual(len(rows), self.num_words + 1)
+
+    def test_json(self):
+        data = json.loads(self.assert_streamed('/values.json'))
+        self.assertEqual(len(data['rows']), self.num_words)
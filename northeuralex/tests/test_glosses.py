@@ -0,0 +1,43 @@
+import os.path
+import unittest
+
+from northeuralex.glosses import GlossIndex, normalise, tokenise
+from northeuralex.scripts.initializedb import ConceptDataset
+
+
+
+FIXTURES_DIR = 'northeuralex/tests/fixtures'
+
+
+
+class GlossIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.concepts = list(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')).gen_concepts())
+        self.index = GlossIndex(self.concepts)
+
+    def test_normalise(self):
+        self.assertEqual(normalise('Äußere'), 'aussere')
+        self.assertEqual(normalise('Ёж'), 'еж')
+        self.assertEqual(normalise('ЙОД'), 'йод')
+        self.assertEqual(tokenise('nose [[anatomy]]'), ['nose', 'anatomy'])
+
+    def test_search(self):
+        self.assertEqual(len(self.index), len(self.concepts))
+        self.assertEqual(self.index.search('eye', ['english']), ['Auge::N'])
+        self.assertEqual(self.index.search('ГЛА', ['russian']), ['Auge::N'])
+        self.assertEqual(self.index.search('auge'), ['Auge::N'])
+        self.assertEqual(self.index.search('auge', ['english']), [])
+        self.assertEqual(self.index.search(' '), [])
+
+    def test_prefix(self):
+        expected = [concept.id for concept in self.concepts
+                if any(token.startswith('to') for token in tokenise(concept.english))]
+        self.assertTrue(expected)
+        self.assertEqual(sorted(self.index.search('To', ['english'])), sorted(expected))
+        self.assertEqual(len(self.index.search('to', ['english'], limit=1)), 1)
+
+    def test_exact_first(self):
+        results = self.index.search('ear', ['english'])
+        self.assertEqual(results[0], 'Ohr::N')
@@ -1,7 +1,16 @@
 import os.path
+import tempfile
+import types
 import unittest
 
-from northeuralex.scripts.initializedb import LangDataset, ConceptDataset, MainDataset
+from clld.db.meta import DBSession
+from clld.tests.util import WithDbMixin
+
+from northeuralex.models import Concept, Synset, Word
+from northeuralex.scripts.initializedb import (
+        LangDataset, ConceptDataset, MainDataset,
+        add_concepts, add_doculects, add_words, bulk_add_words, read_columns,
+        run_pipeline, sync_db)
 
 
 
@@ -27,6 +36,13 @@ class LangDatasetTestCase(unittest.TestCase):
         self.assertEqual(langs[-4], LangDataset.Language._make([
             'Chechen', 'che', 'chec1245', 'Nakh-Daghestanian', 'Nakh', '43.5', '45.5']))
 
+    def test_load_columns(self):
+        columns = self.dataset.load_columns()
+
+        self.assertEqual(list(columns.keys()), list(LangDataset.Language._fields))
+        self.assertEqual(set(map(len, columns.values())), {107})
+        self.assertEqual(columns['iso_code'][:3], ['fin', 'krl', 'olo'])
+
 
 
 class ConceptDatasetTestCase(unittest.TestCase):
@@ -38,6 +54,11 @@ class ConceptDatasetTestCase(unittest.TestCase):
         self.assertEqual(self.dataset.extract_german('Auge::N'), 'Auge')
         self.assertEqual(self.dataset.extract_german('Kiefer[Baum]::N'), 'Kiefer[Baum]')
 
+    def test_make_gloss_column(self):
+        self.assertEqual(self.dataset.make_gloss_column(
+            ['eye', 'ear', 'nose'], ['[[anatomy]]', '[]', '']),
+            ['eye [[anatomy]]', 'ear', 'nose'])
+
     def test_gen_concepts(self):
         concepts = []
 
@@ -80,3 +101,209 @@ class MainDatasetTestCase(unittest.TestCase):
             'gle', 'iris1253', 'Auge::N', 'súil', 'sˠuːlʲ', 'sˠuulʲ', 'validate']))
         self.assertEqual(words[735], MainDataset.Word._make([
             'gle', 'iris1253', 'allein::ADV', 'i d\'aonar', 'ɪd̪ˠiːn̪ˠəɾˠ', 'ɪdˠiinˠəɾˠ', 'validate']))
+
+    def test_load_columns(self):
+        columns = self.dataset.load_columns()
+
+        self.assertEqual(list(columns.keys()), list(MainDataset.Word._fields))
+        self.assertEqual(set(map(len, columns.values())), {1278})
+        self.assertEqual(columns['norm_ipa'][:2], ['sˠuulʲ', 'klˠʊəsˠ'])
+
+    def test_gen_word_batches(self):
+        batches = list(self.dataset.gen_word_batches(500))
+
+        self.assertEqual(list(map(len, batches)), [500, 500, 278])
+        self.assertEqual([word for batch in batches for word in batch],
+                list(self.dataset.gen_words()))
+
+    def test_read_columns(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'main_data.tsv')
+
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('Language_ID\tConcept_ID\r\n')
+            self.assertEqual(read_columns(path, MainDataset.MainDatasetDialect),
+                    {'Language_ID': [], 'Concept_ID': []})
+
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('gle\t1\r\n\r\nfin\t2\r\n\r\n')
+            self.assertEqual(read_columns(path, MainDataset.MainDatasetDialect),
+                    {'Language_ID': ['gle', 'fin'], 'Concept_ID': ['1', '2']})
+
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('gle\r\n')
+            with self.assertRaisesRegex(ValueError, 'line 6 has 1 fields'):
+                read_columns(path, MainDataset.MainDatasetDialect)
+
+
+
+class AddWordsTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.concepts = add_concepts(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')), DBSession)
+        self.doculects = add_doculects(LangDataset(
+            os.path.join(FIXTURES_DIR, 'lang_data.tsv')), DBSession)
+
+        words = [word for word in MainDataset(
+            os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words()
+            if word.concept in self.concepts]
+        self.dataset = types.SimpleNamespace(gen_words=lambda: iter(words))
+
+    def dump_tables(self):
+        tables = [Synset.__mapper__.inherits.local_table, Synset.__table__,
+                Word.__mapper__.inherits.local_table, Word.__table__]
+
+        dump = {}
+        for table in tables:
+            cols = [col for col in table.c if col.name not in ('created', 'updated')]
+            dump[table.name] = DBSession.execute(
+                table.select().with_only_columns(cols).order_by(table.c.pk)).fetchall()
+
+        return dump
+
+    def test_bulk_add_words(self):
+        add_words(self.dataset, DBSession, self.concepts, self.doculects)
+        DBSession.flush()
+
+        expected = self.dump_tables()
+
+        for table in ['word', 'value', 'synset', 'valueset']:
+            DBSession.execute('DELETE FROM {}'.format(table))
+
+        stats = bulk_add_words(self.dataset, DBSession,
+                self.concepts, self.doculects, batch_size=100)
+
+        self.assertEqual(self.dump_tables(), expected)
+
+        for table, rows in expected.items():
+            self.assertEqual(stats[table][0], len(rows))
+
+
+
+class SyncDbTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.concepts = list(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')).gen_concepts())
+        self.langs = LangDataset(os.path.join(FIXTURES_DIR, 'lang_data.tsv'))
+
+        concept_ids = set(concept.id for concept in self.concepts)
+        self.words = [word for word in MainDataset(
+            os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words()
+            if word.concept in concept_ids]
+
+        concepts = add_concepts(self.make_dataset(self.concepts[:-1]), DBSession)
+        doculects = add_doculects(self.langs, DBSession)
+        add_words(self.make_dataset([word for index, word in enumerate(self.words)
+            if word.concept in concepts and index != 5]),
+            DBSession, concepts, doculects)
+        DBSession.flush()
+        DBSession.expire_all()
+
+    def make_dataset(self, items):
+        return types.SimpleNamespace(
+                gen_concepts=lambda: iter(items), gen_words=lambda: iter(items))
+
+    def dump_words(self):
+        return sorted((word.id, word.name, word.raw_ipa, word.norm_ipa,
+            word.next_step, word.valueset.id, word.language_pk, word.parameter_pk)
+            for word in DBSession.query(Word))
+
+    def test_sync_db(self):
+        concepts = [self.concepts[0]._replace(english='eye')] + self.concepts[1:]
+        words = [self.words[0]._replace(next_step='review')] + \
+                [word for word in self.words[1:] if word.concept != 'Ohr::N']
+
+        stats = sync_db(self.make_dataset(words), self.langs,
+                self.make_dataset(concepts), DBSession)
+
+        self.assertEqual(stats['concept'], (1, 1, 0))
+        self.assertEqual(stats['doculect'], (0, 0, 0))
+        self.assertEqual(stats['word'], (
+            1 + len([word for word in words if word.concept == 'Leber::N']), 1,
+            len([word for word in self.words if word.concept == 'Ohr::N'])))
+
+        self.assertEqual(DBSession.query(Concept).count(), 48)
+        self.assertEqual(DBSession.query(Synset).count(),
+                len(set((word.iso_code, word.concept) for word in words)))
+
+        self.assertEqual([(word_id, next_step) for word_id, _, _, _, next_step, _, _, _
+            in self.dump_words()], sorted(('{}-{}-{}'.format(
+                word.iso_code, word.concept, word.form), word.next_step) for word in words))
+
+        for word_id, _, _, _, _, synset_id, language_pk, parameter_pk in self.dump_words():
+            synset = DBSession.query(Synset).filter(Synset.id == synset_id).one()
+            self.assertEqual((language_pk, parameter_pk),
+                    (synset.language_pk, synset.parameter_pk))
+
+        dump = self.dump_words()
+        stats = sync_db(self.make_dataset(words), self.langs,
+                self.make_dataset(concepts), DBSession)
+
+        self.assertFalse(any(map(any, stats.values())))
+        self.assertEqual(self.dump_words(), dump)
+
+
+
+class PipelineTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+        concept_ids = set(concept.id for concept in ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')).gen_concepts())
+
+        with open(os.path.join(FIXTURES_DIR, 'main_data.tsv'), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        lines = lines[:1] + [line for line in lines[1:]
+                if line and line.split('\t')[2] in concept_ids]
+
+        self.args = types.SimpleNamespace(
+                main_data=os.path.join(self.temp_dir.name, 'main_data.tsv'),
+                lang_data=os.path.join(FIXTURES_DIR, 'lang_data.tsv'),
+                concept_data=os.path.join(FIXTURES_DIR, 'concept_data.tsv'),
+                sources_data=os.path.join(self.temp_dir.name, 'sources.bib'),
+                bulk=False)
+
+        with open(self.args.main_data, 'w', encoding='utf-8') as f:
+            f.write('\r\n'.join(lines) + '\r\n')
+        with open(self.args.sources_data, 'w', encoding='utf-8') as f:
+            f.write('@book{gle_source, author={Author}, title={Title}, year={2000}}\n')
+
+        self.num_words = len(lines) - 1
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def test_run_pipeline(self):
+        stats, timer = run_pipeline(self.args, DBSession, batch_size=100, queue_size=2)
+
+        self.assertIsNone(stats)
+        self.assertEqual(DBSession.query(Word).count(), self.num_words)
+        self.assertEqual(DBSession.query(Concept).count(), 48)
+
+        for stage in ['parse words', 'parse sources', 'write sources',
+                'write concepts', 'write doculects', 'write words']:
+            self.assertIn(stage, timer.stages)
+
+    def test_run_pipeline_bulk(self):
+        self.args.bulk = True
+        stats, timer = run_pipeline(self.args, DBSession, batch_size=100, queue_size=2)
+
+        self.assertEqual(stats['word'][0], self.num_words)
+        self.assertEqual(DBSession.query(Word).count(), self.num_words)
+
+    def test_failing_parser(self):
+        with open(self.args.main_data, 'a', encoding='utf-8') as f:
+            f.write('gle\r\n')
+
+        with self.assertRaises(ValueError):
+            run_pipeline(self.args, DBSession, batch_size=100, queue_size=2)
@@ -0,0 +1,84 @@
+import os.path
+import types
+import unittest
+
+from clld.db.meta import DBSession
+from clld.tests.util import WithDbMixin
+
+from sqlalchemy import event
+
+from northeuralex import (
+        FAMILY_ICONS, ICON_URLS, SYNSET_FAMILIES, get_map_marker)
+from northeuralex.models import Doculect, Synset
+from northeuralex.scripts.initializedb import (
+        LangDataset, ConceptDataset, MainDataset,
+        add_concepts, add_doculects, add_words)
+
+
+
+FIXTURES_DIR = 'northeuralex/tests/fixtures'
+
+
+
+class GetMapMarkerTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        concepts = add_concepts(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')), DBSession)
+        doculects = add_doculects(LangDataset(
+            os.path.join(FIXTURES_DIR, 'lang_data.tsv')), DBSession)
+
+        words = [word for word in MainDataset(
+            os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words()
+            if word.concept in concepts]
+        add_words(types.SimpleNamespace(gen_words=lambda: iter(words)),
+                DBSession, concepts, doculects)
+
+        DBSession.flush()
+        DBSession.expunge_all()
+
+        ICON_URLS.clear()
+        SYNSET_FAMILIES.clear()
+
+        self.urls = []
+        self.req = types.SimpleNamespace(
+                dataset=types.SimpleNamespace(jsondata={'data_version': '1'}),
+                application_url='http://localhost', static_url=self.static_url)
+
+        self.statements = []
+        event.listen(DBSession.get_bind(), 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        event.remove(DBSession.get_bind(), 'before_cursor_execute', self.count)
+        super().tearDown()
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def static_url(self, path):
+        self.urls.append(path)
+        return 'http://localhost/' + path
+
+    def test_doculect(self):
+        doculect = DBSession.query(Doculect).filter(Doculect.iso_code == 'gle').one()
+
+        self.assertEqual(get_map_marker(doculect, self.req),
+                FAMILY_ICONS['Indo-European'].url(self.req))
+
+    def test_synsets(self):
+        synsets = DBSession.query(Synset).all()
+
+        markers = [get_map_marker(synset, self.req) for synset in synsets]
+        self.assertEqual(set(markers), {FAMILY_ICONS['Indo-European'].url(self.req)})
+
+        del self.statements[:]
+        del self.urls[:]
+
+        DBSession.expunge_all()
+        synsets = DBSession.query(Synset).all()
+        self.assertEqual([get_map_marker(synset, self.req) for synset in synsets], markers)
+
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(self.urls, [])
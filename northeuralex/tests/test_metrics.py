@@ -0,0 +1,123 @@
+import unittest
+
+from pyramid import testing
+from pyramid.request import Request
+from pyramid.response import Response
+
+from sqlalchemy import create_engine
+
+from northeuralex.metrics import (
+        METRICS, Histogram, Metrics, format_labels, instrument_engine,
+        metrics_tween_factory, timed_render)
+
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = Histogram([1, 0.1, 10])
+        for value in [0.05, 0.1, 0.5, 5, 50]:
+            histogram.observe(value)
+
+        counts, total = histogram.get_state()
+        self.assertEqual(histogram.buckets, (0.1, 1, 10))
+        self.assertEqual(counts, [2, 3, 4, 5])
+        self.assertAlmostEqual(total, 55.65)
+
+    def test_format_labels(self):
+        self.assertEqual(format_labels(()), '')
+        self.assertEqual(format_labels((('route', 'a"b\\c\n'), ('le', '+Inf'))),
+                '{route="a\\"b\\\\c\\n",le="+Inf"}')
+
+    def test_render(self):
+        metrics = Metrics()
+        metrics.add_histogram('test_seconds', 'Test.', [0.5, 1])
+        metrics.add_counter('test_total', 'Test.')
+
+        metrics.observe('test_seconds', 0.75, route='language')
+        metrics.inc('test_total')
+        metrics.inc('test_total', 2)
+
+        self.assertEqual(metrics.render().split('\n'), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{route="language",le="0.5"} 0',
+            'test_seconds_bucket{route="language",le="1"} 1',
+            'test_seconds_bucket{route="language",le="+Inf"} 1',
+            'test_seconds_sum{route="language"} 0.75',
+            'test_seconds_count{route="language"} 1',
+            '# HELP test_total Test.',
+            '# TYPE test_total counter',
+            'test_total 3',
+            ''])
+
+
+
+class TweenTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route('language', '/languages/{id}')
+        self.config.commit()
+
+        self.engine = create_engine('sqlite://')
+        instrument_engine(self.engine, slow_query_threshold=0)
+
+        METRICS.clear()
+
+    def tearDown(self):
+        instrument_engine(self.engine)
+        METRICS.clear()
+        testing.tearDown()
+
+    def get(self, path, handler):
+        req = Request.blank(path)
+        req.registry = self.config.registry
+        return metrics_tween_factory(handler, self.config.registry)(req)
+
+    def get_sample(self, name):
+        for line in METRICS.render().split('\n'):
+            if line.startswith(name + ' '):
+                return float(line.split()[-1])
+
+    def test_request(self):
+        def handler(req):
+            with self.engine.connect() as conn:
+                conn.execute('SELECT 1')
+                conn.execute('SELECT 2')
+            return Response('ok')
+
+        with self.assertLogs('northeuralex.metrics', 'WARNING') as logs:
+            self.get('/languages/fin', handler)
+            self.get('/nowhere', handler)
+
+        self.assertIn('/languages/fin', logs.output[0])
+        self.assertIn('SELECT 1', logs.output[0])
+
+        self.assertEqual(self.get_sample(
+            'northeuralex_request_duration_seconds_count{route="language"}'), 1)
+        self.assertEqual(self.get_sample(
+            'northeuralex_request_duration_seconds_count{route="none"}'), 1)
+        self.assertEqual(self.get_sample(
+            'northeuralex_request_sql_statements_sum{route="language"}'), 2)
+        self.assertEqual(self.get_sample('northeuralex_slow_queries_total'), 4)
+
+    def test_error(self):
+        def handler(req):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            self.get('/languages/fin', handler)
+
+        self.assertEqual(self.get_sample(
+            'northeuralex_request_sql_statements_count{route="language"}'), 1)
+
+    def test_timed_render(self):
+        class WordsCsvAdapter:
+            pass
+
+        with timed_render(WordsCsvAdapter()):
+            pass
+
+        self.assertEqual(self.get_sample(
+            'northeuralex_adapter_render_seconds_count{adapter="WordsCsvAdapter"}'), 1)
@@ -0,0 +1,121 @@
+import gzip
+import os.path
+import tempfile
+import unittest
+
+from pyramid import testing
+from pyramid.request import Request
+from pyramid.response import Response
+
+from northeuralex.precompressed import (
+        choose_encoding, compress_static, get_file_hash, get_static_path,
+        parse_accept_encoding, precompressed_tween_factory)
+
+
+
+class PrecompressedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.static_dir = self.temp_dir.name
+
+        os.mkdir(os.path.join(self.static_dir, 'downloads'))
+
+        self.css_path = os.path.join(self.static_dir, 'project.css')
+        with open(self.css_path, 'w', encoding='utf-8') as f:
+            f.write('body { color: black; }\n' * 100)
+
+        self.csv_path = os.path.join(self.static_dir, 'downloads', 'words.csv')
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write('a,b\n' * 1000)
+
+        with open(os.path.join(self.static_dir, 'small.js'), 'w') as f:
+            f.write('var a;')
+
+        self.config = testing.setUp(settings={'northeuralex.static_dir': self.static_dir})
+
+    def tearDown(self):
+        testing.tearDown()
+        self.temp_dir.cleanup()
+
+    def get(self, path, **headers):
+        tween = precompressed_tween_factory(
+                lambda req: Response('handler'), self.config.registry)
+        return tween(Request.blank(path, headers=headers))
+
+    def test_compress_static(self):
+        written = compress_static(self.static_dir)
+
+        self.assertIn(self.css_path + '.gz', written)
+        self.assertIn(self.csv_path + '.gz', written)
+        self.assertNotIn(os.path.join(self.static_dir, 'small.js.gz'), written)
+
+        with open(self.csv_path + '.gz', 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), b'a,b\n' * 1000)
+
+        self.assertEqual(compress_static(self.static_dir), [])
+
+    def test_choose_encoding(self):
+        compress_static(self.static_dir)
+
+        req = Request.blank('/', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(choose_encoding(req, self.csv_path),
+                ('gzip', self.csv_path + '.gz'))
+
+        req = Request.blank('/', headers={'Accept-Encoding': 'identity'})
+        self.assertEqual(choose_encoding(req, self.csv_path), (None, self.csv_path))
+
+        with open(self.csv_path + '.br', 'wb') as f:
+            f.write(b'br')
+
+        for header, encoding in [
+                ('gzip, br', 'br'),
+                ('br;q=0, gzip', 'gzip'),
+                ('br; q=0.5, gzip', 'gzip'),
+                ('gzip;q=0, br;q=0', None),
+                ('*', 'br'),
+                ('*, br;q=0', 'gzip'),
+                ('GZIP;Q=1', 'gzip'),
+                ('gzip;q=x', None)]:
+            req = Request.blank('/', headers={'Accept-Encoding': header})
+            self.assertEqual(choose_encoding(req, self.csv_path)[0], encoding, header)
+
+        os.utime(self.csv_path, (0, os.path.getmtime(self.csv_path) + 10))
+        req = Request.blank('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(choose_encoding(req, self.csv_path), (None, self.csv_path))
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding('br;q=0, gzip;q=0.8, deflate'),
+                {'br': 0.0, 'gzip': 0.8, 'deflate': 1.0})
+        self.assertEqual(parse_accept_encoding(''), {})
+
+    def test_get_static_path(self):
+        self.assertEqual(get_static_path(self.static_dir, '/static/project.css'),
+                os.path.realpath(self.css_path))
+        self.assertEqual(get_static_path(self.static_dir, '/static/../secret'), None)
+        self.assertEqual(get_static_path(self.static_dir, '/static/nope.css'), None)
+        self.assertEqual(get_static_path(self.static_dir, '/languages'), None)
+
+    def test_tween(self):
+        compress_static(self.static_dir)
+        file_hash = get_file_hash(os.path.realpath(self.csv_path))
+
+        res = self.get('/static/downloads/words.csv?v=' + file_hash,
+                **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.content_encoding, 'gzip')
+        self.assertEqual(res.content_type, 'text/csv')
+        self.assertEqual(res.cache_control.max_age, 365*24*60*60)
+        self.assertEqual(gzip.decompress(b''.join(res.app_iter)), b'a,b\n' * 1000)
+
+        res = self.get('/static/downloads/words.csv')
+        self.assertEqual(res.content_encoding, None)
+        self.assertTrue(res.cache_control.no_cache)
+
+        for name, content_type in [('words.ndjson', 'application/x-ndjson'),
+                ('languages.geojson', 'application/geo+json')]:
+            with open(os.path.join(self.static_dir, 'downloads', name), 'w') as f:
+                f.write('{}\n')
+            res = self.get('/static/downloads/' + name)
+            self.assertEqual(res.content_type, content_type)
+
+        self.assertEqual(self.get('/languages').body, b'handler')
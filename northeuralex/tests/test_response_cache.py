@@ -0,0 +1,190 @@
+import os
+import tempfile
+import unittest
+
+from clld.interfaces import ILanguage, IRepresentation
+
+from pyramid import testing
+from pyramid.request import Request
+from pyramid.response import Response
+
+from northeuralex.metrics import METRICS
+from northeuralex.response_cache import (
+        DiskBackend, MemoryBackend, ResponseCache, decode_entry, encode_entry)
+
+
+
+class FixedVersionCache(ResponseCache):
+    """
+    Stands in for the db lookup of the data version.
+    """
+
+    data_version = '20170101120000000000'
+
+    def get_version(self):
+        return self.data_version
+
+
+
+class Adapter:
+    """
+    Stands in for the adapters that clld registers for the resources.
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+
+
+
+class HtmlAdapter(Adapter):
+    mimetype = 'text/html'
+    extension = 'html'
+
+
+
+class JsonAdapter(Adapter):
+    mimetype = 'application/json'
+    extension = 'json'
+
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route('language', '/languages/{id}')
+        self.config.add_route('languages', '/languages')
+        for adapter_cls in [HtmlAdapter, JsonAdapter]:
+            self.config.registry.registerAdapter(adapter_cls, (ILanguage,),
+                    IRepresentation, name=adapter_cls.mimetype)
+        self.config.commit()
+
+        self.cache = FixedVersionCache(MemoryBackend())
+        self.calls = []
+
+        METRICS.clear()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def handler(self, req):
+        self.calls.append(req.path)
+        res = Response('<p>{}</p>'.format(req.path))
+        res.headers['Link'] = '<{}.json>; rel="alternate"'.format(req.path)
+        return res
+
+    def get(self, path, base_url=None, **headers):
+        req = Request.blank(path, base_url=base_url, headers=headers)
+        req.registry = self.config.registry
+        return self.cache(self.handler, req)
+
+    def test_hit(self):
+        res = self.get('/languages/fin')
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+
+        cached = self.get('/languages/fin')
+        self.assertEqual(cached.headers['X-Cache'], 'HIT')
+        self.assertEqual(cached.body, res.body)
+        self.assertEqual(cached.headers['Link'], res.headers['Link'])
+        self.assertEqual(cached.etag, res.etag)
+        self.assertEqual(cached.last_modified.year, 2017)
+        self.assertEqual(cached.cache_control.max_age, 0)
+
+        self.assertEqual(self.calls, ['/languages/fin'])
+        lines = METRICS.render().split('\n')
+        for outcome in ['hit', 'miss', 'store']:
+            self.assertIn('northeuralex_response_cache_total{{outcome="{}"}} 1'
+                    .format(outcome), lines)
+
+    def test_keys(self):
+        self.get('/languages/fin')
+        self.get('/languages/est')
+        self.get('/languages/fin?v=1')
+        self.get('/languages/fin', Accept='application/json')
+        self.get('/languages/fin', base_url='https://northeuralex.org')
+
+        self.assertEqual(len(self.calls), 5)
+
+    def test_normalised_keys(self):
+        self.get('/languages/fin?a=1&b=2')
+        self.get('/languages/fin?b=2&a=1')
+        self.get('/languages/fin?b=2&a=1&a=3')
+        self.assertEqual(len(self.calls), 1)
+
+        self.get('/languages/fin')
+        self.get('/languages/fin', Accept='*/*')
+        self.get('/languages/fin', Accept='text/html,application/xhtml+xml,*/*;q=0.8')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_not_acceptable(self):
+        self.get('/languages/fin', Accept='image/png')
+        res = self.get('/languages/fin', Accept='image/png')
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertNotIn('X-Cache', res.headers)
+
+    def test_version(self):
+        self.get('/languages/fin')
+        self.cache.data_version = '20180101120000000000'
+        self.get('/languages/fin')
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_other_routes(self):
+        self.get('/languages')
+        self.get('/languages')
+        self.get('/sources')
+
+        self.assertEqual(self.calls, ['/languages', '/languages', '/sources'])
+
+    def test_from_settings(self):
+        prefix = 'northeuralex.response_cache.'
+
+        self.assertIsInstance(ResponseCache.from_settings({}).backend, MemoryBackend)
+        self.assertIsNone(ResponseCache.from_settings({prefix + 'backend': 'none'}))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ResponseCache.from_settings({prefix + 'backend': 'disk',
+                prefix + 'directory': temp_dir, prefix + 'max_bytes': '1000'})
+            self.assertEqual(cache.backend.max_bytes, 1000)
+
+        for settings in [{prefix + 'backend': 'disk'}, {prefix + 'backend': 'redis'}]:
+            with self.assertRaises(ValueError):
+                ResponseCache.from_settings(settings)
+
+    def test_disk_backend(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            backend = DiskBackend(temp_dir)
+            self.assertEqual(backend.lookup('1', 'key'), None)
+
+            backend.store('1', 'key', b'entry')
+            self.assertEqual(backend.lookup('1', 'key'), b'entry')
+
+            backend.store('2', 'key', b'new entry')
+            self.assertEqual(backend.lookup('1', 'key'), None)
+            self.assertEqual(backend.lookup('2', 'key'), b'new entry')
+
+            backend.store(None, 'key', b'entry')
+            self.assertEqual(backend.lookup(None, 'key'), None)
+
+    def test_disk_eviction(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            backend = DiskBackend(temp_dir, max_bytes=100)
+
+            for index in range(3):
+                backend.store('1', index, b'x' * 30)
+                os.utime(backend.get_path('1', index), (index + 1, index + 1))
+
+            backend.lookup('1', 0)
+            backend.store('1', 3, b'x' * 30)
+            self.assertEqual(backend.num_bytes, ('1', 60))
+
+            self.assertEqual([backend.lookup('1', index) is not None
+                for index in range(4)], [True, False, False, True])
+
+    def test_entries(self):
+        res = Response('<p>\n</p>')
+        headers, etag, body = decode_entry(encode_entry(res))
+
+        self.assertEqual(body, res.body)
+        self.assertIn(['Content-Type', 'text/html; charset=UTF-8'], headers)
@@ -0,0 +1,136 @@
+import os.path
+import types
+import unittest
+
+from unittest import mock
+
+from clld.db.meta import DBSession
+from clld.tests.util import WithDbMixin
+
+from pyramid import testing
+
+from northeuralex.models import Word
+from northeuralex.scripts.initializedb import (
+        LangDataset, ConceptDataset, MainDataset,
+        add_concepts, add_doculects, add_words)
+from northeuralex.search import (
+        END, START, build_search_index, delete_from_search_index,
+        make_trigrams, search_view, search_words)
+
+
+
+FIXTURES_DIR = 'northeuralex/tests/fixtures'
+
+
+
+class SearchTestCase(WithDbMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        concepts = add_concepts(ConceptDataset(
+            os.path.join(FIXTURES_DIR, 'concept_data.tsv')), DBSession)
+        doculects = add_doculects(LangDataset(
+            os.path.join(FIXTURES_DIR, 'lang_data.tsv')), DBSession)
+        words = [word for word in MainDataset(
+            os.path.join(FIXTURES_DIR, 'main_data.tsv')).gen_words()
+            if word.concept in concepts]
+        add_words(types.SimpleNamespace(gen_words=lambda: iter(words)),
+                DBSession, concepts, doculects)
+
+        self.num_rows = build_search_index(DBSession)
+        self.words = DBSession.query(Word).order_by(Word.pk).all()
+
+    def expected(self, value, field, prefix=False):
+        """
+        Returns the ids of the words matching the given string, by brute force.
+        """
+        return [word.id for word in self.words if getattr(word, field) and (
+            getattr(word, field).lower().startswith(value) if prefix
+            else value in getattr(word, field).lower())]
+
+    def test_make_trigrams(self):
+        self.assertEqual(make_trigrams('Suil'),
+                {START + 'su', 'sui', 'uil', 'il' + END})
+        self.assertEqual(make_trigrams('suil', complete=False), {'sui', 'uil'})
+        self.assertEqual(make_trigrams('su', prefix=True, complete=False),
+                {START + 'su'})
+        self.assertEqual(make_trigrams('su', complete=False), set())
+
+    def test_contains(self):
+        self.assertTrue(self.num_rows)
+
+        for value in ['ʊə', 'suːl', 'ɔk', 'a', 'sˠuːlʲ']:
+            words = search_words(DBSession, value, ['raw_ipa'], limit=10000)
+            self.assertEqual([word[0] for word in words],
+                    self.expected(value, 'raw_ipa'))
+
+        words = search_words(DBSession, 'ea', limit=10000)
+        self.assertEqual([word[0] for word in words], [word.id for word in self.words
+            if any('ea' in (getattr(word, field) or '').lower()
+                for field in ['name', 'raw_ipa', 'norm_ipa'])])
+
+    def test_prefix(self):
+        for value in ['s', 'cl', 'béa']:
+            words = search_words(DBSession, value, ['name'], 'prefix', limit=10000)
+            self.assertEqual([word[0] for word in words],
+                    self.expected(value, 'name', prefix=True))
+
+    def test_case(self):
+        word = self.words[0]
+        word.name, word.raw_ipa = 'Москва', 'ˈMɔskva'
+        DBSession.flush()
+        build_search_index(DBSession, [word.pk])
+
+        for value, field, mode in [
+                ('Мос', 'name', 'contains'), ('мос', 'name', 'contains'),
+                ('МОСКВА', 'name', 'contains'), ('осКВ', 'name', 'contains'),
+                ('мо', 'name', 'prefix'), ('МОСК', 'name', 'prefix'),
+                ('ˈmƆs', 'raw_ipa', 'contains'), ('ɔSKV', 'raw_ipa', 'contains')]:
+            self.assertEqual([item[0] for item in search_words(
+                DBSession, value, [field], mode)], [word.id], value)
+
+        self.assertEqual(search_words(DBSession, 'оск', ['name'], 'prefix'), [])
+
+    def test_wildcards(self):
+        self.assertEqual(search_words(DBSession, '%', ['name']), [])
+        self.assertEqual(search_words(DBSession, 'a_c', ['name']), [])
+
+    def test_connection(self):
+        conn = DBSession.connection()
+
+        with mock.patch('northeuralex.search.mark_changed') as mark_changed:
+            self.assertEqual(build_search_index(conn), self.num_rows)
+            delete_from_search_index(conn, [self.words[0].pk])
+            self.assertFalse(mark_changed.called)
+
+            build_search_index(DBSession, [self.words[0].pk])
+            self.assertTrue(mark_changed.called)
+
+        self.assertEqual([word[0] for word in search_words(DBSession, 'sˠuːl', ['raw_ipa'])],
+                self.expected('sˠuːl', 'raw_ipa'))
+
+    def test_view(self):
+        testing.setUp()
+        self.addCleanup(testing.tearDown)
+
+        for limit, num_words in [('-1', 1), ('0', 1), ('2', 2), ('x', 100), ('5000', 1000)]:
+            req = testing.DummyRequest(params={'q': 'a', 'limit': limit})
+            with mock.patch('northeuralex.search.search_words') as search:
+                search.return_value = []
+                search_view(req)
+            self.assertEqual(search.call_args[0][4], num_words, limit)
+
+        req = testing.DummyRequest(params={'q': 'a', 'mode': 'nope'})
+        self.assertIn('error', search_view(req))
+        self.assertEqual(req.response.status_int, 400)
+
+    def test_delete(self):
+        word = self.words[0]
+        delete_from_search_index(DBSession, [word.pk])
+        self.assertNotIn(word.id, [item[0] for item in
+            search_words(DBSession, word.raw_ipa, ['raw_ipa'])])
+
+        build_search_index(DBSession, [word.pk])
+        self.assertIn(word.id, [item[0] for item in
+            search_words(DBSession, word.raw_ipa, ['raw_ipa'])])
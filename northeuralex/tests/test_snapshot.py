@@ -0,0 +1,80 @@
+import os.path
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from sqlalchemy.exc import OperationalError
+
+from northeuralex.snapshot import Snapshot, get_db_path, setup_snapshot
+
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'db.sqlite')
+
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE word (pk INTEGER PRIMARY KEY, name TEXT)')
+        conn.execute('CREATE INDEX ix_word_name ON word (name)')
+        conn.executemany('INSERT INTO word (name) VALUES (?)',
+                [('word{}'.format(index),) for index in range(1000)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def check_engine(self, snapshot):
+        engine = snapshot.create_engine(pool_size=2)
+        counts = []
+
+        def count():
+            with engine.connect() as conn:
+                counts.append(conn.execute(
+                    "SELECT count(*) FROM word WHERE name LIKE 'word1%'").scalar())
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counts, [111] * 4)
+
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute('PRAGMA query_only').scalar(), 1)
+            with self.assertRaises(OperationalError):
+                conn.execute("INSERT INTO word (name) VALUES ('word')")
+
+        return engine
+
+    def test_memory(self):
+        snapshot = Snapshot(self.path, 'memory')
+        engine = self.check_engine(snapshot)
+
+        os.remove(self.path)
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute('SELECT count(*) FROM word').scalar(), 1000)
+
+        snapshot.close()
+
+    def test_mmap(self):
+        engine = self.check_engine(Snapshot(self.path, 'mmap'))
+
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute('PRAGMA mmap_size').scalar(),
+                    os.path.getsize(self.path))
+
+    def test_settings(self):
+        self.assertIsNone(setup_snapshot({'sqlalchemy.url': 'sqlite:///' + self.path}))
+        self.assertEqual(get_db_path('sqlite:///' + self.path), self.path)
+
+        with self.assertRaises(ValueError):
+            get_db_path('postgresql://localhost/northeuralex')
+        with self.assertRaises(ValueError):
+            get_db_path('sqlite://')
+        with self.assertRaises(ValueError):
+            Snapshot(self.path, 'disk')